@@ -0,0 +1,383 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "alloc.h"
+
+/* The first slot of an arena starts after the header (keeping the 16 byte alignment) */
+#define ARENA_HEADER ((sizeof(struct arena) + ALLOC_MIN_SIZE - 1) & ~(ALLOC_MIN_SIZE - 1))
+
+#define BITS (8 * sizeof(unsigned long))
+#define GET_BIT(bitmap, i) (((bitmap)[(i) / BITS] >> ((i) % BITS)) & 1)
+#define SET_BIT(bitmap, i) ((bitmap)[(i) / BITS] |= 1UL << ((i) % BITS))
+#define CLEAR_BIT(bitmap, i) ((bitmap)[(i) / BITS] &= ~(1UL << ((i) % BITS)))
+
+struct free_block {
+  struct free_block* next;
+};
+
+struct size_class {
+  char* bump;                   /* next unused slot of the current arena */
+  char* limit;                  /* end of the current arena */
+  struct free_block* free_list;
+  struct arena* arenas;
+  /* Counters */
+  unsigned long allocations;
+  unsigned long frees;
+  unsigned long arena_count;
+};
+
+static struct size_class classes[ALLOC_NUM_CLASSES];
+
+/* Blocks bigger than ALLOC_MAX_SIZE, sorted by address */
+struct large_block {
+  char* start;
+  size_t size;
+  char marked;
+  char object;
+};
+
+static struct large_block* large_blocks;
+static unsigned int large_len;
+static unsigned int large_cap;
+
+static unsigned long large_allocations;
+static unsigned long large_frees;
+
+/* Arenas sorted by address, to tell if a pointer points into the heap */
+static struct arena** arena_table;
+static unsigned int arena_table_len;
+static unsigned int arena_table_cap;
+
+/* Bounds of the heap, to reject most non-pointers quickly */
+static char* heap_low = (char*)-1;
+static char* heap_high;
+
+/* Collection */
+static size_t allocated_since_gc;
+static size_t gc_threshold = GC_MIN_THRESHOLD;
+static size_t gc_min_threshold = GC_MIN_THRESHOLD;
+static int gc_enabled = 1;
+static int collecting;
+static unsigned long collections;
+static unsigned long collected_blocks;
+
+static int initialized;
+
+static void print_stats_at_exit(void)
+{
+  pyy_print_alloc_stats(stderr);
+}
+
+static void init(void)
+{
+  char* env;
+  initialized = 1;
+  if (getenv("PYYC_ALLOC_STATS"))
+    atexit(print_stats_at_exit);
+  if ((env = getenv("PYYC_GC")) && strcmp(env, "0") == 0)
+    gc_enabled = 0;
+  if ((env = getenv("PYYC_GC_THRESHOLD")))
+    gc_threshold = gc_min_threshold = strtoul(env, NULL, 10);
+}
+
+static int class_of(size_t size)
+{
+  int c = 0;
+  size_t slot = ALLOC_MIN_SIZE;
+  while (slot < size) {
+    slot <<= 1;
+    c++;
+  }
+  return c;
+}
+
+static void out_of_memory(void)
+{
+  printf("out of memory");
+  exit(-1);
+}
+
+static void* grow(void* array, unsigned int* cap, size_t elem_size)
+{
+  *cap = *cap ? 2 * *cap : 16;
+  array = realloc(array, elem_size * *cap);
+  if (array == NULL)
+    out_of_memory();
+  return array;
+}
+
+static void update_bounds(char* start, size_t size)
+{
+  if (start < heap_low)
+    heap_low = start;
+  if (start + size > heap_high)
+    heap_high = start + size;
+}
+
+static void add_arena(int c)
+{
+  struct size_class* sc = &classes[c];
+  struct arena* a = (struct arena*)aligned_alloc(ALLOC_ARENA_SIZE, ALLOC_ARENA_SIZE);
+  if (a == NULL)
+    out_of_memory();
+  memset(a, 0, ARENA_HEADER);
+  a->size_class = c;
+  a->slot_size = ALLOC_MIN_SIZE << c;
+  a->slots = (ALLOC_ARENA_SIZE - ARENA_HEADER) / a->slot_size;
+  a->next = sc->arenas;
+  sc->arenas = a;
+  sc->arena_count++;
+  sc->bump = (char*)a + ARENA_HEADER;
+  sc->limit = (char*)a + ALLOC_ARENA_SIZE;
+  update_bounds((char*)a, ALLOC_ARENA_SIZE);
+
+  /* Insert into the sorted arena table */
+  if (arena_table_len == arena_table_cap)
+    arena_table = grow(arena_table, &arena_table_cap, sizeof(struct arena*));
+  unsigned int i = arena_table_len++;
+  while (i > 0 && arena_table[i - 1] > a) {
+    arena_table[i] = arena_table[i - 1];
+    i--;
+  }
+  arena_table[i] = a;
+}
+
+static struct arena* arena_of(void* p)
+{
+  struct arena* a = (struct arena*)((unsigned long)p & ~(unsigned long)(ALLOC_ARENA_SIZE - 1));
+  unsigned int lo = 0, hi = arena_table_len;
+  while (lo < hi) {
+    unsigned int mid = (lo + hi) / 2;
+    if (arena_table[mid] == a)
+      return a;
+    if (arena_table[mid] < a)
+      lo = mid + 1;
+    else
+      hi = mid;
+  }
+  return NULL;
+}
+
+static unsigned int slot_of(struct arena* a, void* p)
+{
+  return ((char*)p - ((char*)a + ARENA_HEADER)) / a->slot_size;
+}
+
+/* Index of the large block containing p (or where a block starting at p would go) */
+static unsigned int large_search(void* p)
+{
+  unsigned int lo = 0, hi = large_len;
+  while (lo < hi) {
+    unsigned int mid = (lo + hi) / 2;
+    if (large_blocks[mid].start + large_blocks[mid].size <= (char*)p)
+      lo = mid + 1;
+    else
+      hi = mid;
+  }
+  return lo;
+}
+
+static void* alloc_large(size_t size, int object)
+{
+  char* p = (char*)calloc(1, size);
+  if (p == NULL)
+    out_of_memory();
+  large_allocations++;
+  update_bounds(p, size);
+  if (large_len == large_cap)
+    large_blocks = grow(large_blocks, &large_cap, sizeof(struct large_block));
+  unsigned int i = large_search(p);
+  memmove(&large_blocks[i + 1], &large_blocks[i], sizeof(struct large_block) * (large_len - i));
+  large_len++;
+  large_blocks[i].start = p;
+  large_blocks[i].size = size;
+  large_blocks[i].marked = 0;
+  large_blocks[i].object = object;
+  return p;
+}
+
+static void* alloc(size_t size, int object)
+{
+  if (!initialized)
+    init();
+  if (gc_enabled && !collecting && allocated_since_gc >= gc_threshold) {
+    collecting = 1;
+    pyy_collect();
+    collecting = 0;
+  }
+  if (size > ALLOC_MAX_SIZE) {
+    allocated_since_gc += size;
+    return alloc_large(size, object);
+  }
+  int c = class_of(size);
+  struct size_class* sc = &classes[c];
+  size_t slot = ALLOC_MIN_SIZE << c;
+  void* p;
+  sc->allocations++;
+  allocated_since_gc += slot;
+  if (sc->free_list) {
+    p = sc->free_list;
+    sc->free_list = sc->free_list->next;
+  } else {
+    if (sc->bump == NULL || sc->bump + slot > sc->limit)
+      add_arena(c);
+    p = sc->bump;
+    sc->bump += slot;
+  }
+  memset(p, 0, slot);
+  struct arena* a = arena_of(p);
+  unsigned int i = slot_of(a, p);
+  SET_BIT(a->allocated, i);
+  if (object)
+    SET_BIT(a->objects, i);
+  return p;
+}
+
+void* pyy_alloc(size_t size)
+{
+  return alloc(size, 0);
+}
+
+void* pyy_alloc_object(size_t size)
+{
+  return alloc(size, 1);
+}
+
+static void free_slot(struct arena* a, unsigned int i)
+{
+  struct size_class* sc = &classes[a->size_class];
+  struct free_block* b = (struct free_block*)((char*)a + ARENA_HEADER + i * a->slot_size);
+  CLEAR_BIT(a->allocated, i);
+  CLEAR_BIT(a->objects, i);
+  b->next = sc->free_list;
+  sc->free_list = b;
+  sc->frees++;
+}
+
+void pyy_free(void* p, size_t size)
+{
+  if (p == NULL)
+    return;
+  if (size > ALLOC_MAX_SIZE) {
+    unsigned int i = large_search(p);
+    free(large_blocks[i].start);
+    memmove(&large_blocks[i], &large_blocks[i + 1], sizeof(struct large_block) * (large_len - i - 1));
+    large_len--;
+    large_frees++;
+    return;
+  }
+  struct arena* a = arena_of(p);
+  free_slot(a, slot_of(a, p));
+}
+
+void* pyy_resize(void* p, size_t old_size, size_t new_size)
+{
+  if (p == NULL)
+    return pyy_alloc(new_size);
+  /* Still fits in the same slot */
+  if (old_size <= ALLOC_MAX_SIZE && new_size <= ALLOC_MAX_SIZE && class_of(old_size) == class_of(new_size))
+    return p;
+  /* p stays reachable from the caller's frame if this collects */
+  void* q = pyy_alloc(new_size);
+  memcpy(q, p, old_size < new_size ? old_size : new_size);
+  pyy_free(p, old_size);
+  return q;
+}
+
+void* pyy_block_of(void* p, size_t* size, int* is_object)
+{
+  if ((char*)p < heap_low || (char*)p >= heap_high)
+    return NULL;
+  struct arena* a = arena_of(p);
+  if (a != NULL) {
+    if ((char*)p < (char*)a + ARENA_HEADER)
+      return NULL;
+    unsigned int i = slot_of(a, p);
+    if (i >= a->slots || !GET_BIT(a->allocated, i))
+      return NULL;
+    *size = a->slot_size;
+    *is_object = GET_BIT(a->objects, i);
+    return (char*)a + ARENA_HEADER + i * a->slot_size;
+  }
+  unsigned int i = large_search(p);
+  if (i < large_len && large_blocks[i].start <= (char*)p) {
+    *size = large_blocks[i].size;
+    *is_object = large_blocks[i].object;
+    return large_blocks[i].start;
+  }
+  return NULL;
+}
+
+int pyy_mark_block(void* block)
+{
+  struct arena* a = arena_of(block);
+  if (a != NULL) {
+    unsigned int i = slot_of(a, block);
+    if (GET_BIT(a->marked, i))
+      return 0;
+    SET_BIT(a->marked, i);
+    return 1;
+  }
+  unsigned int i = large_search(block);
+  if (large_blocks[i].marked)
+    return 0;
+  large_blocks[i].marked = 1;
+  return 1;
+}
+
+size_t pyy_sweep(void)
+{
+  size_t live = 0;
+  int c;
+  unsigned int i, j;
+  collections++;
+  for (c = 0; c != ALLOC_NUM_CLASSES; ++c) {
+    struct arena* a;
+    for (a = classes[c].arenas; a != NULL; a = a->next) {
+      for (j = 0; j != ALLOC_BITMAP_WORDS; ++j) {
+        unsigned long dead = a->allocated[j] & ~a->marked[j];
+        live += __builtin_popcountl(a->marked[j]) * a->slot_size;
+        while (dead) {
+          free_slot(a, j * BITS + __builtin_ctzl(dead));
+          collected_blocks++;
+          dead &= dead - 1;
+        }
+        a->marked[j] = 0;
+      }
+    }
+  }
+  for (i = 0, j = 0; i != large_len; ++i) {
+    if (large_blocks[i].marked) {
+      large_blocks[i].marked = 0;
+      live += large_blocks[i].size;
+      large_blocks[j++] = large_blocks[i];
+    } else {
+      free(large_blocks[i].start);
+      large_frees++;
+      collected_blocks++;
+    }
+  }
+  large_len = j;
+  /* Collect again once the heap has grown by the live size */
+  allocated_since_gc = 0;
+  gc_threshold = live > gc_min_threshold ? live : gc_min_threshold;
+  return live;
+}
+
+void pyy_print_alloc_stats(FILE* out)
+{
+  int c;
+  unsigned long allocations = 0, arenas = 0;
+  fprintf(out, "size class  allocations  frees  arenas\n");
+  for (c = 0; c != ALLOC_NUM_CLASSES; ++c) {
+    struct size_class* sc = &classes[c];
+    fprintf(out, "%10d  %11lu  %5lu  %6lu\n", ALLOC_MIN_SIZE << c, sc->allocations, sc->frees, sc->arena_count);
+    allocations += sc->allocations;
+    arenas += sc->arena_count;
+  }
+  fprintf(out, "%10s  %11lu  %5lu  %6s\n", "large", large_allocations, large_frees, "-");
+  fprintf(out, "total: %lu allocations, %lu bytes in arenas\n",
+          allocations + large_allocations, arenas * ALLOC_ARENA_SIZE);
+  fprintf(out, "gc: %lu collections, %lu blocks collected\n", collections, collected_blocks);
+}
@@ -0,0 +1,61 @@
+#ifndef ALLOC_H
+#define ALLOC_H
+
+#include <stddef.h>
+#include <stdio.h>
+
+/*
+  Allocation layer for the runtime heap (big objects, list data and dicts).
+
+  Small blocks come from per size class arenas: an allocation is a pointer
+  increment (or a pop from the size class free list) and blocks are 16 byte
+  aligned, so pointers to them can be tagged as BIG_TAG pyobjs. Blocks larger
+  than the biggest size class go to malloc. Blocks are zeroed.
+
+  The heap is garbage collected (see gc.c). Once enough has been allocated
+  since the last collection, pyy_alloc calls pyy_collect, which marks the
+  reachable blocks with pyy_mark_block and then calls pyy_sweep to free the
+  others. Blocks from pyy_alloc_object are big_pyobjs, which the collector
+  traces by their tag, other blocks are scanned for anything that looks like
+  a pointer.
+
+  Environment variables:
+  - PYYC_ALLOC_STATS: print the allocation counters to stderr at exit
+  - PYYC_GC=0: never collect
+  - PYYC_GC_THRESHOLD=<bytes>: allocation between collections (at least)
+*/
+
+#define ALLOC_ARENA_SIZE (64 * 1024)
+#define ALLOC_NUM_CLASSES 8
+#define ALLOC_MIN_SIZE 16
+#define ALLOC_MAX_SIZE (ALLOC_MIN_SIZE << (ALLOC_NUM_CLASSES - 1))
+#define ALLOC_MAX_SLOTS (ALLOC_ARENA_SIZE / ALLOC_MIN_SIZE)
+#define ALLOC_BITMAP_WORDS (ALLOC_MAX_SLOTS / (8 * sizeof(unsigned long)))
+
+#define GC_MIN_THRESHOLD (4 * 1024 * 1024)
+
+struct arena {
+  struct arena* next;     /* next arena of the same size class */
+  unsigned int size_class;
+  unsigned int slot_size;
+  unsigned int slots;
+  /* One bit per slot */
+  unsigned long allocated[ALLOC_BITMAP_WORDS];
+  unsigned long marked[ALLOC_BITMAP_WORDS];
+  unsigned long objects[ALLOC_BITMAP_WORDS];
+};
+
+void* pyy_alloc(size_t size);
+void* pyy_alloc_object(size_t size);
+void* pyy_resize(void* p, size_t old_size, size_t new_size);
+void pyy_free(void* p, size_t size);
+
+/* Collector interface */
+void* pyy_block_of(void* p, size_t* size, int* is_object);
+int pyy_mark_block(void* block);
+size_t pyy_sweep(void);
+void pyy_collect(void);
+
+void pyy_print_alloc_stats(FILE* out);
+
+#endif /* ALLOC_H */
@@ -0,0 +1,163 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "runtime.h"
+#include "alloc.h"
+
+/*
+  Mark-sweep garbage collector for the runtime heap (see alloc.h).
+
+  Compiled code keeps its values in registers and in the stack slots that
+  frame_function (to_x86.py) lays out below %rbp, without any root maps, so
+  the roots are found conservatively: every word of the stack, of the
+  callee-saved registers and of the data segment which points into an
+  allocated block keeps that block alive (tagged pointers included, since
+  they point inside the block).
+
+  big_pyobjs are traced by their tag: the list data, the dict tables, the
+  function free_vars and the class/object attribute tables (which live in
+  the hashtable library's malloc'd memory, out of sight of the scan).
+  Other blocks reached from the roots are scanned word by word.
+*/
+
+/* Bounds of the data and bss segments (from the linker) and the bottom of the stack (from glibc) */
+extern char __data_start[], _end[];
+extern void* __libc_stack_end;
+
+struct gray_block {
+  void* start;
+  size_t size;
+  int is_object;
+};
+
+static struct gray_block* gray;
+static unsigned int gray_len;
+static unsigned int gray_cap;
+
+static void push_gray(void* start, size_t size, int is_object)
+{
+  if (gray_len == gray_cap) {
+    gray_cap = gray_cap ? 2 * gray_cap : 256;
+    gray = (struct gray_block*)realloc(gray, sizeof(struct gray_block) * gray_cap);
+    if (gray == NULL) {
+      printf("out of memory");
+      exit(-1);
+    }
+  }
+  gray[gray_len].start = start;
+  gray[gray_len].size = size;
+  gray[gray_len].is_object = is_object;
+  gray_len++;
+}
+
+/* Mark the block a word points into (if any) and queue it to be traced */
+static void mark_word(pyobj word)
+{
+  size_t size;
+  int is_object;
+  void* block = pyy_block_of((void*)word, &size, &is_object);
+  if (block != NULL && pyy_mark_block(block))
+    push_gray(block, size, is_object);
+}
+
+/* Mark the block p points into without queueing it, returns 1 if its contents need tracing */
+static int mark_only(void* p)
+{
+  size_t size;
+  int is_object;
+  void* block = pyy_block_of(p, &size, &is_object);
+  return block != NULL && pyy_mark_block(block);
+}
+
+static void mark_range(void* start, void* end)
+{
+  pyobj* p = (pyobj*)(((unsigned long)start + sizeof(pyobj) - 1) & ~(sizeof(pyobj) - 1));
+  for (; (void*)(p + 1) <= end; ++p)
+    mark_word(*p);
+}
+
+static void trace_hashtable(struct hashtable* h)
+{
+  if (h == NULL || hashtable_count(h) == 0)
+    return;
+  struct hashtable_itr* itr = hashtable_iterator(h);
+  do {
+    mark_word(*(pyobj*)hashtable_iterator_value(itr));
+  } while (hashtable_iterator_advance(itr));
+  free(itr);
+}
+
+static void trace_class(class cl)
+{
+  int i;
+  trace_hashtable(cl.attrs);
+  if (cl.parents != NULL && mark_only(cl.parents))
+    for (i = 0; i != cl.nparents; ++i)
+      trace_class(cl.parents[i]);
+}
+
+static void trace_object(big_pyobj* b)
+{
+  int i;
+  switch (b->tag) {
+  case LIST:
+    if (mark_only(b->u.l.data))
+      for (i = 0; i != b->u.l.len; ++i)
+        mark_word(b->u.l.data[i]);
+    break;
+  case DICT: {
+    dict d = b->u.d;
+    if (d != NULL && mark_only(d)) {
+      mark_only(d->index);
+      if (mark_only(d->entries))
+        for (i = 0; i != d->count; ++i) {
+          mark_word(d->entries[i].key);
+          mark_word(d->entries[i].value);
+        }
+    }
+    break;
+  }
+  case FUN:
+    mark_word(b->u.f.free_vars);
+    break;
+  case CLASS:
+    trace_class(b->u.cl);
+    break;
+  case OBJECT:
+    trace_hashtable(b->u.obj.attrs);
+    trace_class(b->u.obj.cl);
+    break;
+  case UBMETHOD:
+    mark_word(b->u.ubm.fun.free_vars);
+    trace_class(b->u.ubm.cl);
+    break;
+  case BMETHOD:
+    mark_word(b->u.bm.fun.free_vars);
+    trace_hashtable(b->u.bm.receiver.attrs);
+    trace_class(b->u.bm.receiver.cl);
+    break;
+  }
+}
+
+/* Scan the stack below this frame, so the registers pyy_collect spilled are included */
+static void __attribute__((noinline)) mark_stack(void)
+{
+  void* top;
+  mark_range(&top, __libc_stack_end);
+}
+
+void pyy_collect(void)
+{
+  /* Spill the callee-saved registers, they may hold the only pointer to a block */
+  __builtin_unwind_init();
+  mark_stack();
+  mark_range(__data_start, _end);
+  while (gray_len) {
+    struct gray_block b = gray[--gray_len];
+    if (b.is_object)
+      trace_object((big_pyobj*)b.start);
+    else
+      mark_range(b.start, (char*)b.start + b.size);
+  }
+  pyy_sweep();
+}
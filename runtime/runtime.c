@@ -3,17 +3,19 @@
 #include <assert.h>
 #include <ctype.h>
 #include <string.h>
+#include <errno.h>
+#include <limits.h>
+#include <unistd.h>
 
 #include "runtime.h"
+#include "alloc.h"
 
 int min(int x, int y) { return y < x ? y : x; }
 
 /* Some forward declarations */
 static int equal_pyobj(pyobj a, pyobj b);
 static void print_float(double in);
-static void print_list(pyobj pyobj_list);
-static void print_dict(pyobj dict);
-static list list_add(list x, list y);
+static unsigned int hash_pyobj(pyobj obj);
 
 int tag(pyobj val) {
   return val & MASK;
@@ -125,17 +127,183 @@ static int is_zero(pyobj val) {
   return (val >> SHIFT) == 0;
 }
 
+/*
+  Output
+
+  The printers write into out_buf instead of going through printf per
+  token. The buffer is written out when it fills up, before reading input
+  and at exit (every runtime error exits, and atexit handlers run before
+  stdio flushes the error message). On a terminal, every line is flushed.
+*/
+
+#define OUT_BUF_SIZE (64 * 1024)
+
+static char out_buf[OUT_BUF_SIZE];
+static unsigned int out_len;
+static int out_initialized;
+static int out_line_buffered;
+
+static void out_flush(void)
+{
+  unsigned int done = 0;
+  while (done < out_len) {
+    ssize_t n = write(STDOUT_FILENO, out_buf + done, out_len - done);
+    if (n < 0) {
+      if (errno == EINTR)
+        continue;
+      break;
+    }
+    done += n;
+  }
+  out_len = 0;
+}
+
+static void out_init(void)
+{
+  out_initialized = 1;
+  out_line_buffered = isatty(STDOUT_FILENO);
+  /* Anything printf'd so far goes first */
+  fflush(stdout);
+  atexit(out_flush);
+}
+
+static void out_write(const char* s, unsigned int len)
+{
+  if (!out_initialized)
+    out_init();
+  if (out_len + len > OUT_BUF_SIZE) {
+    out_flush();
+    if (len > OUT_BUF_SIZE) {
+      memcpy(out_buf, s, OUT_BUF_SIZE);
+      out_len = OUT_BUF_SIZE;
+      out_flush();
+      out_write(s + OUT_BUF_SIZE, len - OUT_BUF_SIZE);
+      return;
+    }
+  }
+  memcpy(out_buf + out_len, s, len);
+  out_len += len;
+}
+
+static void out_char(char c)
+{
+  if (!out_initialized)
+    out_init();
+  if (out_len == OUT_BUF_SIZE)
+    out_flush();
+  out_buf[out_len++] = c;
+}
+
+static void out_str(const char* s)
+{
+  out_write(s, strlen(s));
+}
+
+static void out_newline(void)
+{
+  out_char('\n');
+  if (out_line_buffered)
+    out_flush();
+}
+
+/* Format the digits backwards (the magnitude is unsigned so INT_MIN works) */
+static void out_int(int x)
+{
+  char digits[16];
+  char* p = digits + sizeof(digits);
+  unsigned int u = x < 0 ? -(unsigned int)x : (unsigned int)x;
+  do {
+    *--p = '0' + u % 10;
+    u /= 10;
+  } while (u);
+  if (x < 0)
+    *--p = '-';
+  out_write(p, digits + sizeof(digits) - p);
+}
+
+/*
+  Printing
+
+  Containers being printed are kept on a stack, so a list or dict that
+  contains itself (however deep) prints as [...] or {...} where it recurs,
+  as python does.
+*/
+
 static void print_int(int x) {
-  printf("%d", x);
+  out_int(x);
 }
 void print_int_nl(int x) {
-  printf("%d\n", x);
+  print_int(x);
+  out_newline();
 }
 static void print_bool(int b) {
-  if (b)
-    printf ("True");
-  else
-    printf ("False");
+  out_str(b ? "True" : "False");
+}
+
+static void print_pyobj(pyobj x);
+
+static big_pyobj** printing;    /* containers being printed, innermost last */
+static unsigned int printing_len;
+static unsigned int printing_cap;
+
+/* Push b on the printing stack, returns 0 if b is already being printed */
+static int print_enter(big_pyobj* b)
+{
+  unsigned int i;
+  for (i = 0; i != printing_len; ++i)
+    if (printing[i] == b)
+      return 0;
+  if (printing_len == printing_cap) {
+    printing_cap = printing_cap ? 2 * printing_cap : 16;
+    printing = (big_pyobj**)realloc(printing, sizeof(big_pyobj*) * printing_cap);
+    if (printing == NULL) {
+      printf("out of memory");
+      exit(-1);
+    }
+  }
+  printing[printing_len++] = b;
+  return 1;
+}
+
+static void print_leave(void)
+{
+  printing_len--;
+}
+
+static void print_list(big_pyobj* b)
+{
+  unsigned int i;
+  if (!print_enter(b)) {
+    out_str("[...]");
+    return;
+  }
+  out_char('[');
+  for (i = 0; i != b->u.l.len; ++i) {
+    if (i != 0)
+      out_str(", ");
+    print_pyobj(b->u.l.data[i]);
+  }
+  out_char(']');
+  print_leave();
+}
+
+static void print_dict(big_pyobj* b)
+{
+  unsigned int i;
+  if (!print_enter(b)) {
+    out_str("{...}");
+    return;
+  }
+  out_char('{');
+  for (i = 0; i != b->u.d->count; ++i) {
+    if (i != 0)
+      out_str(", ");
+    print_pyobj(b->u.d->entries[i].key);
+    out_str(": ");
+    print_pyobj(b->u.d->entries[i].value);
+  }
+  out_char('}');
+  print_leave();
 }
 
 static void print_pyobj(pyobj x) {
@@ -153,10 +321,10 @@ static void print_pyobj(pyobj x) {
     big_pyobj* b = project_big(x);
     switch (b->tag) {
     case DICT:
-      print_dict(x);
+      print_dict(b);
       break;
     case LIST:
-      print_list(x);
+      print_list(b);
       break;
     default:
       assert(0);
@@ -168,17 +336,86 @@ static void print_pyobj(pyobj x) {
   }
 }
 
+/*
+  Input
+
+  Input is split into whitespace separated tokens, read out of in_buf which
+  is refilled with read(2) in large chunks (the output is flushed first, so
+  a prompt shows up before blocking on input). A token is True, False or an
+  int, parsed by hand: like atoi, parsing stops at the first non digit, but
+  an int which does not fit in a pyobj is an error instead of wrapping around.
+*/
+
+#define IN_BUF_SIZE (64 * 1024)
+#define IN_TOKEN_SIZE 64
+
+static char in_buf[IN_BUF_SIZE];
+static unsigned int in_pos;
+static unsigned int in_len;
+
+/* The next input character (without consuming it), EOF at the end of the input */
+static int in_peek(void)
+{
+  if (in_pos == in_len) {
+    ssize_t n;
+    out_flush();
+    do
+      n = read(STDIN_FILENO, in_buf, IN_BUF_SIZE);
+    while (n < 0 && errno == EINTR);
+    in_pos = 0;
+    in_len = n > 0 ? n : 0;
+    if (in_len == 0)
+      return EOF;
+  }
+  return (unsigned char)in_buf[in_pos];
+}
+
+/* Read the next token into token (truncated to IN_TOKEN_SIZE - 1 characters) */
+static void read_token(char* token)
+{
+  int c;
+  unsigned int len = 0;
+  while ((c = in_peek()) != EOF && isspace(c))
+    in_pos++;
+  if (c == EOF) {
+    fprintf(stderr, "EOFError: EOF when reading a line\n");
+    exit(1);
+  }
+  while ((c = in_peek()) != EOF && !isspace(c)) {
+    if (len != IN_TOKEN_SIZE - 1)
+      token[len++] = c;
+    in_pos++;
+  }
+  token[len] = '\0';
+}
+
+static int parse_int(const char* s)
+{
+  int negative = *s == '-';
+  /* inject_int keeps the low bits of the int, shifted past the tag */
+  unsigned long limit = ((unsigned long)INT_MAX >> SHIFT) + negative;
+  unsigned long value = 0;
+  if (*s == '-' || *s == '+')
+    s++;
+  for (; isdigit((unsigned char)*s); ++s) {
+    value = 10 * value + (*s - '0');
+    if (value > limit) {
+      printf("ERROR: input integer out of range\n");
+      exit(1);
+    }
+  }
+  return negative ? -(long)value : (long)value;
+}
+
 // For idiomatic purposes only.
 int eval(int x) {
   return x;
 }
 
 int input() {
-  char buf[100];
-  int i;
-  scanf("%s", buf);
-  i = atoi(buf);
-  return i; 
+  char token[IN_TOKEN_SIZE];
+  read_token(token);
+  return parse_int(token);
 }
 
 
@@ -188,19 +425,13 @@ pyobj eval_pyobj(pyobj x) {
 }
 
 pyobj input_pyobj() {
-  char buf[100];
-  int i;
-  int ret;
-  scanf("%s", buf);
-  if (strcmp(buf, "True") == 0)
-    ret = inject_bool(1);
-  else if (strcmp(buf, "False") == 0)
-    ret = inject_bool(0);
-  else {
-    i = atoi(buf);
-    ret = inject_int(i);
-  }
-  return ret;
+  char token[IN_TOKEN_SIZE];
+  read_token(token);
+  if (strcmp(token, "True") == 0)
+    return inject_bool(1);
+  if (strcmp(token, "False") == 0)
+    return inject_bool(0);
+  return inject_int(parse_int(token));
 }
 
 // wrapper for eval_input idiom
@@ -214,9 +445,7 @@ pyobj eval_input_pyobj() {
 
 // old input
 pyobj input_int() {
-  int i;
-  scanf("%d", &i);
-  return inject_int(i);
+  return inject_int(input());
 }
 
 /*
@@ -224,7 +453,7 @@ pyobj input_int() {
 */
 
 static big_pyobj* list_to_big(list l) {
-  big_pyobj* v = (big_pyobj*)malloc(sizeof(big_pyobj));
+  big_pyobj* v = (big_pyobj*)pyy_alloc_object(sizeof(big_pyobj));
   v->tag = LIST;
   v->u.l = l;
   return v;
@@ -233,7 +462,8 @@ static big_pyobj* list_to_big(list l) {
 big_pyobj* create_list(pyobj length) {
   list l;
   l.len = project_int(length); /* this should be checked */
-  l.data = (pyobj*)malloc(sizeof(pyobj) * l.len);
+  l.capacity = l.len;
+  l.data = (pyobj*)pyy_alloc(sizeof(pyobj) * l.capacity);
   return list_to_big(l);
 }
 
@@ -242,15 +472,6 @@ static pyobj make_list(pyobj length) {
 }
 
 
-static char is_in_list(list ls, pyobj b)
-{
-    int i;
-    for(i = 0; i < ls.len; i++)
-      if (ls.data[i] == b)
-	return 1;
-    return 0;
-}
-
 static int list_equal(list x, list y)
 {
   char eq = 1;
@@ -268,65 +489,6 @@ static int list_equal(list x, list y)
   Hashtable support
 */
 
-static char inside;
-static list printing_list;
-
-static void print_dict(pyobj dict)
-{
-    big_pyobj* d;
-    char inside_reset = 0;
-    if(!inside) {
-        inside = 1;
-        inside_reset = 1;
-        printing_list.len = 0;
-	printing_list.data = 0;
-    }
-    d = project_big(dict);
-
-    if(is_in_list(printing_list, dict)) {
-        printf("{...}");
-        return;
-    }
-    printf("{");
-    int i = 0;
-    int max = hashtable_count(d->u.d);
-
-    struct hashtable_itr *itr = hashtable_iterator(d->u.d);
-    if (max) {
-        do {
-            pyobj k = *(pyobj *)hashtable_iterator_key(itr);
-            pyobj v = *(pyobj *)hashtable_iterator_value(itr);
-            print_pyobj(k);
-            printf(": ");
-            if (is_in_list(printing_list, v)
-		|| equal_pyobj(v,dict)) {
-	      printf("{...}");
-            }
-            else {
-                /* tally this dictionary in our list of printing dicts */
-	      list a;
-	      a.len = 1;
-	      a.data = (pyobj*)malloc(sizeof(pyobj) * a.len);
-	      a.data[0] = dict;
-	      /* Yuk, concatenating (adding) lists is slow! */
-	      printing_list = list_add(printing_list, a);
-	      print_pyobj(v);
-            }
-            if(i != max - 1)
-                printf(", ");
-            i++;
-        } while (hashtable_iterator_advance(itr));
-    }
-    printf("}");
-
-    if(inside_reset) {
-        inside = 0;
-        printing_list.len = 0;
-	printing_list.data = 0;
-    }
-}
-
-
 /* This hash function was chosen more or less at random -Jeremy */
 static int hash32shift(int key)
 {  
@@ -340,9 +502,41 @@ static int hash32shift(int key)
 }
 
 
-static unsigned int hash_any(void* o)
+/* Hash of a list or dict, cached on the object when it holds no other containers */
+static unsigned int hash_big(big_pyobj* b)
+{
+  int i;
+  int cacheable = 1;
+  unsigned long h = 0;
+  if (b->hash != HASH_UNSET)
+    return b->hash;
+  switch (b->tag) {
+  case LIST:
+    for (i = 0; i != b->u.l.len; ++i) {
+      cacheable = cacheable && tag(b->u.l.data[i]) != BIG_TAG;
+      h = 5*h + hash_pyobj(b->u.l.data[i]);
+    }
+    break;
+  case DICT:
+    for (i = 0; i != b->u.d->count; ++i) {
+      cacheable = cacheable && tag(b->u.d->entries[i].value) != BIG_TAG;
+      h = 5*h + hash_pyobj(b->u.d->entries[i].value);
+    }
+    break;
+  default:
+    printf("unrecognized tag in hash_any\n");
+    *(int*)0 = 42;
+  }
+  /* HASH_UNSET is not a hash (cached or not, so equal containers hash the same) */
+  if ((unsigned int)h == HASH_UNSET)
+    h = 1;
+  if (cacheable)
+    b->hash = h;
+  return h;
+}
+
+static unsigned int hash_pyobj(pyobj obj)
 {
-  pyobj obj = *(pyobj*)o;
   switch (tag(obj)) {
   case INT_TAG:
     return hash32shift(project_int(obj));
@@ -350,33 +544,8 @@ static unsigned int hash_any(void* o)
     return hash32shift(project_float(obj));
   case BOOL_TAG:
     return hash32shift(project_bool(obj));
-  case BIG_TAG: {
-    big_pyobj* b = project_big(obj);
-    switch (b->tag) {
-    case LIST: {
-      int i;
-      unsigned long h = 0; 
-      for (i = 0; i != b->u.l.len; ++i)
-	h = 5*h + hash_any(&b->u.l.data[i]);
-      return h;
-    }
-    case DICT: {
-      struct hashtable_itr* i;
-      unsigned long h = 0; 
-      if (hashtable_count(b->u.d) == 0)
-	return h;
-      i = hashtable_iterator(b->u.d); 
-      do {
-	h = 5*h + hash_any(hashtable_iterator_value(i));
-      } while (hashtable_iterator_advance(i));
-      return h;
-    }
-    default:
-      printf("unrecognized tag in hash_any\n");
-      *(int*)0 = 42;
-    }
-    break;
-  }
+  case BIG_TAG:
+    return hash_big(project_big(obj));
   default:
     printf("unrecognized tag in hash_any\n");
     *(int*)0 = 42;
@@ -384,12 +553,14 @@ static unsigned int hash_any(void* o)
 }
 
 
-static struct hashtable *current_cmp_a;
-static struct hashtable *current_cmp_b;
+static dict current_cmp_a;
+static dict current_cmp_b;
 
-static char dict_equal(struct hashtable* x, struct hashtable* y)
+static pyobj* dict_lookup(dict d, pyobj key, unsigned int hash);
+
+static char dict_equal(dict x, dict y)
 {
-    if(hashtable_count(x) != hashtable_count(y))
+    if(x->count != y->count)
         return 0;
 
     if(current_cmp_a)
@@ -426,22 +597,13 @@ static char dict_equal(struct hashtable* x, struct hashtable* y)
         will_reset = 1;
     }
 
-    int max = hashtable_count(x);
-
-    struct hashtable_itr *itr_a = hashtable_iterator(x);
-    struct hashtable_itr *itr_b = hashtable_iterator(y);
-    if (max)
-    {
-        do {
-            pyobj k_a = *(pyobj *)hashtable_iterator_key(itr_a);
-            pyobj v_a = *(pyobj *)hashtable_iterator_value(itr_a);
-            pyobj k_b = *(pyobj *)hashtable_iterator_key(itr_b);
-            pyobj v_b = *(pyobj *)hashtable_iterator_value(itr_b);
-
-            if(!equal_pyobj(k_a,k_b) || !equal_pyobj(v_a,v_b))
-                same = 0;
-
-        } while (hashtable_iterator_advance(itr_a) && hashtable_iterator_advance(itr_b));
+    /* Same number of entries, so equal if every key of x maps to an equal value in y */
+    int i;
+    for (i = 0; same && i != x->count; ++i) {
+        struct dict_entry* e = &x->entries[i];
+        pyobj* v_b = dict_lookup(y, e->key, e->hash);
+        if(v_b == NULL || !equal_pyobj(e->value, *v_b))
+            same = 0;
     }
 
     if(will_reset)
@@ -519,34 +681,93 @@ static int equal_pyobj(pyobj a, pyobj b)
 }
 
 
-static int equal_any(void* a, void* b)
+/*
+  Dictionaries
+*/
+
+#define DICT_MIN_SIZE 8
+
+/* The probe table is grown when it is more than 2/3 full */
+static int dict_needs_resize(dict d)
+{
+  return 3 * (d->count + 1) > 2 * (d->mask + 1);
+}
+
+/* Find the probe table slot for a key: either the slot holding it or the empty slot where it goes */
+static unsigned int dict_probe(dict d, pyobj key, unsigned int hash)
+{
+  unsigned int i = hash & d->mask;
+  while (d->index[i] != DICT_EMPTY) {
+    struct dict_entry* e = &d->entries[d->index[i]];
+    if (e->hash == hash && (e->key == key || equal_pyobj(e->key, key)))
+      return i;
+    i = (i + 1) & d->mask;
+  }
+  return i;
+}
+
+static pyobj* dict_lookup(dict d, pyobj key, unsigned int hash)
+{
+  int entry = d->index[dict_probe(d, key, hash)];
+  return entry == DICT_EMPTY ? NULL : &d->entries[entry].value;
+}
+
+static void dict_resize(dict d, unsigned int size)
+{
+  int i;
+  if (d->index)
+    pyy_free(d->index, sizeof(int) * (d->mask + 1));
+  d->mask = size - 1;
+  d->index = (int*)pyy_alloc(sizeof(int) * size);
+  for (i = 0; i != size; ++i)
+    d->index[i] = DICT_EMPTY;
+  for (i = 0; i != d->count; ++i)
+    d->index[dict_probe(d, d->entries[i].key, d->entries[i].hash)] = i;
+}
+
+static dict dict_new()
 {
-  return equal_pyobj(*(pyobj*)a, *(pyobj*)b);
+  dict d = (dict)pyy_alloc(sizeof(struct dict_struct));
+  d->count = 0;
+  d->capacity = DICT_MIN_SIZE;
+  d->entries = (struct dict_entry*)pyy_alloc(sizeof(struct dict_entry) * d->capacity);
+  d->index = NULL;
+  dict_resize(d, DICT_MIN_SIZE);
+  return d;
 }
 
 big_pyobj* create_dict()
 {
-  big_pyobj* v = (big_pyobj*)malloc(sizeof(big_pyobj));
+  big_pyobj* v = (big_pyobj*)pyy_alloc_object(sizeof(big_pyobj));
   v->tag = DICT;
-  v->u.d = create_hashtable(4, hash_any, equal_any);
+  v->u.d = dict_new();
   return v;
 }
 
 static pyobj make_dict() { return inject_big(create_dict()); }
 
+/* The value for key, a missing key is inserted (with a placeholder value) */
 static pyobj* dict_subscript(dict d, pyobj key)
 {
-  void* p = hashtable_search(d, &key);
-  if (p)
-    return (pyobj*)p;
-  else {
-    pyobj* k = (pyobj*) malloc(sizeof(pyobj));
-    *k = key;
-    pyobj* v = (pyobj*) malloc(sizeof(pyobj));
-    *v = inject_int(444);
-    hashtable_insert(d, k, v);
-return v;
+  unsigned int hash = hash_pyobj(key);
+  unsigned int slot = dict_probe(d, key, hash);
+  if (d->index[slot] != DICT_EMPTY)
+    return &d->entries[d->index[slot]].value;
+  if (dict_needs_resize(d)) {
+    dict_resize(d, 2 * (d->mask + 1));
+    slot = dict_probe(d, key, hash);
+  }
+  if (d->count == d->capacity) {
+    d->entries = (struct dict_entry*)pyy_resize(d->entries, sizeof(struct dict_entry) * d->capacity,
+                                                sizeof(struct dict_entry) * 2 * d->capacity);
+    d->capacity *= 2;
   }
+  struct dict_entry* e = &d->entries[d->count];
+  e->hash = hash;
+  e->key = key;
+  e->value = inject_int(444);
+  d->index[slot] = d->count++;
+  return &e->value;
 }
 
 static pyobj* list_subscript(list ls, pyobj n)
@@ -598,7 +819,7 @@ static void print_float(double in)
         }
         else
         {
-            printf(printed_0_neg ? "-0.0" : "0.0");
+            out_str(printed_0_neg ? "-0.0" : "0.0");
             return;
         }
     }
@@ -610,47 +831,18 @@ static void print_float(double in)
     while(*p && isdigit(*p))
         p++;
 
-    printf( ( (*p)  ? "%s" : "%s.0" ), outstr);
+    out_str(outstr);
+    if (!*p)
+        out_str(".0");
 }
 
-static pyobj *current_list;
-static void print_list(pyobj ls)
-{
-  big_pyobj* pyobj_list = project_big(ls);
-  if(current_list && current_list == pyobj_list->u.l.data) {
-    printf("[...]");
-    return;
-  }
-
-  int will_reset = 0;
-  if(!current_list) {
-    current_list = pyobj_list->u.l.data;
-    will_reset = 1;
-  }
-  
-  list l = pyobj_list->u.l;
-  printf("[");
-  int i;
-  for(i = 0; i < l.len; i++) {
-    if (tag(l.data[i]) == BIG_TAG && project_big((l.data[i]))->tag == LIST
-	&& project_big((l.data[i]))->u.l.data == l.data)
-      printf("[...]");
-    else
-      print_pyobj(l.data[i]);
-    if(i != l.len - 1)
-      printf(", ");
-  }
-  printf("]");
-  
-  if(will_reset)
-    current_list = NULL;
-}
 
 static list list_add(list a, list b)
 {
   list c;
   c.len = a.len + b.len;
-  c.data = (pyobj*)malloc(sizeof(pyobj) * c.len);
+  c.capacity = c.len;
+  c.data = (pyobj*)pyy_alloc(sizeof(pyobj) * c.capacity);
   int i;
   for (i = 0; i != a.len; ++i)
     c.data[i] = a.data[i];
@@ -659,6 +851,40 @@ static list list_add(list a, list b)
   return c;
 }
 
+#define LIST_MIN_CAPACITY 4
+
+/* Make room for len elements, doubling the capacity */
+static void list_reserve(list* l, unsigned int len)
+{
+  unsigned int capacity = l->capacity ? l->capacity : LIST_MIN_CAPACITY;
+  if (len <= l->capacity)
+    return;
+  while (capacity < len)
+    capacity *= 2;
+  l->data = (pyobj*)pyy_resize(l->data, sizeof(pyobj) * l->capacity, sizeof(pyobj) * capacity);
+  l->capacity = capacity;
+}
+
+/*
+  a + b appending to a itself, for when the compiler knows nothing else can
+  see a (see inplace.py). Appending n elements is amortized O(n).
+*/
+big_pyobj* list_extend(big_pyobj* a, big_pyobj* b) {
+  if (a->tag != LIST || b->tag != LIST) {
+    printf("error in add, expected a list\n");
+    exit(-1);
+  }
+  /* b may be a, read its length before growing */
+  unsigned int len = b->u.l.len;
+  int i;
+  list_reserve(&a->u.l, a->u.l.len + len);
+  for (i = 0; i != len; ++i)
+    a->u.l.data[a->u.l.len + i] = b->u.l.data[i];
+  a->u.l.len += len;
+  a->hash = HASH_UNSET;
+  return a;
+}
+
 big_pyobj* add(big_pyobj* a, big_pyobj* b) {
   switch (a->tag) {
   case LIST:
@@ -707,6 +933,7 @@ int not_equal(big_pyobj* x, big_pyobj* y) { return !equal(x, y); }
 
 static pyobj subscript_assign(big_pyobj* c, pyobj key, pyobj val)
 {
+  c->hash = HASH_UNSET;
   switch (c->tag) {
   case LIST:
     return *list_subscript(c->u.l, key) = val;
@@ -738,6 +965,8 @@ static pyobj subscript(big_pyobj* c, pyobj key)
   case LIST:
     return *list_subscript(c->u.l, key);
   case DICT:
+    /* A missing key is inserted */
+    c->hash = HASH_UNSET;
     return *dict_subscript(c->u.d, key);
   default:
     printf("error in set subscript, not a list or dictionary\n");
@@ -760,7 +989,7 @@ pyobj get_subscript(pyobj c, pyobj key)
 
 void print_any(pyobj p) {
   print_pyobj(p);
-  printf("\n");
+  out_newline();
 }
 
 int is_true(pyobj v)
@@ -778,7 +1007,7 @@ int is_true(pyobj v)
     case LIST:
       return b->u.l.len != 0;
     case DICT:
-      return hashtable_count(b->u.d) > 0;
+      return b->u.d->count > 0;
     case FUN:
       return 1;
     case CLASS:
@@ -797,7 +1026,7 @@ int is_true(pyobj v)
 /* Support for Functions */
 
 static big_pyobj* closure_to_big(function f) {
-  big_pyobj* v = (big_pyobj*)malloc(sizeof(big_pyobj));
+  big_pyobj* v = (big_pyobj*)pyy_alloc_object(sizeof(big_pyobj));
   v->tag = FUN;
   v->u.f = f;
   return v;
@@ -849,7 +1078,7 @@ static int attrname_equal(void *a, void *b)
 
 big_pyobj* create_class(pyobj bases)
 {
-  big_pyobj* ret = (big_pyobj*)malloc(sizeof(big_pyobj));
+  big_pyobj* ret = (big_pyobj*)pyy_alloc_object(sizeof(big_pyobj));
   ret->tag = CLASS;
   ret->u.cl.attrs = create_hashtable(2, attrname_hash, attrname_equal);
 
@@ -858,7 +1087,7 @@ big_pyobj* create_class(pyobj bases)
   case LIST: {
       int i;
       ret->u.cl.nparents = basesp->u.l.len;
-      ret->u.cl.parents = (class*)malloc(sizeof(class) * ret->u.cl.nparents);
+      ret->u.cl.parents = (class*)pyy_alloc(sizeof(class) * ret->u.cl.nparents);
       for (i = 0; i != ret->u.cl.nparents; ++i) {
 	  pyobj* parent = &basesp->u.l.data[i];
 	  if (tag(*parent) == BIG_TAG && project_big(*parent)->tag == CLASS)
@@ -876,7 +1105,7 @@ big_pyobj* create_class(pyobj bases)
 
 /* we leave calling the __init__ function for a separate step. */
 big_pyobj* create_object(pyobj cl) {
-  big_pyobj* ret = (big_pyobj*)malloc(sizeof(big_pyobj));
+  big_pyobj* ret = (big_pyobj*)pyy_alloc_object(sizeof(big_pyobj));
   ret->tag = OBJECT;
   big_pyobj* clp = project_big(cl);
   if (clp->tag == CLASS)
@@ -915,7 +1144,7 @@ static pyobj* attrsearch(class cl, char* attr) {
 }
 
 static big_pyobj* create_bound_method(object receiver, function f) {
-  big_pyobj* ret = (big_pyobj*)malloc(sizeof(big_pyobj));
+  big_pyobj* ret = (big_pyobj*)pyy_alloc_object(sizeof(big_pyobj));
   ret->tag = BMETHOD;
   ret->u.bm.fun = f;
   ret->u.bm.receiver = receiver;
@@ -923,7 +1152,7 @@ static big_pyobj* create_bound_method(object receiver, function f) {
 }
 
 static big_pyobj* create_unbound_method(class cl, function f) {
-  big_pyobj* ret = (big_pyobj*)malloc(sizeof(big_pyobj));
+  big_pyobj* ret = (big_pyobj*)pyy_alloc_object(sizeof(big_pyobj));
   ret->tag = UBMETHOD;
   ret->u.ubm.fun = f;
   ret->u.ubm.cl = cl;
@@ -976,7 +1205,7 @@ int inherits(pyobj c1, pyobj c2) {
 
 big_pyobj* get_class(pyobj o)
 {
-  big_pyobj* ret = (big_pyobj*)malloc(sizeof(big_pyobj));
+  big_pyobj* ret = (big_pyobj*)pyy_alloc_object(sizeof(big_pyobj));
   ret->tag = CLASS;
 
   big_pyobj* b = project_big(o);
@@ -996,7 +1225,7 @@ big_pyobj* get_class(pyobj o)
 
 big_pyobj* get_receiver(pyobj o)
 {
-  big_pyobj* ret = (big_pyobj*)malloc(sizeof(big_pyobj));
+  big_pyobj* ret = (big_pyobj*)pyy_alloc_object(sizeof(big_pyobj));
   ret->tag = OBJECT;
   big_pyobj* b = project_big(o);
   switch (b->tag) {
@@ -1012,7 +1241,7 @@ big_pyobj* get_receiver(pyobj o)
 
 big_pyobj* get_function(pyobj o)
 {
-  big_pyobj* ret = (big_pyobj*)malloc(sizeof(big_pyobj));
+  big_pyobj* ret = (big_pyobj*)pyy_alloc_object(sizeof(big_pyobj));
   ret->tag = FUN;
   big_pyobj* b = project_big(o);
   switch (b->tag) {
@@ -40,13 +40,38 @@ typedef long int pyobj;
 
 struct pyobj_struct;
 
+/*
+  Lists keep room for capacity elements, so appending in place (list_extend)
+  only reallocates when the list doubles.
+*/
 struct list_struct {
   pyobj* data;
   unsigned int len;
+  unsigned int capacity;
 };
 typedef struct list_struct list;
 
-typedef struct hashtable* dict;
+/*
+  Dictionaries are open-addressing hash tables with the keys and values
+  stored inline. The entries are kept in insertion order (as python does)
+  and the probe table holds indices into the entries.
+*/
+struct dict_entry {
+  unsigned int hash;
+  pyobj key;
+  pyobj value;
+};
+
+struct dict_struct {
+  unsigned int count;          /* number of entries */
+  unsigned int capacity;       /* allocated entries */
+  unsigned int mask;           /* size of the probe table - 1 (a power of 2) */
+  int* index;                  /* probe table, DICT_EMPTY or an index into entries */
+  struct dict_entry* entries;
+};
+typedef struct dict_struct* dict;
+
+#define DICT_EMPTY -1
 
 struct fun_struct {
   void* function_ptr;
@@ -80,8 +105,17 @@ struct bound_method_struct {
 typedef struct bound_method_struct bound_method;
 
 
+/*
+  hash caches the hash of a list or dict (HASH_UNSET until it is computed).
+  Only containers of ints and bools are cached: the hash of a nested list
+  would go stale when the inner list changes. Anything that changes the
+  container itself must reset it.
+*/
+#define HASH_UNSET 0
+
 struct pyobj_struct {
   enum big_type_tag tag;
+  unsigned int hash;
   union {
     dict d;
     list l;
@@ -128,6 +162,7 @@ pyobj set_subscript(pyobj c, pyobj key, pyobj val);
 pyobj get_subscript(pyobj c, pyobj key);
 
 big_pyobj* add(big_pyobj* a, big_pyobj* b);
+big_pyobj* list_extend(big_pyobj* a, big_pyobj* b);
 int equal(big_pyobj* a, big_pyobj* b);
 int not_equal(big_pyobj* x, big_pyobj* y);
 
@@ -12,6 +12,7 @@ The big type is used for all other types.
 """
 
 from ast import *
+import copy
 import inspect
 
 from tree_utils import *
@@ -21,27 +22,56 @@ import P1
 
 # Explicate
 
+# Parsed FunctionDefs of the explicate helpers, keyed by function name.
+# Each helper is parsed at most once per process. The cached trees are never
+# handed out directly since later passes transform the tree in place.
+_helper_templates = {}
+
+# The node types of which the parser creates a single instance
+SHARED_NODES = (expr_context, operator, cmpop, boolop, unaryop)
+
+def parse_helper(func) -> FunctionDef:
+    ''' Parse the FunctionDef of a helper in explicate.py, or build the one of an exp.Variant '''
+    if isinstance(func, exp.Variant):
+        tree = parse_helper(func.helper)
+        tree.name = func.__name__
+        for node in ast.walk(tree):
+            if isinstance(node, Call) and isinstance(node.func, Name) and node.func.id in func.calls:
+                node.func.id = func.calls[node.func.id]
+        return tree
+    return ast.parse(inspect.getsource(func)).body[0]
+
+def get_helper_template(func) -> FunctionDef:
+    ''' Return a fresh copy of the FunctionDef for a helper in explicate.py '''
+    template = _helper_templates.get(func.__name__)
+    if template is None:
+        template = parse_helper(func)
+        _helper_templates[func.__name__] = template
+    # The parser shares the expression contexts (Load/Store) and the operators
+    # between all trees, and insertParentPointers gives them a parent in whatever
+    # tree was compiled last, so they must not be copied along with the template
+    # (the copy would take that whole tree with it).
+    memo = {id(n): n for n in ast.walk(template) if isinstance(n, SHARED_NODES)}
+    return copy.deepcopy(template, memo)
+
 class Explicate(BodyStacker):
     ''' Explicate the AST. 
         All values need to be boxed and unboxed.
         All operations must check the type of the values and do the correct
         operation if it allowed. 
         We will translate this into calls to the runtime functions.
+        With fast_paths, the int/int case of `+` and the comparisons is
+        emitted inline and only the other cases call the generic helper.
     '''
-    def __init__(self, prefix='exp'):
+    def __init__(self, prefix='exp', fast_paths=True):
         super().__init__(prefix=prefix)
         # Keep track of the function names so we don't add them twice
         self.function_names = []
+        self.fast_paths = fast_paths
 
     def explicate(self, func, inline=False, **kwargs):
-        ''' Use inspect to get the source code of the function and parse it with AST.
-            The function arguments will be replace by keyword. '''
-        # Convert using ast
-        s = inspect.getsource(func)
-        # print(s)
-        t = ast.parse(s)
-        # print(ast.dump(t, indent=2))
-
+        ''' Use inspect to get the source code of the function and parse it with AST
+            (see get_helper_template). The function arguments will be replace by keyword. '''
         temp = self.get_temp()
         name_load = Name(id=temp, ctx=Load())
         # kwargs = {
@@ -51,7 +81,7 @@ class Explicate(BodyStacker):
         # print(kwargs)
         if not inline:
             # Cause the function to be appended to the body (if it is not already there)
-            self.prepend_FunctionDef(t.body[0])
+            self.prepend_FunctionDef(func)
             # Not sure if the order will be preserved...
             args = [kwargs[arg] for arg in kwargs.keys()]
             self.appendToCurrentBody(
@@ -89,11 +119,51 @@ class Explicate(BodyStacker):
         # # return [t.body[0]]
         # return name_load
     
-    def prepend_FunctionDef(self, node):
-        ''' Add the function to the TOP LEVEL body if it is not already there. '''
-        if node.name not in self.function_names:
-            self.function_names.append(node.name)
-            self._body_stack[0].insert(0, node)
+    def explicate_int_fast_path(self, func, op, inject, left, right):
+        ''' Inline the case where both operands are ints, call the helper otherwise.
+            - exp0 = __add__(x, y)
+            becomes
+            - if is_int(x):
+                  if is_int(y):
+                      exp1 = project_int(x)
+                      exp2 = project_int(y)
+                      exp0 = exp1 + exp2
+                      exp0 = inject_int(exp0)
+                  else:
+                      exp0 = __add__(x, y)
+              else:
+                  exp0 = __add__(x, y)
+            `op` builds the unboxed operation from the two projected operands. '''
+        if not isinstance(left, ast.Name):
+            left = self.replaceWithTemp(left)
+        if not isinstance(right, ast.Name):
+            right = self.replaceWithTemp(right)
+        load = lambda n: Name(id=n.id, ctx=Load())
+        temp = self.get_temp()
+        left_int = self.get_temp()
+        right_int = self.get_temp()
+        self.prepend_FunctionDef(func)
+        def slow_path():
+            return Assign(targets=[Name(id=temp, ctx=Store())],
+                    value=Call(func=Name(id=func.__name__, ctx=Load()), args=[load(left), load(right)], keywords=[]))
+        fast_path = [
+            Assign(targets=[Name(id=left_int, ctx=Store())], value=project_int(load(left))),
+            Assign(targets=[Name(id=right_int, ctx=Store())], value=project_int(load(right))),
+            Assign(targets=[Name(id=temp, ctx=Store())],
+                value=op(Name(id=left_int, ctx=Load()), Name(id=right_int, ctx=Load()))),
+            Assign(targets=[Name(id=temp, ctx=Store())], value=inject(Name(id=temp, ctx=Load()))),
+        ]
+        self.appendToCurrentBody(
+            If(test=is_int(load(left)),
+                body=[If(test=is_int(load(right)), body=fast_path, orelse=[slow_path()])],
+                orelse=[slow_path()]))
+        return Name(id=temp, ctx=Load())
+
+    def prepend_FunctionDef(self, func):
+        ''' Add the helper function to the TOP LEVEL body if it is not already there. '''
+        if func.__name__ not in self.function_names:
+            self.function_names.append(func.__name__)
+            self._body_stack[0].insert(0, get_helper_template(func))
 
     def visit_Constant(self, node):
         return inject_constant(node)
@@ -232,7 +302,12 @@ class Explicate(BodyStacker):
         #   BitAnd
         #   FloorDiv
         assert(isinstance(node.op, ast.Add))
-        return self.explicate(exp.__add__, left=node.left, right=node.right)
+        # Adds marked by inplace.py append to the left list instead of copying it
+        helper = exp.__iadd__ if getattr(node, 'in_place', False) else exp.__add__
+        if self.fast_paths:
+            return self.explicate_int_fast_path(helper,
+                lambda l, r: BinOp(left=l, op=Add(), right=r), inject_int, node.left, node.right)
+        return self.explicate(helper, left=node.left, right=node.right)
 
     def visit_Compare(self, node: Compare):
         # Compare:
@@ -258,6 +333,10 @@ class Explicate(BodyStacker):
         if not isinstance(op, tuple(supported_ops)):
             print(op, type(op), file=sys.stderr)
             raise Exception('Unsupported comparison operator')
+        if self.fast_paths and not isinstance(op, ast.Is):
+            return self.explicate_int_fast_path(exp.cmp(op),
+                lambda l, r: Compare(left=l, ops=[op.__class__()], comparators=[r]),
+                inject_bool, node.left, node.comparators[0])
         return self.explicate(exp.cmp(op), left=node.left, right=node.comparators[0])
         return inject_bool(node)
 
@@ -1,243 +1,286 @@
-from typing import List
-from IR import *
+'''
+Control flow graph and liveness analysis.
+
+The CFG is built over the body of an ir_Function. It understands both the
+IR control statements (ir_Label, ir_Jump, ir_Branch, ir_Return) and their
+lowered x86 counterparts (x86_Label, x86_cntrl, x86_Ret) so the same
+liveness solver serves the IR passes and the register allocator.
 
+Live sets are stored as bitsets (python ints) over a numbered variable table.
+'''
 
+import ast
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+from IR import *
+from x86 import *
 
-# Control flow graph class
-# This class is used to represent the control flow graph of a function
-# It is used to generate the liveness analysis and interference graph
-# It is also used to generate the x86 assembly code
-# It is a directed graph with nodes being basic blocks of statements
-# and edges being the control flow between the basic blocks and liveness variables
-# The graph is represented as a dictionary of basic blocks
-# Each basic block is a list of statements
-# Each statement is a dataclass with the following fields:
-# reference to IR_Statement objects in an ordered list of statements
-# reference to the next basic block based on the control flow
-# reference to the previous basic block based on the control flow
+ReadWriteSets = Callable[[ir_stmt], Tuple[Set[str], Set[str]]]
+
+def ir_get_read_write_sets(stmnt: ir_stmt, variables: Set[str] = frozenset()) -> Tuple[Set[str], Set[str]]:
+    '''
+    Return (read set, write set) tuple of variable names for an IR statement.
+    `variables` is used to detect indirect calls through a variable.
+    '''
+    reads, writes = set(), set()
+    if isinstance(stmnt, ir_Assign):
+        writes.add(stmnt.target.id)
+        value = stmnt.value
+    elif isinstance(stmnt, ir_Expr):
+        value = stmnt.value
+    elif isinstance(stmnt, ir_Branch):
+        value = stmnt.condition
+    elif isinstance(stmnt, ir_Return):
+        value = stmnt.value
+    else:
+        return reads, writes
+    if value is None:
+        return reads, writes
+    # The operands of the IR are names and constants, so there is no need to walk the expression
+    if isinstance(value, ir_Target):
+        operands = [value.target]
+    elif isinstance(value, (ir_BinOp, ir_Compare)):
+        operands = [value.left, value.right]
+    elif isinstance(value, ir_UnaryOp):
+        operands = [value.operand]
+    elif isinstance(value, ir_Call):
+        operands = value.args
+        if value.func in variables:
+            reads.add(value.func)
+    elif isinstance(value, ir_trgt):
+        operands = [value]
+    else:
+        operands = list(ast.walk(value))
+    for operand in operands:
+        if isinstance(operand, ir_Name):
+            reads.add(operand.id)
+    return reads, writes
+
+def _label_name(stmnt: ir_stmt) -> str:
+    if isinstance(stmnt, (ir_Label, x86_Label)):
+        return stmnt.name
+    return None
+
+def _jump_targets(stmnt: ir_stmt) -> Tuple[List[str], bool]:
+    '''
+    Return (target labels, falls through) for a statement.
+    Non-control statements fall through with no targets.
+    '''
+    if isinstance(stmnt, ir_Jump):
+        return [stmnt.label], False
+    if isinstance(stmnt, ir_Branch):
+        return [stmnt.true_label, stmnt.false_label], False
+    if isinstance(stmnt, x86_Jmp):
+        return [stmnt.name], False
+    if isinstance(stmnt, x86_cntrl):
+        return [stmnt.name], True
+    if isinstance(stmnt, (ir_Return, x86_Ret)):
+        return [], False
+    return [], True
 
 class CFG:
     '''
     Control flow graph class:
     This class is used to represent the control flow graph of a function.
     Vertices are basic blocks of statements.
-    Edges are the control flow between the basic blocks and liveness variables.
+    Edges are the control flow between the basic blocks.
+    Jumps to labels outside of the function (e.g. end_<function>) and
+    returns are edges to the exit.
     '''
     class BasicBlock:
-        def __init__(self, statements: List[ir_stmt], jmp_name: str , jmp_type: str, label: str):
-            self.statements = statements
-            # self.live_variables = set()
-            # self.live_visited = False
+        def __init__(self, index: int, label: str, start: int, statements: List[ir_stmt]):
+            self.index = index
             self.label = label
-            self.jmp_type = jmp_type
-            self.jmp_name = jmp_name
-            self.entry = None
-            self.exit = None
-            self.next_blocks = set()
-            self.prev_blocks = set()
-
-        def add_next_block(self, block):
-            self.next_blocks.add(block)
-
-        def add_prev_block(self, block):
-            self.prev_blocks.add(block)
-
-        def get_next_blocks(self):
-            return self.next_blocks
-        
-        def get_prev_blocks(self):
-            return self.prev_blocks
+            # Index of the first statement of the block in the function body
+            self.start = start
+            self.statements = statements
+            self.next_blocks: List['CFG.BasicBlock'] = []
+            self.prev_blocks: List['CFG.BasicBlock'] = []
+            self.exits = False
+            # Bitsets over CFG.variables: (reads, writes) of each statement, and of the block
+            self.read_write: List[Tuple[int, int]] = []
+            self.gen = 0
+            self.kill = 0
+            self.live_in = 0
+            self.live_out = 0
 
         def print(self, file=sys.stdout):
-            print_ir(self.statements, file=file)
+            for stmnt in self.statements:
+                print_ir(stmnt, file=file, indent=TAB_PREF)
 
         def __repr__(self):
             return f'BasicBlock({self.label})'
 
         def __str__(self):
-            str = StringIO()
-            self.print(stream=str)
-            return str.getvalue()
-
-    def __init__(self, function: ir_Function):
-        self.basic_blocks = []
-        self.block_dict = {}
-        self.variables = dict()
-        self._create_basic_blocks(function)
+            s = StringIO()
+            self.print(file=s)
+            return s.getvalue()
+
+    def __init__(self, function: ir_Function, read_write_sets: ReadWriteSets = None, exit_live: Iterable[str] = ()):
+        if read_write_sets is None:
+            function.update_variables()
+            variables = function.variables
+            read_write_sets = lambda s: ir_get_read_write_sets(s, variables)
+        self.read_write_sets = read_write_sets
+        self.basic_blocks: List[CFG.BasicBlock] = []
+        self.block_dict: Dict[str, CFG.BasicBlock] = {}
+        # Numbered variable table for the bitsets
+        self.variables: Dict[str, int] = {}
+        self.names: List[str] = []
+        self._create_basic_blocks(function.body)
+        self._link_blocks()
+        self.update_read_write_sets()
+        self.exit_live = self.to_bits(exit_live)
+
+    def _create_basic_blocks(self, body: List[ir_stmt]):
+        '''
+        Split the body into basic blocks.
+        A block starts at a label (or after a control statement) and ends at a control statement.
+        '''
+        statements, start, label = [], 0, None
+        def add_block():
+            block = CFG.BasicBlock(len(self.basic_blocks), label, start, statements)
+            self.basic_blocks.append(block)
+            if label is not None:
+                self.block_dict[label] = block
+        for i, stmnt in enumerate(body):
+            name = _label_name(stmnt)
+            if name is not None and statements:
+                add_block()
+                statements, start, label = [], i, None
+            if not statements:
+                label = name
+            statements.append(stmnt)
+            if not _jump_targets(stmnt)[1]:
+                add_block()
+                statements, start, label = [], i + 1, None
+        if statements or not self.basic_blocks:
+            add_block()
+
+    def _link_blocks(self):
+        ''' Add the edges between blocks '''
+        for block in self.basic_blocks:
+            targets, falls_through = _jump_targets(block.statements[-1]) if block.statements else ([], True)
+            for name in targets:
+                succ = self.block_dict.get(name)
+                if succ is None:
+                    block.exits = True
+                else:
+                    self._add_edge(block, succ)
+            if falls_through:
+                if block.index + 1 < len(self.basic_blocks):
+                    self._add_edge(block, self.basic_blocks[block.index + 1])
+                else:
+                    block.exits = True
+            elif not targets:
+                block.exits = True
 
-    def _create_basic_blocks(self, function: ir_Function):
+    def update_read_write_sets(self):
         '''
-        From an ir_Function, construct all vertices (no edges) by iterating through ir_stmnt's
+        Compute the read/write sets of the statements and the gen/kill sets of
+        the blocks, again after passes changed the statements of the blocks in
+        place (the edges are kept, see remove_edge).
         '''
-        # label = function.name
-        # statements = []
-
-        # def add_block(statements, label):
-        #     block = CFG.BasicBlock(statements, None, None, label)
-        #     self.basic_blocks.append(block)
-        #     self.block_dict[label] = block
-
-        # for statement in function.body:
-        #     if isinstance(statement, ir_Label):
-        #         if statements:
-        #             self.add_basic_block(statements, label)
-        #             statements = []
-        #         label = statement.name
-        #     elif isinstance(statement, ir_Jump):
-        #         statements.append(statement)
-        #         self.add_basic_block(statements, label, jmp_name=statement.name, jmp_type='jump')
-        #         statements = []
-        #     elif isinstance(statement, ir_CJump):
-        #         statements.append(statement)
-        #         self.add_basic_block(statements, label, jmp_name=statement.true_name, jmp_type='cjump')
-        #         statements = []
-        #     else:
-        #         statements.append(statement)
+        start = 0
+        for block in self.basic_blocks:
+            block.start = start
+            start += len(block.statements)
+            block.read_write = [tuple(map(self.to_bits, self.read_write_sets(stmnt))) for stmnt in block.statements]
+            block.gen = block.kill = 0
+            for reads, writes in reversed(block.read_write):
+                block.kill |= writes
+                block.gen = reads | (block.gen & ~writes)
+
+    @staticmethod
+    def _add_edge(block: 'CFG.BasicBlock', succ: 'CFG.BasicBlock'):
+        block.next_blocks.append(succ)
+        succ.prev_blocks.append(block)
+
+    @staticmethod
+    def remove_edge(block: 'CFG.BasicBlock', succ: 'CFG.BasicBlock'):
+        ''' Remove an edge, e.g. to the label a branch no longer goes to '''
+        block.next_blocks.remove(succ)
+        succ.prev_blocks.remove(block)
+
+    def statements(self) -> List[ir_stmt]:
+        ''' The statements of the blocks in order (the function body) '''
+        return [stmnt for block in self.basic_blocks for stmnt in block.statements]
+
+    def to_bits(self, names: Iterable[str]) -> int:
+        bits = 0
+        for name in names:
+            i = self.variables.get(name)
+            if i is None:
+                i = self.variables[name] = len(self.names)
+                self.names.append(name)
+            bits |= 1 << i
+        return bits
+
+    def to_set(self, bits: int) -> Set[str]:
+        # Find the ones in the binary digits, shifting the bitset for every bit would copy it every time
+        digits = format(bits, 'b')[::-1]
+        names = set()
+        i = digits.find('1')
+        while i >= 0:
+            names.add(self.names[i])
+            i = digits.find('1', i + 1)
+        return names
 
     def get_entry_block(self):
         return self.basic_blocks[0]
-    
-    def get_exit_block(self):
-        return self.basic_blocks[-1]
 
-    def _get_block(self, label: str):
+    def liveness(self):
+        '''
+        Solve live-in/live-out for every block with a worklist.
+        live_out(b) = U live_in(s) for s in succ(b) (plus the exit live set)
+        live_in(b) = gen(b) | (live_out(b) & ~kill(b))
+        '''
         for block in self.basic_blocks:
-            if block.label == label:
-                return block
-        return None
-
-    # Add a basic block to the CFG with the given statement list
-    def add_basic_block(self, statements: list[IR_Statement], label: str = None, entry: bool = False, exit: bool = False, jmp_name: str = None , jmp_type: str = None):
-        block = BasicBlock(statements, label = label, entry = entry, exit = exit, jmp_name = jmp_name, jmp_type =jmp_type)
-        self.basic_blocks.append(block)
-        if entry:
-            self.entry_block = block
-        if exit:
-            self.exit_block = block
-        return block
-    
-    def get_block_label(self, block: BasicBlock):
-        for statement in block.statements:
-            if statement.type == IR_Statement.LABEL:
-                return statement.str_arg
-        return None
-
-
-    # Goes through Module and creates a CFG
-    def create_CFG(self):
-        #Adds statements to a list until a jump is found
-        #Then adds the list to a new basic block and clears the list
-        self.basic_blocks = []
-        self.block_dict = {}
-        self.variables = dict()
-        statements = []
-        entry = True
-        label = 'entry'
-        label_true = True
-        for statement in module.statements:
-            # if isinstance(statement.src, IR_Variable):
-            #     if statement.src not in self.variables:
-            #         self.variables[statement.src.name] = statement.src
-            # if isinstance(statement.dest, IR_Variable):
-            #     if statement.dest not in self.variables:
-            #         self.variables[statement.dest.name] = statement.dest
-            if statement.type == IR_Statement.LABEL:
-                if label_true:
-                    self.add_basic_block(statements, label=label, entry=entry)
-                    statements = []
-                    entry = False
-                    label_true = False
-                    label = statement.str_arg
-                else:
-                    label = statement.str_arg
-                    label_true = True
-            statements.append(statement)
-            if statement.type == IR_Statement.JUMP:
-                #if jump is jmp, dont add a new basic block as next block
-                #print(statement.src)
-                self.add_basic_block(statements, label=label, entry=entry, jmp_name=statement.str_arg, jmp_type=statement.type)
-                statements = []
-                entry = False
-                label_true = False
-            elif statement.type == IR_Statement.JUMPEQ:
-                #if jump is jumpeq, add a new basic block as next block
-                self.add_basic_block(statements, label=label, entry=entry, jmp_name=statement.str_arg, jmp_type=statement.type)
-                statements = []
-                entry = False
-                label_true = False
-            elif statement.type == IR_Statement.JUMPNE:
-                #if jump is jumpne, add a new basic block as next block
-                self.add_basic_block(statements, label=label, entry=entry, jmp_name=statement.str_arg, jmp_type=statement.type)
-                statements = []
-                entry = False
-                label_true = False
-        #Adds the last list of statements to a basic block
-        self.add_basic_block(statements, label=label, exit=True)
-        #Sets the next and previous blocks for each basic block
-
-
-        for i, block in enumerate(self.basic_blocks):
-            if block.jmp_type == IR_Statement.JUMP:
-                for b in self.basic_blocks:
-                    # print(b.label, " ", block.jmp_name)
-                    if b.label == block.jmp_name:
-                        block.next_blocks.append(b)
-                        b.prev_blocks.append(block)
-            elif block.jmp_type == IR_Statement.JUMPEQ:              
-                for b in self.basic_blocks:
-                    if b.label == block.jmp_name:
-                        block.next_blocks.append(b)
-                        b.prev_blocks.append(block)
-                # also add the next block as the next block
-                block.next_blocks.append(self.basic_blocks[i + 1])
-                self.basic_blocks[i + 1].prev_blocks.append(block)
-            elif block.jmp_type == IR_Statement.JUMPNE:
-                for b in self.basic_blocks:
-                    if b.label == block.jmp_name:
-                        block.next_blocks.append(b)
-                        b.prev_blocks.append(block)
-                # also add the next block as the next block
-                block.next_blocks.append(self.basic_blocks[i + 1])
-                self.basic_blocks[i + 1].prev_blocks.append(block)
-            elif not block.exit:
-                # if no jump, add the next block as the next block
-                block.next_blocks.append(self.basic_blocks[i + 1])
-                self.basic_blocks[i + 1].prev_blocks.append(block)
-
-        print('\n\nBasic Blocks: ')
+            block.live_in = block.live_out = 0
+        worklist = deque(reversed(self.basic_blocks))
+        pending = set(b.index for b in self.basic_blocks)
+        while worklist:
+            block = worklist.popleft()
+            pending.discard(block.index)
+            out = self.exit_live if block.exits else 0
+            for succ in block.next_blocks:
+                out |= succ.live_in
+            block.live_out = out
+            live_in = block.gen | (out & ~block.kill)
+            if live_in != block.live_in:
+                block.live_in = live_in
+                for pred in block.prev_blocks:
+                    if pred.index not in pending:
+                        pending.add(pred.index)
+                        worklist.append(pred)
+        return self
+
+    def live_after(self) -> List[Set[str]]:
+        '''
+        The set of live variables after each statement of the function body (in body order).
+        Must be called after liveness().
+        '''
+        live_after = []
         for block in self.basic_blocks:
-            print(block.label)
-            block.print()
-            print(block.next_blocks)
-            print(block.prev_blocks)
-            print(block.jmp_name)
-            print('\n')
-
-
-
-        # Create a block dictionary indexed by it's label
-        self.block_dict = { label: block for block in self.basic_blocks }
-        
-
-    # MOVE = 'movl'
-    # ADD = 'addl'
-    # SUB = 'subl'
-    # NEG = 'negl'
-    # PUSH = 'pushl'
-    # POP = 'popl'
-    # RET = 'ret'
-    # CALL = 'call'
-    # DIRECTIVE_GLOBAL = '.global'
-    # LABEL = 'LABEL'
-    # JUMP = 'jmp'  # jmp label
-    # JUMPEQ = 'je'  # je label
-    # JUMPNE = 'jne'  # jne label
-    # CMP = 'cmpl'  # cmpl %eax, %ebx 
-    # SETEQ = 'sete'  # sete %al
-    # SETNE = 'setne'  # setne %al
-    # MOVZBL = 'movzbl'  # movzbl %al, %eax
-
-        
+            live = block.live_out
+            block_live = []
+            for reads, writes in reversed(block.read_write):
+                block_live.append(live)
+                live = reads | (live & ~writes)
+            block_live.reverse()
+            live_after.extend(block_live)
+        cache = {}
+        return [cache[b] if b in cache else cache.setdefault(b, self.to_set(b)) for b in live_after]
+
+    def print(self, file=sys.stdout):
+        for block in self.basic_blocks:
+            file.write(f'{block.label}: -> {[b.label for b in block.next_blocks]}\n')
+            file.write(f'{TAB_PREF}# live in: {sorted(self.to_set(block.live_in))}\n')
+            block.print(file=file)
+            file.write(f'{TAB_PREF}# live out: {sorted(self.to_set(block.live_out))}\n')
+
+
 # def IR_get_read_write_sets(stmnt: IR_Statement):
 #     """
 #     Return (read set, write set) tuple"""
@@ -20,10 +20,37 @@ class ClosureTransformer(BodyStacker):
         super().__init__()
         self.prefix = prefix
         self.functions = {}
+        self.function_labels = set()
+
+    def visit_Module(self, node):
+        # Every function becomes a label of the module (see AST_to_IR), so the
+        # functions it calls by name are not free variables, unless the name is
+        # also assigned somewhere
+        functions = [n for n in walk(node) if isinstance(n, FunctionDef)]
+        self.function_labels = {n.name for n in functions} - self.find_defined_vars(node)
+        # Find the free variables of every function up front, whatever the
+        # order they are defined and call each other in
+        modified = True
+        while modified:
+            modified = False
+            for n in functions:
+                free_vars = sorted(self.find_free_vars(n))
+                if free_vars != self.functions.get(n.name, []):
+                    self.functions[n.name] = free_vars
+                    modified = True
+        # The calls pass the free variables by name, which a function value cannot get
+        called = {id(n.func) for n in walk(node) if isinstance(n, Call)}
+        for n in walk(node):
+            if isinstance(n, Name) and isinstance(n.ctx, Load) and id(n) not in called \
+                    and n.id in self.function_labels and self.functions.get(n.id):
+                raise Exception(f"Function {n.id} uses free variables, it can only be called by name")
+        return super().visit_Module(node)
 
     def visit_FunctionDef(self, node):
-        # Find the free variables
-        free_vars = self.find_free_vars(node)
+        # The free variables were found by visit_Module (sorted so the argument
+        # order is deterministic), so calls inside the body pass them too
+        free_vars = self.functions.get(node.name, [])
+        super().visit_FunctionDef(node)
         if free_vars:
             # # Rename all of the vars in the function
             # class VarRenamer(NodeTransformer):
@@ -34,8 +61,6 @@ class ClosureTransformer(BodyStacker):
             # free_vars = {f'cloj_{var}' for var in free_vars}
             # Create a new function
             new_func = self.create_closure(node, free_vars)
-            # Add the new function to the list of functions
-            self.functions[new_func.name] = free_vars
             # # Replace the old function with a call to the new function
             # return self.replace_with_closure_call(node, free_vars)
             return new_func
@@ -48,8 +73,15 @@ class ClosureTransformer(BodyStacker):
         # Find the variables that are defined in the function
         defined_vars = self.find_defined_vars(node)
         # Find the variables that are free
-        free_vars = used_vars - defined_vars
+        free_vars = used_vars - defined_vars - self.function_labels
+        # A call passes the free variables of the callee, so they are free here too
+        for callee in self.find_called_functions(node):
+            free_vars.update(v for v in self.functions.get(callee, []) if v not in defined_vars)
         return free_vars
+
+    def find_called_functions(self, node):
+        ''' Find the names of the functions called (by name) in a function. '''
+        return {n.func.id for n in walk(node) if isinstance(n, Call) and isinstance(n.func, Name)}
     
     def find_used_vars(self, node):
         ''' Find the variables that are used in a function. '''
@@ -82,6 +114,7 @@ class ClosureTransformer(BodyStacker):
         return node
 
     def visit_Call(self, node):
+        self.generic_visit(node)
         # Check if the function is a closure
         if node.func.id in self.functions:
             # Replace the function call with a call to the closure
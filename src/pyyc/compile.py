@@ -8,6 +8,10 @@ import os
 # import re
 # import io
 import sys
+import argparse
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 from ast import *
 
 from file_utils import getProgramTree
@@ -15,6 +19,7 @@ from flatten import *
 from desugar import *
 from box_front import *
 from closure import ClosureTransformer
+from inplace import mark_in_place_adds
 from x86 import x86_unparse
 from to_x86 import *
 from tree_utils import *
@@ -24,24 +29,77 @@ import explicate as exp
 # from cfg import *
 import P1
 import lambda_util
+from type_inference import infer_types
+from optimize import optimize_ir
+import compile_cache
+from stats import CompileStats, write_stats
+
+# The intermediate representations which can be dumped (--dump or PYYC_DUMP).
+# Nothing is printed or written besides the .s unless it is asked for.
+# - flat and pyobj also write the .flatpy and .pyobjpy files
+# - ir prints the IR before and after optimization (with the pass statistics)
+# - x86 prints the x86 before register assignment and the final x86
+DUMPS = ('original', 'flat', 'closure', 'pyobj', 'ir', 'x86')
+
+def parse_dumps(spec: str):
+    ''' Parse a comma separated list of DUMPS ('all' for every one) '''
+    dumps = {d.strip() for d in spec.split(',') if d.strip()}
+    if 'all' in dumps:
+        return frozenset(DUMPS)
+    unknown = dumps.difference(DUMPS)
+    if unknown:
+        raise ValueError(f"Unknown dump {', '.join(sorted(unknown))} (choose from {', '.join(DUMPS)} or all)")
+    return frozenset(dumps)
+
+def compile(path_py, dumps=frozenset(), cache=False, stats=False):
+    '''
+    Compile path_py to a .s file next to it.
+    With cache, an unchanged program (compiled by an unchanged compiler) is copied
+    from the cache instead (see compile_cache.py). Dumps and stats always compile.
+    With stats, returns the CompileStats of the phases (see stats.py).
+    '''
+    path_s = path_py[:-3] + '.s'
 
-    
-
-def printUsage():
-    print(f"Usage: {sys.argv[0]} <input.py>")
-    
-def compile(path_py):
-    print("Compiling", path_py, "to", path_py[:-3] + ".s", end='\n\n')
+    if cache:
+        with open(path_py, 'rb') as f:
+            source = f.read()
+        if not dumps and not stats and compile_cache.lookup(source, path_s):
+            return None
+
+    if stats:
+        stats = CompileStats(path_py)
+        # tracemalloc makes the phases several times slower, so they are timed
+        # in one compile and their memory is taken in a second, traced one
+        compile_phases(path_py, dumps, stats.run)
+        stats.start_tracing()
+        # Stop tracing the allocations even if a phase raises, the worker process goes on with other files
+        try:
+            compile_phases(path_py, frozenset(), stats.trace)
+        finally:
+            stats.close()
+    else:
+        compile_phases(path_py, dumps, lambda name, run, *args: run(*args))
+    if cache:
+        compile_cache.store(source, path_s)
+    return stats if stats else None
+
+def compile_phases(path_py, dumps, phase):
+    '''
+    Compile path_py to a .s file next to it, calling phase(name, run, *args)
+    to run every phase (see CompileStats.run).
+    '''
+    if dumps:
+        print("Compiling", path_py, "to", path_py[:-3] + ".s", end='\n\n')
     # Replace the .py extension with .flatpy and .s respectively
     path_flatpy = path_py[:-3] + '.flatpy'
     path_pyobjpy = path_py[:-3] + '.pyobjpy'
     path_s = path_py[:-3] + '.s'
 
     # read file as AST and flatten
-    tree = getProgramTree(path_py)
-    code = unparse(tree)
-    print("ORIGINAL:")
-    print(code, end='\n\n')
+    tree = phase('parse', getProgramTree, path_py)
+    if 'original' in dumps:
+        print("ORIGINAL:")
+        print(unparse(tree), end='\n\n')
 
     # print("ORIGINAL AST:")
     # print(dump(tree, indent=2), end='\n\n')
@@ -51,72 +109,72 @@ def compile(path_py):
 
     # ensure the tree is valid P1
     # TODO: add more checks to ensure valid P1
-    P1.EnsureValid('P1_').transform(tree)
+    phase('validate', P1.EnsureValid('P1_').transform, tree)
 
     # Rename user variables to avoid conflicts with builtins and temps
-    renameUserVariables(tree)
+    phase('rename', renameUserVariables, tree)
 
     def flatten(tree, num=0):
-        old_code = None
+        # The passes transform the module in place and count the changes they make
+        def run(transformer: BodyStacker):
+            transformer.transform(tree)
+            return transformer.modified
         # Need to run until no changes are made
-        while old_code != unparse(tree):
-            old_code = unparse(tree)
-            DesugarUnaryConstantTransformer('u_').transform(tree)
-            # Convert Ternary operations into If statements
-            tree = DesugarTernaryTransformer(f't{num}_').transform(tree)
+        modified = True
+        while modified:
+            modified = run(DesugarUnaryConstantTransformer('u_'))
             # Convert lambda functions into FunctionDefs
-            old_lambda = None
-            while old_lambda != unparse(tree):
-                old_lambda = unparse(tree)
-                tree = DesugarLambdaTransformer(f'lambda{num}_').transform(tree)
-                print("LAMBDA:")
+            while lambdas := run(DesugarLambdaTransformer(f'lambda{num}_')):
+                modified += lambdas
+            # Convert Ternary operations into If statements (after the lambdas,
+            # so the If of a ternary in a lambda goes into its FunctionDef)
+            modified += run(DesugarTernaryTransformer(f't{num}_'))
             # print(dump(tree, indent=2), end='\n\n')
             # flatten and export as .flatpy for intermediate testing
-            tree = FlattenTreeTransformer(f'f{num}_').transform(tree)
+            modified += run(FlattenTreeTransformer(f'f{num}_'))
             # print(dump(tree, indent=2), end='\n\n') 
             # Convert BoolOp nodes into If statments
-            tree = DesguarShortCircuitTransformer(f's{num}_').transform(tree)
+            modified += run(DesguarShortCircuitTransformer(f's{num}_'))
             # DesugarTreeTransformer.transform(tree, type="bool")
-            tree = FlattenTreeTransformer(f'f{num}_').transform(tree)
+            modified += run(FlattenTreeTransformer(f'f{num}_'))
 
-    flatten(tree)
+    phase('flatten', flatten, tree)
     # TODO: constant folding -> evaluate constant conditonals and comparisons
     # TODO: Precompute injections using the constant folding
-    tree_flat = "'''\n" + dump(tree, indent=2) + "\n'''\n"
-    code_flat = unparse(tree)
-    print("FLAT:")
-    print(code_flat, end='\n\n')
-    # print("FLAT AST:")
-    # print(dump(tree, indent=2), end='\n\n')
-    with open(path_flatpy, 'w') as f:
-        f.write(code_flat)
-        f.write('\n' * 2)
-        f.write("# FLAT AST:\n")
-        f.write(tree_flat)
+    if 'flat' in dumps:
+        tree_flat = "'''\n" + dump(tree, indent=2) + "\n'''\n"
+        code_flat = unparse(tree)
+        print("FLAT:")
+        print(code_flat, end='\n\n')
+        with open(path_flatpy, 'w') as f:
+            f.write(code_flat)
+            f.write('\n' * 2)
+            f.write("# FLAT AST:\n")
+            f.write(tree_flat)
 
     # Convert functions into closure form
-    tree = ClosureTransformer('c').transform(tree)
-    code_closure = unparse(tree)
-    print("CLOSURE:")
-    print(code_closure, end='\n\n')
+    tree = phase('closure', ClosureTransformer('c').transform, tree)
+    if 'closure' in dumps:
+        print("CLOSURE:")
+        print(unparse(tree), end='\n\n')
 
+    # Let `l = l + r` append to l when no other reference to the list can exist
+    phase('in_place', mark_in_place_adds, tree)
 
-    tree = Explicate('exp').transform(tree)
+    tree = phase('explicate', Explicate('exp').transform, tree)
     # FlattenTreeTransformer('f').transform(tree)
-    flatten(tree, num=1)
-    # print("PY_OBJ AST:")
-    tree_flat = "'''\n" + dump(tree, indent=2) + "\n'''\n"
-    code_pyobj = unparse(tree)
-    print("PYOBJ:")
-    print(code_pyobj, end='\n\n')
-    # print("PYOBJ AST:")
-    # print(dump(tree, indent=2), end='\n\n')
-    with open(path_pyobjpy, 'w') as f:
-        code_pyobj = exp.PYTHON_RUNTIME_FAKE_HEADER + code_pyobj
-        f.write(code_pyobj)
-        f.write('\n' * 2)
-        f.write("# PY_OBJ AST:\n")
-        f.write(tree_flat)
+    phase('flatten_explicated', flatten, tree, 1)
+    if 'pyobj' in dumps:
+        tree_flat = "'''\n" + dump(tree, indent=2) + "\n'''\n"
+        code_pyobj = unparse(tree)
+        print("PYOBJ:")
+        print(code_pyobj, end='\n\n')
+        with open(path_pyobjpy, 'w') as f:
+            code_pyobj = exp.PYTHON_RUNTIME_FAKE_HEADER + code_pyobj
+            f.write(code_pyobj)
+            f.write('\n' * 2)
+            f.write("# PY_OBJ AST:\n")
+            f.write(tree_flat)
 
     # deleteFlatOnly(tree)
     # fix_missing_locations(tree)
@@ -137,15 +195,15 @@ def compile(path_py):
     # # insert function entry (ABI)
     # # prog.functionEntry('main', nvars = len(vars))
     # # convert each flat statement into x86
-    
+
     # Assuming proper flattening:
     # x86Transformer.transform(tree, prog, vars)
     # convert to x86_IR
     # x86_IR: IR_Function = x86_IR_Transformer().transform(tree)
-    ir = AST_to_IR().transform(tree)
-    print("\n\nIR:")
-    # print("IR RETURN VALUE:", ir, type(ir))
-    print_ir(ir)
+    ir = phase('to_ir', AST_to_IR().transform, tree)
+    if 'ir' in dumps:
+        print("\n\nIR:")
+        print_ir(ir)
     # Do liveness analysis
     # print("x86 IR:")
     # x86_IR.print_structure()
@@ -153,30 +211,33 @@ def compile(path_py):
     # print("\n\nx86 IR (comments):")
     # x86_IR.print(print_comments=False, print_liveness=False)
 
-    def optimize_ir(ir):
-        # TODO: optimize the IR
-        # TODO: constant folding
-        # TODO: copy folding
-        # TODO: dead store elimination
-        # TODO: dead code elimination
-        ...
+    # Remove the boxing/unboxing and tag checks on values with known types
+    phase('infer_types', infer_types, ir)
 
-    optimize_ir(ir)
-    lambda_util.get_lambda_funcs(ir)
+    # Constant folding, copy propagation, dead store and dead code elimination
+    optimizer = phase('optimize', optimize_ir, ir)
+    if 'ir' in dumps:
+        print("\n\nIR (optimized):")
+        print_ir(ir)
+        print("IR optimization stats:")
+        optimizer.print_stats()
+    phase('lambdas', lambda_util.get_lambda_funcs, ir)
 
 
     # After optimization, convert to x86
     # TODO: pass the liveness in for better register allocation
     # x86 = IR_to_x86().transform(ir)
-    x86: ir_Module = ir_Module_to_x86_Transformer('x86').transform(ir)
+    x86: ir_Module = phase('to_x86', ir_Module_to_x86_Transformer('x86', dump='x86' in dumps).transform, ir)
         # TODO: CFG
         # TODO: liveness analysis
-    
-    print("\n\nFinal x86")
-    x86_unparse(x86)
-    with open(path_s, 'w') as f:
-        x86_unparse(x86, f)
-    return
+
+    if 'x86' in dumps:
+        print("\n\nFinal x86")
+        x86_unparse(x86)
+    def emit(x86):
+        with open(path_s, 'w') as f:
+            x86_unparse(x86, f)
+    phase('emit', emit, x86)
 
     # graph = CFG()
     # graph.create_CFG(x86_IR)
@@ -243,23 +304,91 @@ def compile(path_py):
     # prog.functionExit()
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        printUsage()
-        exit(-1)
+def compile_worker(path_py, dumps=frozenset(), cache=False, stats=False):
+    '''
+    Compile one file of a batch in a worker process.
+    Each worker process has its own TempContext.temp_gen, so the files do not share temporaries.
+    Returns the path, the traceback of the failure (None on success) and the stats (a dict, with stats).
+    '''
+    try:
+        file_stats = compile(path_py, dumps, cache, stats)
+    except Exception:
+        return path_py, traceback.format_exc(), None
+    return path_py, None, file_stats.to_dict() if file_stats else None
+
+def silence_worker():
+    ''' The intermediate dumps of the files would be interleaved, so drop the workers' stdout '''
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+
+def compile_directory(path_dir, jobs=None, dumps=frozenset(), cache=False, stats=None, log=sys.stdout):
+    '''
+    Compile all .py files in a directory across a pool of processes.
+    With a stats list, the stats of every compiled file are appended to it.
+    The compiled files and the summary are printed to log, the failures to stderr.
+    Returns the number of files which failed to compile.
+    '''
+    py_paths = sorted(os.path.join(path_dir, f) for f in os.listdir(path_dir) if f.endswith(".py"))
+    failures = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=silence_worker) as executor:
+        results = executor.map(compile_worker, py_paths, itertools.repeat(dumps), itertools.repeat(cache),
+                               itertools.repeat(stats is not None))
+        for path_py, error, file_stats in results:
+            if file_stats is not None:
+                stats.append(file_stats)
+            if error is None:
+                print("Compiled", path_py, file=log)
+            else:
+                print("FAILED", path_py, file=sys.stderr)
+                print(error, file=sys.stderr)
+                failures.append(path_py)
+    print(f"{len(py_paths) - len(failures)}/{len(py_paths)} files compiled", file=log)
+    return len(failures)
 
-    path_py = sys.argv[1]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile python3.10 to x86")
+    parser.add_argument("path", help="the .py file to compile, or a directory of .py files")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of processes for compiling a directory (default: number of CPUs)")
+    parser.add_argument("--dump", default=os.environ.get("PYYC_DUMP", ""),
+                        help=f"comma separated intermediate representations to dump: {','.join(DUMPS)} or all "
+                             "(default: $PYYC_DUMP or none)")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", default=compile_cache.enabled_by_default(),
+                        help="always compile instead of reusing the .s of an unchanged file "
+                             "(the cache is on unless PYYC_CACHE=0, see compile_cache.py)")
+    parser.add_argument("--stats", action="store_true",
+                        help="print the time, memory, node counts and temporaries of every compiler phase "
+                             "as JSON (see stats.py)")
+    parser.add_argument("--stats-file", metavar="FILE",
+                        help="write the --stats JSON to FILE instead of stdout (implies --stats)")
+    args = parser.parse_args()
+    if args.stats_file:
+        args.stats = True
+    stats_path = args.stats_file or '-'
+    try:
+        dumps = parse_dumps(args.dump)
+    except ValueError as e:
+        parser.error(str(e))
+
+    path_py = args.path
     if not os.path.exists(path_py):
         print(f"Invalid path given {path_py}")
         exit(-2)
     
     # If the path is a directory, compile all .py files in it
     if os.path.isdir(path_py):
-        py_paths = [os.path.join(path_py, f) for f in os.listdir(path_py) if f.endswith(".py")]
-        for path_py in py_paths:
-            compile(path_py)
+        stats = [] if args.stats else None
+        # Keep stdout for the JSON when the stats go there
+        log = sys.stderr if args.stats and stats_path == '-' else sys.stdout
+        failures = compile_directory(path_py, args.jobs, dumps, args.cache, stats, log)
+        if args.stats:
+            write_stats(stats, stats_path)
+        if failures:
+            exit(1)
     elif path_py.endswith(".py"):
-        compile(path_py)
+        stats = compile(path_py, dumps, args.cache, stats=args.stats)
+        if args.stats:
+            write_stats(stats.to_dict(), stats_path)
     else:
         print("Invalid path given")
         exit(-3)
@@ -0,0 +1,77 @@
+'''
+Content-addressed cache of the compiled .s files.
+
+The key is a hash of the program source and of the compiler itself (every
+.py module next to this one, and the version of the python running it, whose
+ast module it uses), so changing any of them misses the cache and nothing
+has to be invalidated by hand. An entry is stored at
+<cache dir>/<key[:2]>/<key>.s, written to a temporary file and renamed into
+place, so the processes of compile_directory can share the cache.
+
+The cache directory is $PYYC_CACHE_DIR, or $XDG_CACHE_HOME/pyyc
+(~/.cache/pyyc by default). PYYC_CACHE=0 (or --no-cache) turns it off.
+'''
+
+import os
+import sys
+import glob
+import shutil
+import hashlib
+import tempfile
+from functools import lru_cache
+from typing import Optional
+
+COMPILER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def enabled_by_default() -> bool:
+    return os.environ.get('PYYC_CACHE', '1') != '0'
+
+def cache_dir() -> str:
+    if 'PYYC_CACHE_DIR' in os.environ:
+        return os.environ['PYYC_CACHE_DIR']
+    xdg = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(xdg, 'pyyc')
+
+@lru_cache(maxsize=None)
+def compiler_hash() -> str:
+    ''' Hash of the compiler's modules (names and contents) and of the python version '''
+    digest = hashlib.sha256(sys.version.encode() + b'\0')
+    for path in sorted(glob.glob(os.path.join(COMPILER_DIR, '*.py'))):
+        digest.update(os.path.basename(path).encode() + b'\0')
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def cache_key(source: bytes) -> str:
+    return hashlib.sha256(compiler_hash().encode() + b'\0' + source).hexdigest()
+
+def entry_path(key: str) -> str:
+    return os.path.join(cache_dir(), key[:2], key + '.s')
+
+def lookup(source: bytes, path_s: str) -> bool:
+    ''' Copy the cached .s for source to path_s, returns False on a miss '''
+    try:
+        shutil.copyfile(entry_path(cache_key(source)), path_s)
+    except FileNotFoundError:
+        return False
+    return True
+
+def store(source: bytes, path_s: str) -> Optional[str]:
+    '''
+    Add the compiled path_s for source to the cache, returns the entry (None if it could not be written).
+    A cache which cannot be written (read-only, full disk) only costs the next compile.
+    '''
+    entry = entry_path(cache_key(source))
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+    except OSError:
+        return None
+    try:
+        with os.fdopen(fd, 'wb') as f, open(path_s, 'rb') as s:
+            shutil.copyfileobj(s, f)
+        os.replace(tmp, entry)
+    except OSError:
+        os.unlink(tmp)
+        return None
+    return entry
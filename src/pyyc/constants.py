@@ -2,3 +2,27 @@ import os
 
 TESTS_DIR = os.path.join(os.path.dirname(__file__), "tests/P0")
 
+
+# pyobj tag layout (must match runtime/runtime.h)
+MASK = 3
+SHIFT = 2
+INT_TAG = 0
+BOOL_TAG = 1
+BIG_TAG = 3
+
+# inject_int/inject_bool and project_int/project_bool box and unbox through a
+# C int, so only the low INT_BITS bits of a boxed value (tag included) are kept
+INT_BITS = 32
+
+def to_c_int(value: int) -> int:
+    ''' The value of a C int holding the low INT_BITS bits of value '''
+    value &= (1 << INT_BITS) - 1
+    return value - (1 << INT_BITS) if value >> (INT_BITS - 1) else value
+
+def inject_value(value: int, tag: int) -> int:
+    ''' The pyobj inject_int/inject_bool return for value '''
+    return to_c_int(value << SHIFT) | tag
+
+def project_value(value: int) -> int:
+    ''' The int project_int/project_bool return for the pyobj value '''
+    return to_c_int(value >> SHIFT)
@@ -0,0 +1,131 @@
+'''
+Helpers shared by the forward analyses over the IR (type_inference.py and
+the passes of optimize.py).
+
+A state maps variable names to facts; a fact holds at the start of a block
+if it holds on every incoming edge. Dominators tell where the facts of a
+variable which is assigned once hold without following them along the edges.
+'''
+
+import heapq
+from typing import Dict, List
+
+from IR import *
+from cfg import CFG
+
+State = Dict[str, object]
+
+def constant(value: int) -> ir_Constant:
+    return ir_Constant(value=int(value), type=ir_int)
+
+def meet(states: List[State]) -> State:
+    '''
+    Keep only the facts which hold on every incoming edge.
+    With a single edge its state is returned as it is, so it must not be changed.
+    '''
+    if len(states) == 1:
+        return states[0]
+    states = sorted(states, key=len)
+    state = states[0]
+    for other in states[1:]:
+        state = {var: fact for var, fact in state.items() if other.get(var) == fact}
+    return state
+
+def reverse_postorder(cfg: CFG) -> Dict[int, int]:
+    '''
+    Number the blocks reachable from the entry in reverse postorder, so that
+    (back edges aside) a block comes after all of its predecessors.
+    Returns the number of each block by its index.
+    '''
+    entry = cfg.get_entry_block()
+    postorder = []
+    visited = {entry.index}
+    stack = [(entry, iter(entry.next_blocks))]
+    while stack:
+        block, successors = stack[-1]
+        for succ in successors:
+            if succ.index not in visited:
+                visited.add(succ.index)
+                stack.append((succ, iter(succ.next_blocks)))
+                break
+        else:
+            stack.pop()
+            postorder.append(block)
+    return {block.index: number for number, block in enumerate(reversed(postorder))}
+
+class Dominators:
+    '''
+    The dominator tree of the blocks reachable from the entry: a block
+    dominates another if every path from the entry to the other goes
+    through it. Computed with the iterative algorithm of Cooper, Harvey and
+    Kennedy over the reverse postorder, and numbered in a depth first walk
+    of the tree so dominates() is two comparisons.
+    '''
+    def __init__(self, cfg: CFG, order: Dict[int, int] = None):
+        if order is None:
+            order = reverse_postorder(cfg)
+        entry = cfg.get_entry_block().index
+        blocks = sorted(order, key=order.get)
+        idom = {entry: entry}
+        def intersect(a, b):
+            while a != b:
+                while order[a] > order[b]:
+                    a = idom[a]
+                while order[b] > order[a]:
+                    b = idom[b]
+            return a
+        changed = True
+        while changed:
+            changed = False
+            for index in blocks[1:]:
+                preds = [p.index for p in cfg.basic_blocks[index].prev_blocks if p.index in idom]
+                dominator = preds[0]
+                for pred in preds[1:]:
+                    dominator = intersect(pred, dominator)
+                if idom.get(index) != dominator:
+                    idom[index] = dominator
+                    changed = True
+        children: Dict[int, List[int]] = {index: [] for index in blocks}
+        for index in blocks[1:]:
+            children[idom[index]].append(index)
+        # Preorder number and the last preorder number below each block
+        self.first: Dict[int, int] = {}
+        self.last: Dict[int, int] = {}
+        stack = [(entry, False)]
+        while stack:
+            index, done = stack.pop()
+            if done:
+                self.last[index] = len(self.first) - 1
+                continue
+            self.first[index] = len(self.first)
+            stack.append((index, True))
+            stack.extend((child, False) for child in children[index])
+
+    def dominates(self, a: int, b: int) -> bool:
+        ''' Whether block a dominates block b (by index), blocks dominate themselves '''
+        return a in self.first and b in self.first and self.first[a] <= self.first[b] <= self.last[a]
+
+class Worklist:
+    '''
+    The blocks left to visit, taken in reverse postorder so a block is
+    visited once its predecessors are (a forward analysis then only goes
+    around loops as often as their facts change).
+    '''
+    def __init__(self, cfg: CFG):
+        self.order = reverse_postorder(cfg)
+        self.blocks = cfg.basic_blocks
+        self.heap: List[int] = []
+        self.queued = set()
+
+    def add(self, block: CFG.BasicBlock):
+        if block.index not in self.queued and block.index in self.order:
+            self.queued.add(block.index)
+            heapq.heappush(self.heap, (self.order[block.index], block.index))
+
+    def pop(self) -> CFG.BasicBlock:
+        _, index = heapq.heappop(self.heap)
+        self.queued.discard(index)
+        return self.blocks[index]
+
+    def __bool__(self):
+        return bool(self.heap)
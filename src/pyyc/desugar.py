@@ -15,10 +15,12 @@ class DesugarUnaryConstantTransformer(BodyStacker):
         if isinstance(node.op, USub):
             if isinstance(node.operand, Constant):
                 if isinstance(node.operand.value, int):
+                    self.markModified()
                     return Constant(-node.operand.value)
         elif isinstance(node.op, Not):
             if isinstance(node.operand, Constant):
                 if isinstance(node.operand.value, bool):
+                    self.markModified()
                     return Constant(not node.operand.value)
         return node
     
@@ -120,6 +122,7 @@ class DesguarShortCircuitTransformer(BodyStacker):
                 tmp = tmp.orelse[0]
             else:
                 raise Exception(f"Invalid BoolOp {node.op}")
+        self.markModified()
         self.visit(iff)
         return Name(id=temp, ctx=Load())
 
@@ -149,5 +152,6 @@ class DesguarShortCircuitTransformer(BodyStacker):
                 tmp.body = [Assign(targets=[Name(id=temp, ctx=Store())], value=Constant(True))]
             tmp = tmp.body[0]
             left = right
+        self.markModified()
         self.visit(iff)
         return Name(id=temp, ctx=Load())
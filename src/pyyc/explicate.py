@@ -58,6 +58,20 @@ def __add__(left: PyObj, right: PyObj):
             target = inject_big(add(left, right))
     return target
 
+class Variant:
+    '''
+    A helper whose code is the code of another helper with some of the runtime
+    functions it calls replaced (see get_helper_template in box_front.py).
+    '''
+    def __init__(self, name: str, helper, **calls: str):
+        self.__name__ = name
+        self.helper = helper
+        self.calls = calls
+
+# __add__ for `l = l + r` when nothing else can see the list l (see inplace.py):
+# the left list is extended instead of copied
+__iadd__ = Variant('__iadd__', __add__, add='list_extend')
+
 def __neg__(value: PyObj):
     target = 0
     if is_int(value):
@@ -300,6 +314,9 @@ def print_any(x: PyObj):
     print(x)
 def add(x: Big_PyObj_P, y: Big_PyObj_P) -> Big_PyObj_P:
     return x + y
+def list_extend(x: Big_PyObj_P, y: Big_PyObj_P) -> Big_PyObj_P:
+    x.extend(y)
+    return x
 def equal(x: Big_PyObj_P, y: Big_PyObj_P) -> Big_PyObj_P:
     return x == y
 def create_list(len: PyObj) -> Big_PyObj_P:
@@ -0,0 +1,74 @@
+'''
+Find the list appends which can reuse the left operand.
+
+`l = l + r` builds a new list and copies both operands into it, so a loop
+appending one element at a time this way is quadratic. When the result
+replaces the left operand (so its old value is dead after the add) and
+nothing else can refer to the list, the add can append to the list in place
+instead: Explicate calls the __iadd__ helper, which uses list_extend from
+the runtime (a list doubles its capacity when it grows).
+
+A variable is unshared in its scope when:
+- it is not a parameter and not used by a nested function
+- every assignment to it creates a new value (a list or dict display, an
+  operation or a constant), never a copy of another reference
+- every use only reads it: an operand, a subscript, a test or print
+
+Anything else (a copy, a call argument, a return, an element of a container)
+could leave a second reference to the list, which must not see the append.
+
+This runs on the flattened tree after closure conversion, where the free
+variables of the closures are passed as call arguments.
+'''
+
+from ast import *
+
+# Assigning these creates a value nobody else refers to
+FRESH_VALUES = (List, Dict, BinOp, UnaryOp, Compare, Constant)
+# Using a variable in these only reads it
+READING_PARENTS = (BinOp, UnaryOp, Compare, If, While)
+
+def is_self_add(node: AST) -> bool:
+    ''' `x = x + y` '''
+    return (isinstance(node, Assign) and len(node.targets) == 1 and isinstance(node.targets[0], Name)
+        and isinstance(node.value, BinOp) and isinstance(node.value.op, Add)
+        and isinstance(node.value.left, Name) and node.value.left.id == node.targets[0].id)
+
+def is_unshared_use(name: Name, parent: AST) -> bool:
+    ''' Whether this occurrence of the name leaves no other reference to its value '''
+    if isinstance(name.ctx, Store):
+        return isinstance(parent, Assign) and len(parent.targets) == 1 and isinstance(parent.value, FRESH_VALUES)
+    if isinstance(parent, Subscript):
+        return parent.value is name
+    if isinstance(parent, Call):
+        return isinstance(parent.func, Name) and parent.func.id == 'print' and parent.func is not name
+    return isinstance(parent, READING_PARENTS)
+
+def mark_scope(scope: AST) -> int:
+    ''' Mark the in place adds of one scope (a module or function), returns how many were marked '''
+    shared = set()
+    if isinstance(scope, FunctionDef):
+        shared.update(a.arg for a in scope.args.args)
+    adds = []
+    stack = [(stmnt, scope) for stmnt in scope.body]
+    while stack:
+        node, parent = stack.pop()
+        if isinstance(node, FunctionDef):
+            # Anything a nested function refers to may be captured
+            shared.update(n.id for n in walk(node) if isinstance(n, Name))
+            continue
+        if isinstance(node, Name) and not is_unshared_use(node, parent):
+            shared.add(node.id)
+        if is_self_add(node):
+            adds.append(node)
+        stack.extend((child, node) for child in iter_child_nodes(node))
+    marked = 0
+    for node in adds:
+        if node.targets[0].id not in shared:
+            node.value.in_place = True
+            marked += 1
+    return marked
+
+def mark_in_place_adds(tree: Module) -> int:
+    ''' Mark the adds of every scope which can append in place (see Explicate.visit_BinOp) '''
+    return sum(mark_scope(node) for node in walk(tree) if isinstance(node, (Module, FunctionDef)))
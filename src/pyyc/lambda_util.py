@@ -30,7 +30,6 @@ def get_lambda_funcs(ir: ir_Module):
     
 def get_calls(func: ir_Function,dic):
     ''' Converts the calls to call respective lambda functions '''
-    print('get_call')
     for stmt in func.body:
         if isinstance(stmt, x86_Call):
             if stmt.func in dic:
@@ -0,0 +1,513 @@
+'''
+IR optimization passes and the pass manager which runs them.
+
+The passes work on one ir_Function at a time and return the number of
+changes they made, so the manager can run them until none of them changes
+anything (a fixpoint) and keep statistics per pass:
+- ConstantFolding: propagate constants along the CFG and evaluate
+  operations, comparisons and branches on them
+- CopyPropagation: replace uses of `x` after `x = y` with `y`
+- DeadStoreElimination: remove assignments to variables which are not live
+  afterwards (using the CFG liveness) and expressions without side effects
+- DeadCodeElimination: remove unreachable blocks, thread jumps to jumps and
+  remove jumps to the following label
+
+The passes of a round share one CFG of the function: they change the
+statements of its blocks in place and keep its edges up to date, only
+DeadCodeElimination changes the blocks themselves. The manager updates the
+read/write sets and the liveness of the CFG after every change.
+'''
+
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+from IR import *
+from cfg import CFG
+from dataflow import Dominators, State, Worklist, constant, meet
+from to_x86 import RUNTIME_INTRINSICS, fits_imm32
+
+# Runtime functions without side effects, their calls can be removed when the result is unused
+PURE_CALLS = {
+    *RUNTIME_INTRINSICS,
+    'is_true', 'tag', 'is_function', 'is_object', 'is_class',
+    'is_unbound_method', 'is_bound_method',
+    'create_list', 'create_dict', 'create_closure', 'get_fun_ptr', 'get_free_vars',
+    'add', 'equal', 'not_equal',
+}
+
+def _wrap(value: int) -> int:
+    ''' Wrap a python int to a signed 64 bit machine word '''
+    value &= 2**64 - 1
+    return value - 2**64 if value >= 2**63 else value
+
+def _operand_fields(stmnt: ir_stmt):
+    '''
+    Yield (node, field) for every operand read by a statement.
+    The function of an ir_Call is a name, not an operand, so it is not included.
+    '''
+    if isinstance(stmnt, (ir_Assign, ir_Expr)):
+        value = stmnt.value
+        if isinstance(value, ir_Target):
+            yield value, 'target'
+        elif isinstance(value, (ir_BinOp, ir_Compare)):
+            yield value, 'left'
+            yield value, 'right'
+        elif isinstance(value, ir_UnaryOp):
+            yield value, 'operand'
+        elif isinstance(value, ir_Call):
+            for i in range(len(value.args)):
+                yield value.args, i
+    elif isinstance(stmnt, ir_Branch):
+        yield stmnt, 'condition'
+    elif isinstance(stmnt, ir_Return) and stmnt.value is not None:
+        yield stmnt, 'value'
+
+def _get(node, field):
+    return node[field] if isinstance(node, list) else getattr(node, field)
+
+def _set(node, field, value):
+    if isinstance(node, list):
+        node[field] = value
+    else:
+        setattr(node, field, value)
+
+class Pass:
+    ''' An optimization over one ir_Function '''
+    name = 'pass'
+    # Whether the pass changes the blocks (and writes function.body itself), so the CFG must be built again
+    restructures = False
+
+    def run(self, function: ir_Function, cfg: CFG) -> int:
+        ''' Optimize the statements of the blocks of cfg in place and return the number of changes '''
+        raise NotImplementedError
+
+class ForwardPass(Pass):
+    '''
+    A pass driven by a forward analysis over the CFG.
+    States map variable names to facts, a fact holds at a block if it holds
+    on every incoming edge. Subclasses implement transfer, which updates the
+    state with the effect of a statement and, once the facts are final
+    (self.rewriting), rewrites the statement with them.
+
+    The states are sparse: they only keep the facts about the variables which
+    are live at the end of a block, and facts which hold wherever they are
+    available are kept in self.facts for the whole function instead of in
+    the states carried from block to block. Most variables are temporaries
+    which are assigned once (self.definitions), and the subclasses put the
+    facts about those in self.facts when they can.
+    '''
+    def run(self, function: ir_Function, cfg: CFG) -> int:
+        self.changes = 0
+        self.cfg = cfg
+        self.prepare(function, cfg)
+        in_states = self.analyze(cfg)
+        self.rewriting = True
+        for block in cfg.basic_blocks:
+            if block.index in in_states:
+                # Unreachable blocks are left to DeadCodeElimination
+                block.statements = self.transfer_block(block, dict(in_states[block.index]))
+        return self.changes
+
+    def prepare(self, function: ir_Function, cfg: CFG):
+        ''' Find the variables which are assigned once and where (None for the arguments) '''
+        self.facts: State = {}
+        self.definitions: Dict[str, Optional[Tuple[int, int]]] = {arg.id: None for arg in function.args}
+        assigned_again: Set[str] = set()
+        for block in cfg.basic_blocks:
+            for i, stmnt in enumerate(block.statements):
+                if isinstance(stmnt, ir_Assign):
+                    if stmnt.target.id in self.definitions:
+                        assigned_again.add(stmnt.target.id)
+                    else:
+                        self.definitions[stmnt.target.id] = (block.index, i)
+        for var in assigned_again:
+            del self.definitions[var]
+
+    def analyze(self, cfg: CFG) -> Dict[int, State]:
+        ''' Worklist over the blocks in reverse postorder, returns the state at the start of each reachable block '''
+        self.rewriting = False
+        in_states: Dict[int, State] = {}
+        out_states: Dict[int, State] = {}
+        entry = cfg.get_entry_block()
+        worklist = Worklist(cfg)
+        worklist.add(entry)
+        # The live variables at the end of each block as a string of bits by variable number
+        # (testing a bit of the live set itself takes a copy of it)
+        live_out: Dict[int, str] = {}
+        while worklist:
+            block = worklist.pop()
+            incoming = [out_states[p.index] for p in block.prev_blocks if p.index in out_states]
+            if block is entry:
+                incoming.append({})
+            state = meet(incoming)
+            if block.index in out_states and in_states[block.index] == state:
+                continue
+            in_states[block.index] = state
+            # Only updates the state, the statements are rewritten once the facts are final
+            state = dict(state)
+            self.transfer_block(block, state)
+            # The facts about the variables which are dead after the block are of no more use
+            if block.index not in live_out:
+                live_out[block.index] = format(block.live_out, f'0{len(cfg.names)}b')[::-1]
+            live = live_out[block.index]
+            state = {var: fact for var, fact in state.items() if live[cfg.variables[var]] == '1'}
+            if out_states.get(block.index) != state:
+                out_states[block.index] = state
+                for succ in block.next_blocks:
+                    worklist.add(succ)
+        return in_states
+
+    def transfer_block(self, block: CFG.BasicBlock, state: State) -> List[ir_stmt]:
+        ''' Transfer the statements of a block in order, returns them (rewritten once self.rewriting) '''
+        self.block = block
+        statements = []
+        for i, stmnt in enumerate(block.statements):
+            self.position = i
+            statements.append(self.transfer(stmnt, state))
+        return statements
+
+    def transfer(self, stmnt: ir_stmt, state: State) -> ir_stmt:
+        raise NotImplementedError
+
+    def fact(self, state: State, var: str):
+        ''' The fact about var at the current statement (None if there is none) '''
+        if var in state:
+            return state[var]
+        if var in self.facts and self.available(var):
+            return self.facts[var]
+        return None
+
+    def available(self, var: str) -> bool:
+        ''' Whether the fact about var in self.facts holds at the current statement '''
+        return True
+
+    def changed(self):
+        if self.rewriting:
+            self.changes += 1
+
+    @staticmethod
+    def kill(state: State, var: str):
+        state.pop(var, None)
+
+class ConstantFolding(ForwardPass):
+    '''
+    Propagate constants and evaluate what can be evaluated at compile time.
+    Facts are the constant (python int) value of a variable.
+    Only constants which fit in an immediate operand are propagated.
+    A variable which is assigned once from constants and such variables
+    (self.invariant) has the same value wherever it is assigned, so its fact
+    goes in self.facts.
+    '''
+    name = 'constant folding'
+
+    def prepare(self, function: ir_Function, cfg: CFG):
+        super().prepare(function, cfg)
+        # Start from the variables assigned once and drop those which read any other variable
+        self.invariant = {var for var, definition in self.definitions.items() if definition is not None}
+        readers: Dict[str, List[str]] = {}
+        dropped = []
+        for var in self.invariant:
+            block, i = self.definitions[var]
+            for node, field in _operand_fields(cfg.basic_blocks[block].statements[i]):
+                operand = _get(node, field)
+                if isinstance(operand, ir_Name):
+                    readers.setdefault(operand.id, []).append(var)
+                    if operand.id not in self.invariant:
+                        dropped.append(var)
+        while dropped:
+            var = dropped.pop()
+            if var in self.invariant:
+                self.invariant.discard(var)
+                dropped.extend(readers.get(var, ()))
+
+    def transfer(self, stmnt: ir_stmt, state: State) -> ir_stmt:
+        if self.rewriting:
+            for node, field in _operand_fields(stmnt):
+                operand = _get(node, field)
+                if isinstance(operand, ir_Name):
+                    value = self.fact(state, operand.id)
+                    if value is not None:
+                        _set(node, field, constant(value))
+                        self.changed()
+            if isinstance(stmnt, ir_Branch) and isinstance(stmnt.condition, ir_Constant):
+                self.changed()
+                return self.fold_branch(stmnt)
+        if not isinstance(stmnt, ir_Assign):
+            return stmnt
+        value = self.evaluate(stmnt.value, lambda var: self.fact(state, var))
+        if value is not None and not fits_imm32(value):
+            # Leave it to the instructions, the value cannot be an immediate
+            value = None
+        if self.rewriting and value is not None and not isinstance(stmnt.value, ir_Target):
+            stmnt.value = ir_Target(target=constant(value))
+            self.changed()
+        self.kill(state, stmnt.target.id)
+        if value is not None:
+            if stmnt.target.id in self.invariant:
+                self.facts[stmnt.target.id] = value
+            else:
+                state[stmnt.target.id] = value
+        return stmnt
+
+    def fold_branch(self, branch: ir_Branch) -> ir_Jump:
+        ''' The jump a branch on a constant makes, the CFG loses the edge to the other label '''
+        label, other = (branch.true_label, branch.false_label) if branch.condition.value else (branch.false_label, branch.true_label)
+        if other != label and other in self.cfg.block_dict:
+            self.cfg.remove_edge(self.block, self.cfg.block_dict[other])
+        return ir_Jump(label=label)
+
+    @staticmethod
+    def evaluate(value: ir_expr, fact) -> Optional[int]:
+        ''' The value of an expression on constants and variables whose fact is a constant (None if it is not constant) '''
+        def const(operand):
+            if isinstance(operand, ir_Constant):
+                return int(operand.value)
+            if isinstance(operand, ir_Name):
+                return fact(operand.id)
+            return None
+        if isinstance(value, ir_Target):
+            return const(value.target)
+        if isinstance(value, ir_UnaryOp) and isinstance(value.op, ir_USub):
+            operand = const(value.operand)
+            return None if operand is None else _wrap(-operand)
+        if isinstance(value, (ir_BinOp, ir_Compare)):
+            left, right = const(value.left), const(value.right)
+            if left is None or right is None:
+                return None
+            ops = {
+                ir_Add: lambda l, r: _wrap(l + r),
+                ir_BitXor: lambda l, r: l ^ r,
+                ir_Eq: lambda l, r: int(l == r),
+                ir_NotEq: lambda l, r: int(l != r),
+                ir_Lt: lambda l, r: int(l < r),
+                ir_LtE: lambda l, r: int(l <= r),
+                ir_Gt: lambda l, r: int(l > r),
+                ir_GtE: lambda l, r: int(l >= r),
+            }
+            op = ops.get(type(value.op))
+            return None if op is None else op(left, right)
+        return None
+
+class CopyPropagation(ForwardPass):
+    '''
+    Replace uses of copies with the original variable.
+    Facts are the variable a variable is a copy of, they are removed when
+    either variable is assigned.
+    When both are assigned once and the original is assigned before the copy
+    on every path, neither changes between the copy and a use of it which
+    the copy dominates, so the fact goes in self.facts and holds wherever
+    its assignment dominates the use (available).
+    '''
+    name = 'copy propagation'
+
+    def prepare(self, function: ir_Function, cfg: CFG):
+        super().prepare(function, cfg)
+        self.dominators = Dominators(cfg)
+        # The variables which were a copy of a variable in some state, to find the facts to remove when it is assigned
+        self.copies: Dict[str, Set[str]] = {}
+
+    def available(self, var: str) -> bool:
+        definition = self.definitions[var]
+        if definition is None:
+            return True
+        block, i = definition
+        if block == self.block.index:
+            return i < self.position
+        return self.dominators.dominates(block, self.block.index)
+
+    def transfer(self, stmnt: ir_stmt, state: State) -> ir_stmt:
+        if self.rewriting:
+            for node, field in _operand_fields(stmnt):
+                operand = _get(node, field)
+                if isinstance(operand, ir_Name):
+                    original = self.fact(state, operand.id)
+                    if original is not None:
+                        _set(node, field, ir_Name(id=original))
+                        self.changed()
+        if not isinstance(stmnt, ir_Assign):
+            return stmnt
+        target = stmnt.target.id
+        value = stmnt.value
+        source, lasting = None, False
+        if isinstance(value, ir_Target) and isinstance(value.target, ir_Name):
+            # The original of the copied variable (what the rewrite puts there)
+            copied = value.target.id
+            if copied in state:
+                # Facts in the state may not hold any more once the analysis goes around a loop
+                source = state[copied]
+            else:
+                source = self.fact(state, copied) or copied
+                lasting = target in self.definitions and source in self.definitions and self.available(source)
+        self.kill(state, target)
+        for var in self.copies.get(target, ()):
+            if state.get(var) == target:
+                self.kill(state, var)
+        if source is not None and source != target:
+            if lasting:
+                self.facts[target] = source
+            else:
+                state[target] = source
+                self.copies.setdefault(source, set()).add(target)
+        return stmnt
+
+class DeadStoreElimination(Pass):
+    '''
+    Remove assignments to variables which are dead afterwards.
+    Calls with side effects are kept as expressions.
+    '''
+    name = 'dead store elimination'
+
+    def run(self, function: ir_Function, cfg: CFG) -> int:
+        changes = 0
+        for block in cfg.basic_blocks:
+            # Backwards from the live set at the end of the block, without the reads of the removed statements
+            live = block.live_out
+            statements = []
+            for stmnt, (reads, writes) in zip(reversed(block.statements), reversed(block.read_write)):
+                if isinstance(stmnt, ir_Assign):
+                    value = stmnt.value
+                    if isinstance(value, ir_Target) and isinstance(value.target, ir_Name) and value.target.id == stmnt.target.id:
+                        # Self copy
+                        changes += 1
+                        continue
+                    if not writes & live:
+                        changes += 1
+                        if self.has_side_effects(value):
+                            statements.append(ir_Expr(value=value))
+                            live |= reads
+                        continue
+                elif isinstance(stmnt, ir_Expr) and not self.has_side_effects(stmnt.value):
+                    changes += 1
+                    continue
+                statements.append(stmnt)
+                live = reads | (live & ~writes)
+            statements.reverse()
+            block.statements = statements
+        return changes
+
+    @staticmethod
+    def has_side_effects(value: ir_expr) -> bool:
+        return isinstance(value, ir_Call) and value.func not in PURE_CALLS
+
+class DeadCodeElimination(Pass):
+    '''
+    Remove unreachable blocks and simplify the jumps:
+    - a jump (or branch) to a block which only jumps on goes straight to the final label
+    - a branch with the same label on both sides becomes a jump
+    - a jump to the label right after it is removed
+    '''
+    name = 'dead code elimination'
+    restructures = True
+
+    def run(self, function: ir_Function, cfg: CFG) -> int:
+        changes = 0
+        # Labels whose block is only a jump
+        forward = {}
+        for block in cfg.basic_blocks:
+            if block.label is not None and len(block.statements) == 2 and isinstance(block.statements[1], ir_Jump):
+                forward[block.label] = block.statements[1].label
+        def resolve(label):
+            seen = set()
+            while label in forward and label not in seen:
+                seen.add(label)
+                label = forward[label]
+            return label
+        # Find the reachable blocks
+        reachable = set()
+        worklist = [cfg.get_entry_block()]
+        while worklist:
+            block = worklist.pop()
+            if block.index in reachable:
+                continue
+            reachable.add(block.index)
+            worklist.extend(block.next_blocks)
+        body = []
+        for block in cfg.basic_blocks:
+            if block.index not in reachable:
+                changes += len(block.statements)
+                continue
+            body.extend(block.statements)
+            last = body[-1]
+            if isinstance(last, ir_Jump):
+                label = resolve(last.label)
+                if label != last.label:
+                    body[-1] = last = ir_Jump(label=label)
+                    changes += 1
+            elif isinstance(last, ir_Branch):
+                true_label, false_label = resolve(last.true_label), resolve(last.false_label)
+                if (true_label, false_label) != (last.true_label, last.false_label):
+                    body[-1] = last = ir_Branch(condition=last.condition, true_label=true_label, false_label=false_label)
+                    changes += 1
+                if true_label == false_label:
+                    body[-1] = ir_Jump(label=true_label)
+                    changes += 1
+        # Jumps to the next label
+        function.body = []
+        for i, stmnt in enumerate(body):
+            if isinstance(stmnt, ir_Jump) and i + 1 < len(body) and isinstance(body[i + 1], ir_Label) and body[i + 1].name == stmnt.label:
+                changes += 1
+                continue
+            function.body.append(stmnt)
+        return changes
+
+class PassManager:
+    '''
+    Run a sequence of passes over every function of a module until none of
+    them makes a change, or for at most max_rounds rounds. A pass is only run
+    again when another pass (or itself) changed the function since its last
+    run. The CFG is only built again after a pass which restructures the
+    blocks changed them. Keeps the number of changes made by each pass and
+    the number of statements before and after.
+    '''
+    max_rounds = 16
+
+    def __init__(self, passes: List[Pass]):
+        self.passes = passes
+        self.stats: Dict[str, int] = {p.name: 0 for p in passes}
+        self.iterations = 0
+        self.statements_before = 0
+        self.statements_after = 0
+
+    def run(self, module: ir_Module) -> ir_Module:
+        for function in module.functions:
+            self.statements_before += len(function.body)
+            # The passes which have not run since the last change
+            pending = set(range(len(self.passes))) if function.body else set()
+            rounds = 0
+            cfg = None
+            while pending and rounds < self.max_rounds:
+                self.iterations += 1
+                rounds += 1
+                for i, p in enumerate(self.passes):
+                    if i not in pending:
+                        continue
+                    if cfg is None:
+                        cfg = CFG(function).liveness()
+                    changes = p.run(function, cfg)
+                    self.stats[p.name] += changes
+                    pending.discard(i)
+                    if changes > 0:
+                        pending = set(range(len(self.passes)))
+                        if p.restructures:
+                            cfg = None
+                        else:
+                            function.body = cfg.statements()
+                            cfg.update_read_write_sets()
+                            cfg.liveness()
+            self.statements_after += len(function.body)
+        return module
+
+    def print_stats(self, file=sys.stdout):
+        for name, changes in self.stats.items():
+            file.write(f'{TAB_PREF}{name}: {changes}\n')
+        file.write(f'{TAB_PREF}iterations: {self.iterations}\n')
+        file.write(f'{TAB_PREF}statements: {self.statements_before} -> {self.statements_after}\n')
+
+def default_passes() -> List[Pass]:
+    return [ConstantFolding(), CopyPropagation(), DeadStoreElimination(), DeadCodeElimination()]
+
+def optimize_ir(module: ir_Module) -> PassManager:
+    ''' Run the default passes over the module to a fixpoint '''
+    manager = PassManager(default_passes())
+    manager.run(module)
+    return manager
@@ -150,6 +150,9 @@ def add(a: Big_PyObj_P, b: Big_PyObj_P) -> Big_PyObj_P:
     # return CallRuntime(func=ast.Name(id="add", ctx=ast.Load()), args=[a, b])
     # return ast.parse(f"add({a}, {b})").body[0].value
 
+def list_extend(a: Big_PyObj_P, b: Big_PyObj_P) -> Big_PyObj_P:
+    return ast.Call(func=ast.Name(id="list_extend", ctx=ast.Load()), args=[a, b], keywords=[])
+
 def equal(a: Big_PyObj_P, b: Big_PyObj_P) -> Int:
     return ast.Call(func=ast.Name(id="equal", ctx=ast.Load()), args=[a, b], keywords=[])
     # return CallRuntime(func=ast.Name(id="equal", ctx=ast.Load()), args=[a, b])
@@ -191,6 +194,7 @@ pyobj set_subscript(pyobj c, pyobj key, pyobj val);
 pyobj get_subscript(pyobj c, pyobj key);
 
 big_pyobj* add(big_pyobj* a, big_pyobj* b);
+big_pyobj* list_extend(big_pyobj* a, big_pyobj* b);
 int equal(big_pyobj* a, big_pyobj* b);
 int not_equal(big_pyobj* x, big_pyobj* y);
 
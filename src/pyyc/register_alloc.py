@@ -0,0 +1,203 @@
+'''
+Register allocation for x86 functions.
+
+The input is an ir_Function whose body has already been lowered to x86
+statements, but whose operands are still ir_Name variables (plus a few
+physical registers used by the calling convention and comparisons).
+
+1. Liveness analysis (over the CFG) computes the set of live locations after every statement
+2. The interference graph connects each written location to everything
+   live after the write (except the source of a move)
+3. The graph is colored using saturation (DSatur) ordering onto the
+   allocatable registers. Variables which cannot be colored are spilled.
+
+Locations are represented as strings:
+- variables by their id (e.g. `f0_1`)
+- registers by their 64-bit name with a `%` prefix (e.g. `%rax`)
+'''
+
+import heapq
+from typing import Dict, List, Set, Tuple
+
+from IR import *
+from x86 import *
+from cfg import CFG
+
+ARGUMENT_REGISTERS = ('rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9')
+# Reserved for fixing up instructions with too many memory references
+SPILL_REGISTER = 'r11'
+# Values live at the end of a function (the return value)
+EXIT_LIVE = frozenset(['%rax'])
+
+def register_key(reg: x86_Register) -> str:
+    ''' Location key for a register (8-bit registers alias their 64-bit equivalent) '''
+    if reg.is8Bit():
+        return f'%{reg.equivalent[0]}'
+    return f'%{reg.id}'
+
+def is_register_key(key: str) -> bool:
+    return key.startswith('%')
+
+def is_function_name(node: ir_Name) -> bool:
+    ''' Names of generated functions are labels, not variables '''
+    return str(node.id).startswith('lambda')
+
+CALLER_SAVED = tuple(f'%{r.id}' for r in x86_Registers.values()
+                     if r.caller_save and not r.is8Bit() and not r.isReserved())
+CALLEE_SAVED = tuple(f'%{r.id}' for r in x86_Registers.values()
+                     if not r.caller_save and not r.is8Bit() and not r.isReserved())
+# Caller-saved registers come first so values which do not live across a call
+# do not cost a push/pop in the prologue/epilogue
+ALLOCATABLE = tuple(r for r in CALLER_SAVED + CALLEE_SAVED if r != f'%{SPILL_REGISTER}')
+
+def _location(operand) -> str:
+    if isinstance(operand, ir_Name) and not is_function_name(operand):
+        return operand.id
+    if isinstance(operand, x86_Register) and not operand.isReserved():
+        return register_key(operand)
+    return None
+
+def x86_read_write_sets(stmnt: x86_stmnt, variables: Set[str] = frozenset()) -> Tuple[Set[str], Set[str]]:
+    '''
+    Return (read set, write set) tuple of locations for an x86 statement.
+    `variables` is used to detect indirect calls through a variable.
+    '''
+    reads, writes = [], []
+    if isinstance(stmnt, x86_mov):
+        reads, writes = [stmnt.src], [stmnt.dst]
+    elif isinstance(stmnt, (x86_Add, x86_Sub, x86_Xorq, x86_And, x86_Or, x86_shift)):
+        reads, writes = [stmnt.src, stmnt.dst], [stmnt.dst]
+    elif isinstance(stmnt, x86_Neg):
+        reads, writes = [stmnt.src], [stmnt.src]
+    elif isinstance(stmnt, x86_Cmp):
+        reads = [stmnt.src, stmnt.dst]
+    elif isinstance(stmnt, x86_set):
+        writes = [stmnt.dst]
+    elif isinstance(stmnt, x86_Push):
+        reads = [stmnt.src]
+    elif isinstance(stmnt, x86_Pop):
+        writes = [stmnt.dst]
+    elif isinstance(stmnt, x86_Call):
+        read_set = {f'%{r}' for r in ARGUMENT_REGISTERS[:stmnt.num_args]}
+        if stmnt.func in variables:
+            read_set.add(stmnt.func)
+        return read_set, set(CALLER_SAVED)
+    elif isinstance(stmnt, x86_Ret):
+        return set(EXIT_LIVE), set()
+    read_set = {loc for loc in map(_location, reads) if loc is not None}
+    write_set = {loc for loc in map(_location, writes) if loc is not None}
+    return read_set, write_set
+
+def liveness(body: List[x86_stmnt], variables: Set[str] = frozenset()) -> List[Set[str]]:
+    '''
+    Compute the live-after set for each statement in the body.
+    Jumps to labels outside of the body (e.g. end_<function>) exit the function.
+    '''
+    function = ir_Function(name='', args=[], body=body, return_type=ir_void, variables=variables)
+    cfg = CFG(function, lambda s: x86_read_write_sets(s, variables), exit_live=EXIT_LIVE)
+    return cfg.liveness().live_after()
+
+class InterferenceGraph:
+    '''
+    Undirected graph of locations which cannot share a register.
+    Also records move-related pairs so the coloring can try to
+    place both ends of a move in the same register.
+    '''
+    def __init__(self):
+        self.neighbors: Dict[str, Set[str]] = {}
+        self.moves: Dict[str, Set[str]] = {}
+
+    def add_node(self, a: str):
+        self.neighbors.setdefault(a, set())
+        self.moves.setdefault(a, set())
+
+    def add_edge(self, a: str, b: str):
+        if a == b:
+            return
+        self.add_node(a)
+        self.add_node(b)
+        self.neighbors[a].add(b)
+        self.neighbors[b].add(a)
+
+    def add_move(self, a: str, b: str):
+        if a == b:
+            return
+        self.add_node(a)
+        self.add_node(b)
+        self.moves[a].add(b)
+        self.moves[b].add(a)
+
+    @staticmethod
+    def build(body: List[x86_stmnt], live_after: List[Set[str]], variables: Set[str] = frozenset()):
+        graph = InterferenceGraph()
+        for var in variables:
+            graph.add_node(var)
+        for stmnt, live in zip(body, live_after):
+            reads, writes = x86_read_write_sets(stmnt, variables)
+            for loc in reads | writes:
+                graph.add_node(loc)
+            src = None
+            if isinstance(stmnt, x86_mov):
+                src = _location(stmnt.src)
+                dst = _location(stmnt.dst)
+                if src is not None and dst is not None:
+                    graph.add_move(src, dst)
+            for d in writes:
+                for v in live:
+                    # The destination of a move may share a register with the source
+                    if v != src:
+                        graph.add_edge(d, v)
+        return graph
+
+def color_graph(graph: InterferenceGraph, registers: Tuple[str, ...] = ALLOCATABLE) -> Tuple[Dict[str, str], List[str]]:
+    '''
+    Saturation based (DSatur) coloring of the variables in the graph.
+    Registers are pre-colored with themselves.
+    Returns (coloring, spilled variables).
+    '''
+    coloring = {n: n for n in graph.neighbors if is_register_key(n)}
+    saturation = {n: set() for n in graph.neighbors if not is_register_key(n)}
+    for n in saturation:
+        saturation[n] = {m for m in graph.neighbors[n] if is_register_key(m)}
+    spilled = []
+    # Max-heap on (saturation, degree) with lazy invalidation
+    heap = [(-len(saturation[n]), -len(graph.neighbors[n]), n) for n in saturation]
+    heapq.heapify(heap)
+    done = set()
+    while heap:
+        sat, _, var = heapq.heappop(heap)
+        if var in done or -sat != len(saturation[var]):
+            continue
+        done.add(var)
+        available = [r for r in registers if r not in saturation[var]]
+        if not available:
+            spilled.append(var)
+            continue
+        # Prefer the register of a move related location (the move can then be deleted)
+        preferred = [coloring[m] for m in graph.moves[var] if m in coloring and coloring[m] in available]
+        color = preferred[0] if preferred else available[0]
+        coloring[var] = color
+        for n in graph.neighbors[var]:
+            if n in saturation and n not in done and color not in saturation[n]:
+                saturation[n].add(color)
+                heapq.heappush(heap, (-len(saturation[n]), -len(graph.neighbors[n]), n))
+    return coloring, spilled
+
+def allocate_registers(node: ir_Function, var_size: int = 8) -> Dict[str, Union[x86_Register, x86_Memory]]:
+    '''
+    Map each variable of the (lowered) function to a register or a stack slot.
+    Stack slots are placed below the callee-saved registers pushed in the prologue.
+    '''
+    node.update_variables()
+    variables = {v for v in node.variables if not str(v).startswith('lambda')}
+    live_after = liveness(node.body, variables)
+    graph = InterferenceGraph.build(node.body, live_after, variables)
+    coloring, spilled = color_graph(graph)
+    register_assignments = {}
+    for var in variables:
+        if var in coloring:
+            register_assignments[var] = x86_Registers[coloring[var][1:]]
+    saved = {coloring[v] for v in variables if v in coloring and coloring[v] in CALLEE_SAVED}
+    for i, var in enumerate(sorted(spilled)):
+        register_assignments[var] = x86_Memory(base=x86_Registers['rbp'], offset=-(var_size * (len(saved) + i + 1)))
+    return register_assignments
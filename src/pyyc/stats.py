@@ -0,0 +1,102 @@
+'''
+Per phase instrumentation of the compiler (compile.py --stats).
+
+For each phase of compile(), CompileStats records:
+- wall_time: seconds spent in the phase
+- peak_memory: bytes allocated at the peak of the phase, above what was
+  allocated when it started (tracemalloc)
+- nodes_in / nodes_out: nodes in the tree (AST, IR or x86 IR) before and after
+- temporaries: names handed out by TempContext.temp_gen during the phase
+
+tracemalloc makes compiling several times slower, so compile() runs the
+phases twice: untraced for everything but the memory (run), then traced for
+the memory alone (trace). None of this runs without --stats.
+'''
+
+import ast
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from tree_utils import TempContext
+
+def count_nodes(tree) -> int:
+    ''' Nodes in an AST or IR tree (0 for anything else) '''
+    if not isinstance(tree, ast.AST):
+        return 0
+    return sum(1 for _ in ast.walk(tree))
+
+class CompileStats:
+    '''
+    The statistics of the phases of compiling one file.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.phases: List[Dict[str, object]] = []
+        self.traced = 0
+        self.started_tracing = False
+
+    def run(self, name: str, phase: Callable, *args):
+        '''
+        Run phase(*args) and record its statistics, returns what it returns.
+        The first argument is the input tree, the output tree is the result
+        (or the input, for the phases which change the tree in place).
+        '''
+        tree = args[0] if args else None
+        nodes_in = count_nodes(tree)
+        temps = TempContext.temp_gen.count()
+        start = time.perf_counter()
+        result = phase(*args)
+        wall_time = time.perf_counter() - start
+        self.phases.append({
+            'name': name,
+            'wall_time': wall_time,
+            'peak_memory': 0,
+            'nodes_in': nodes_in,
+            'nodes_out': count_nodes(result if isinstance(result, ast.AST) else tree),
+            'temporaries': TempContext.temp_gen.count() - temps,
+        })
+        return result
+
+    def start_tracing(self):
+        ''' Trace the allocations of the phases which run next (with trace) '''
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def trace(self, name: str, phase: Callable, *args):
+        '''
+        Run phase(*args) again, after all phases were run, and record its peak memory
+        in the statistics which run recorded for it. Returns what phase returns.
+        '''
+        stats = self.phases[self.traced]
+        assert stats['name'] == name, f"Traced phase {name} but the phase {stats['name']} was run"
+        self.traced += 1
+        tracemalloc.reset_peak()
+        memory = tracemalloc.get_traced_memory()[0]
+        result = phase(*args)
+        stats['peak_memory'] = tracemalloc.get_traced_memory()[1] - memory
+        return result
+
+    def close(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            'file': self.path,
+            'wall_time': sum(p['wall_time'] for p in self.phases),
+            'peak_memory': max((p['peak_memory'] for p in self.phases), default=0),
+            'phases': self.phases,
+        }
+
+def write_stats(stats, path: str):
+    ''' Write statistics (to_dict of one file, or a list of them) as JSON to path ('-' for stdout) '''
+    text = json.dumps(stats, indent=2)
+    if path == '-':
+        print(text)
+    else:
+        with open(path, 'w') as f:
+            f.write(text + '\n')
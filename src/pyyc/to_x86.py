@@ -10,23 +10,37 @@ from tree_utils import BodyStacker
 from IR import *
 from x86 import *
 from lambda_util import *
+from register_alloc import ARGUMENT_REGISTERS, SPILL_REGISTER, allocate_registers
+from constants import MASK, SHIFT, INT_TAG, BOOL_TAG, BIG_TAG, INT_BITS, inject_value, project_value
 
 VAR_SIZE = 8
 
+# Runtime functions which are a few tag/shift instructions on a pyobj.
+# These are emitted inline instead of being called (see inline_intrinsic).
+TAG_CHECKS = {'is_int': INT_TAG, 'is_bool': BOOL_TAG, 'is_big': BIG_TAG}
+INJECTIONS = {'inject_int': INT_TAG, 'inject_bool': BOOL_TAG}
+PROJECTIONS = ('project_int', 'project_bool')
+RUNTIME_INTRINSICS = (*TAG_CHECKS, *INJECTIONS, *PROJECTIONS, 'inject_big', 'project_big')
+
+def fits_imm32(value: int) -> bool:
+    return -2**31 <= value < 2**31
+
 class ir_Module_to_x86_Transformer(BodyStacker):
     '''
     Convert IR Module to x86.
-    Sometimes we will need to create temporaries. In this case we need to restart the conversion...
+    Sometimes a statement needs supporting instructions. These are lowered in turn (see lower_body).
     We will think about register spilling soon...
     For each function:
     1. Flatten the IR into two op code IR
     2. Assign registers to variables
     3. Add supporting statements and convert all IR to x86
     '''
-    def __init__(self, prefix: str = 'x86'):
+    def __init__(self, prefix: str = 'x86', dump: bool = False):
         super().__init__(prefix)
+        self.dump = dump
         self.og_prefix = prefix
         self.current_function = ''
+        self.next_label = None
 
     def visit(self, node):
         # print(f"VISITING: {node.__class__.__name__} -> {node}")
@@ -58,22 +72,9 @@ class ir_Module_to_x86_Transformer(BodyStacker):
 
         self.current_function = node.name
 
-        # Do an initial visits to convert all IR to x86
-        i = 0
-        while True:
-            # print(f'Flattening {node.name} {i}')
-            self.has_spilled = False
-            self.prefix = f'{self.og_prefix}_{node.name}_1_{i}'
-            super().visit_ir_Function(node)
-            # if we have not spilled, we are done
-            # print()
-            # print_ir(node)
-            # print()
-            # input('Press enter to continue...')
-            # print()
-            if not self.has_spilled:
-                break
-            i += 1
+        # Convert all IR to x86
+        self.prefix = f'{self.og_prefix}_{node.name}_1'
+        self.lower_body(node)
 
         # Make sure we have a return statement
         if not isinstance(node.body[-1], x86_Ret):
@@ -88,8 +89,9 @@ class ir_Module_to_x86_Transformer(BodyStacker):
                 print(stmnt)
                 raise
 
-        print("x86 before register assignment: ")
-        print_ir(node)
+        if self.dump:
+            print("x86 before register assignment: ")
+            print_ir(node)
 
         # Do register assignment
         self.assign_registers(node)
@@ -108,6 +110,32 @@ class ir_Module_to_x86_Transformer(BodyStacker):
 
         return node
 
+    def lower_body(self, node: ir_Function):
+        '''
+        Convert the body to x86 in one pass over a worklist of statements.
+        The instructions a statement adds before itself (appendToCurrentBody) may
+        still be IR, or need fixing in turn (a cmpq with an immediate destination),
+        so they go back on the worklist followed by the statement's result. A
+        statement which adds nothing is done, so each statement is visited again
+        only as often as it produces new instructions.
+        '''
+        worklist = list(reversed(node.body))
+        body = []
+        while worklist:
+            stmnt = worklist.pop()
+            # The label the statement falls through to, if any (see visit_ir_Branch)
+            following = worklist[-1] if worklist else None
+            self.next_label = following.name if isinstance(following, ir_Label) else None
+            self.has_spilled = False
+            self._pushCurrentBody([])
+            self.visit(stmnt)
+            lowered = self._popCurrentBody()
+            if self.has_spilled:
+                worklist.extend(reversed(lowered))
+            else:
+                body.extend(lowered)
+        node.body = body
+
     def visit_ir_Assign(self, node):
         self.generic_visit(node)
         try:
@@ -125,6 +153,8 @@ class ir_Module_to_x86_Transformer(BodyStacker):
             return x86_Movq(
                 src=node.value.target,
                 dst=node.target)
+        elif isinstance(node.value, ir_Call) and node.value.func in RUNTIME_INTRINSICS:
+            return self.inline_intrinsic(node.value, node.target)
         elif isinstance(node.value, ir_Call):
             self.appendToCurrentBody(self.call_function(node.value))
             return x86_Movq(
@@ -181,7 +211,8 @@ class ir_Module_to_x86_Transformer(BodyStacker):
             # The register allocator can use the restrictions on this shell to guide it's decision
             # for the target register...
             # For now we will just use a static register (al)
-            self.appendToCurrentBody(x86_Cmp(src=node.value.left, dst=node.value.right))
+            # cmpq src, dst sets the flags on dst - src (so left goes in dst)
+            self.appendToCurrentBody(x86_Cmp(src=node.value.right, dst=node.value.left))
             self.appendToCurrentBody(op(dst=x86_Registers['al']))
             self.appendToCurrentBody(x86_Movzbq(src=x86_Registers['al'], dst=node.target))
             return None
@@ -193,6 +224,9 @@ class ir_Module_to_x86_Transformer(BodyStacker):
         if isinstance(node.value, invalid_expr):
             # Get rid of the expression
             return None
+        elif isinstance(node.value, ir_Call) and node.value.func in RUNTIME_INTRINSICS:
+            # The intrinsics have no side effects
+            return None
         elif isinstance(node.value, ir_Call):
             return self.call_function(node.value)
 
@@ -220,19 +254,68 @@ class ir_Module_to_x86_Transformer(BodyStacker):
         self.generic_visit(node)
         # Compare the condition to zero
         self.appendToCurrentBody(x86_Cmp(src=x86_Constant(value=0), dst=node.condition))
-        # Jump if the condition is true
-        return x86_Je(name=node.false_label)
-        # Jump if the condition is false (we don't need to do this, but it is more clear)
-        # I would add it except is creates an edge case in the CFG generation
-        # self.appendToCurrentBody(x86_Jmp(name=node.true_label))
+        # The optimizer may have threaded the true edge past the block after the branch,
+        # so only fall through into the true block when it comes next
+        if self.next_label == node.true_label:
+            return x86_Je(name=node.false_label)
+        if self.next_label == node.false_label:
+            return x86_Jne(name=node.true_label)
+        self.appendToCurrentBody(x86_Je(name=node.false_label))
+        return x86_Jmp(name=node.true_label)
     
+    def inline_intrinsic(self, node: ir_Call, target: ir_Name):
+        '''
+        Emit a runtime tag/box function as instructions (see runtime.h for the layout)
+        - is_int(x)      -> andq $MASK, t; cmpq $INT_TAG, t; sete %al; movzbq %al, t
+        - inject_bool(x) -> shlq $34, t; sarq $32, t; orq $BOOL_TAG, t
+        - project_int(x) -> sarq $SHIFT, t
+        - project_big(x) -> andq $~MASK, t
+        The injections of ints and bools go through a C int in the runtime, so the
+        shifts keep the same INT_BITS low bits and sign extend them. Every boxed
+        int or bool comes from an injection, so it is a sign extended C int and
+        the projection only has to shift it.
+        Constant arguments are folded.
+        '''
+        func = node.func
+        arg = node.args[0]
+        if isinstance(arg, ir_Constant):
+            value = int(arg.value)
+            if func in TAG_CHECKS:
+                value = int((value & MASK) == TAG_CHECKS[func])
+            elif func in INJECTIONS:
+                value = inject_value(value, INJECTIONS[func])
+            elif func in PROJECTIONS:
+                value = project_value(value)
+            elif func == 'inject_big':
+                value = value | BIG_TAG
+            else:
+                value = value & ~MASK
+            if fits_imm32(value):
+                return x86_Movq(src=x86_Constant(value=value), dst=target)
+        self.appendToCurrentBody(x86_Movq(src=arg, dst=target))
+        if func in TAG_CHECKS:
+            self.appendToCurrentBody(x86_And(src=x86_Constant(value=MASK), dst=target))
+            self.appendToCurrentBody(x86_Cmp(src=x86_Constant(value=TAG_CHECKS[func]), dst=target))
+            self.appendToCurrentBody(x86_SetE(dst=x86_Registers['al']))
+            return x86_Movzbq(src=x86_Registers['al'], dst=target)
+        if func in INJECTIONS:
+            self.appendToCurrentBody(x86_Shl(src=x86_Constant(value=64 - INT_BITS + SHIFT), dst=target))
+            if INJECTIONS[func] == 0:
+                return x86_Sar(src=x86_Constant(value=64 - INT_BITS), dst=target)
+            self.appendToCurrentBody(x86_Sar(src=x86_Constant(value=64 - INT_BITS), dst=target))
+            return x86_Or(src=x86_Constant(value=INJECTIONS[func]), dst=target)
+        if func in PROJECTIONS:
+            return x86_Sar(src=x86_Constant(value=SHIFT), dst=target)
+        if func == 'inject_big':
+            return x86_Or(src=x86_Constant(value=BIG_TAG), dst=target)
+        return x86_And(src=x86_Constant(value=~MASK), dst=target)
+
     def call_function(self, node: ir_Call):
         # Pass the arguments in using the calling convention
         # x86: Pass the first 6 arguments in registers
         # - rdi, rsi, rdx, rcx, r8, r9
         # - The rest on the stack
-        regs = ('rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9')
-        regs = (x86_Registers[reg] for reg in regs)
+        regs = (x86_Registers[reg] for reg in ARGUMENT_REGISTERS)
         while len(node.args) > 6:
             # Pop the 7th argument off the stack
             arg = node.args.pop(6)
@@ -243,7 +326,7 @@ class ir_Module_to_x86_Transformer(BodyStacker):
             # print(arg, reg)
             self.appendToCurrentBody(x86_Movq(src=arg, dst=reg))
         # Call the function
-        return x86_Call(func=node.func)
+        return x86_Call(func=node.func, num_args=len(node.args))
     
     def frame_function(self, node: ir_Function, return_stmnt: x86_Ret):
         '''
@@ -267,22 +350,26 @@ class ir_Module_to_x86_Transformer(BodyStacker):
             x86_Movq(src=x86_Registers['rsp'], dst=x86_Registers['rbp']),
         ])
         # Push all of the callee-saved registers which are used in the program
+        # (the register allocator places the stack slots below these)
         saved_regs = 0
         for reg in node_registers:
                 reg = x86_Registers[reg]
-                if reg.caller_save:
+                if not reg.caller_save and not reg.isReserved():
                     r = reg
                     if is8BitRegister(reg.id):
-                        # print('8 bit register')
-                        # r = x86_Registers[r.equivalent[0]]
-                        # print(r)
                         continue
                     prologue.append(x86_Push(src=r))
                     epilogue.append(x86_Pop(dst=r))
                     saved_regs += 1
         # Reverse the epilogue to get the correct order of popping
-        epilogue += [x86_Label(name=f'end_{node.name}')]
         epilogue.reverse()
+        if saved_regs > 0:
+            # Point rsp back at the saved registers (below them are the stack slots)
+            epilogue[0:0] = [
+                x86_Movq(src=x86_Registers['rbp'], dst=x86_Registers['rsp']),
+                x86_Sub(src=x86_Constant(value=VAR_SIZE * saved_regs), dst=x86_Registers['rsp']),
+            ]
+        epilogue.insert(0, x86_Label(name=f'end_{node.name}'))
         # allocate stack space if necessary
         # TODO: This should be done in the register allocator
         # Determine the stack space needed for the function rounding up to a multiple of 16
@@ -319,60 +406,19 @@ class ir_Module_to_x86_Transformer(BodyStacker):
     
     def assign_registers(self, node: ir_Function):
         '''
-        Assign registers to variables
+        Assign registers to variables using liveness analysis and graph coloring.
+        Variables which cannot be colored are spilled to the stack.
         '''
-        # print(node.args, node.variables, file=sys.stderr)
-        # print([type(var) for var in node.args], file=sys.stderr)
-        # Now we need to do register allocation
-
-        # def _get_register_allocations(node: ir_Function, register_assignments: Dict[ir_trgt, Union[x86_Register, x86_Memory]]):
-        #     node.update_variables()
-        #     # # Create CFG
-        #     # cfg = CFG(node)
-        #     # # Do liveness analysis
-        #     # liveness = Liveness(cfg)
-        #     # # Create interference graph
-        #     # interference = InterferenceGraph(liveness)
-        #     # # Do register allocation
-        #     # register_allocation = RegisterAllocation(interference)
-        #     # # Assign registers
-        #     # for var in node.variables:
-        #     #     if var in register_allocation.register_allocations:
-        #     #         self.register_assignments[var] = x86_Register(register_allocation.register_allocations[var])
-        #     #     else:
-        #     #         # We need to spill this variable
-        #     #         self.has_spilled = True
-        #     # Naive register allocation
-        #     # Put everything on the stack
-        #     register_assignments = { var: x86_Memory(base=x86_Registers['rbp'], offset=VAR_SIZE * i) for i, var in enumerate(node.variables)}
-        #     return register_assignments
-
-        i = 0
-        while True:
-            self.has_spilled = False
-            self.prefix = f'{self.og_prefix}_{node.name}_2_{i}'
-            # register_assignments = { arg.id: x86_Registers[argument_registers[i]] for i, arg in enumerate(node.args) }
-            register_assignments = {}
-            node.update_variables()
-            # register_assignments = { var: x86_Memory(base=x86_Registers['rbp'], offset=-(VAR_SIZE * (i))) for i, var in enumerate(node.variables) if var not in register_assignments}
-            for i, var in enumerate(node.variables):
-                if var not in register_assignments.keys():
-                    register_assignments[var] = x86_Memory(base=x86_Registers['rbp'], offset=-(VAR_SIZE * (i+1)))
-            # print(register_assignments)
-            break
-            # # if we have not spilled, we are done
-            # if not self.has_spilled:
-            #     break
-            # i += 1
-        # Move the arguments to the correct registers
-        argument_registers = ['rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9']
-        for i, arg in enumerate(node.args):
-            if i < len(argument_registers):
-                # register_assignments[arg.id] = x86_Registers[argument_registers[i]]
-                node.body.insert(0, x86_Movq(src=x86_Registers[argument_registers[i]], dst=register_assignments[arg.id]))
-            else:
-                raise NotImplementedError('Too many arguments')
+        # Move the arguments out of the argument registers
+        # (before allocation so the moves take part in the liveness analysis)
+        if len(node.args) > len(ARGUMENT_REGISTERS):
+            raise NotImplementedError('Too many arguments')
+        node.body[0:0] = [
+            x86_Movq(src=x86_Registers[reg], dst=ir_Name(id=arg.id))
+            for arg, reg in zip(node.args, ARGUMENT_REGISTERS)
+        ]
 
+        register_assignments = allocate_registers(node, VAR_SIZE)
 
         # Replace all ir_Name nodes with the new register assignments from the dict map
         #functions = self.functions
@@ -386,10 +432,24 @@ class ir_Module_to_x86_Transformer(BodyStacker):
         
         # Visit the function again to fix x86 instructions with too many memory references
         node.register_assignments = register_assignments
+        self.prefix = f'{self.og_prefix}_{node.name}_2_0'
         super().visit_ir_Function(node)
 
+        # Remove moves made redundant by the coloring
+        node.body = [stmnt for stmnt in node.body if not self.is_self_move(stmnt)]
+
         get_calls(node,register_assignments)
 
+    @staticmethod
+    def is_self_move(stmnt: x86_stmnt):
+        if not isinstance(stmnt, x86_Movq):
+            return False
+        if isinstance(stmnt.src, x86_Register) and isinstance(stmnt.dst, x86_Register):
+            return stmnt.src.id == stmnt.dst.id
+        if isinstance(stmnt.src, x86_Memory) and isinstance(stmnt.dst, x86_Memory):
+            return stmnt.src.offset == stmnt.dst.offset and stmnt.src.base.id == stmnt.dst.base.id
+        return False
+
 
     def visit_x86_Movq(self, node: x86_Movq):
         '''
@@ -424,7 +484,7 @@ class ir_Module_to_x86_Transformer(BodyStacker):
             # This one is special since this instruction is used with 'al' as the source
             # This one is special because the temp register is the destination
             # return x86_Movzbq(src=node.src, dst=self.move_to_register(node.dst))
-            temp = self.get_reg_sequential()
+            temp = x86_Registers[SPILL_REGISTER]
             self.appendToCurrentBody(x86_Movzbq(src=node.src, dst=temp))
             return x86_Movq(src=temp, dst=node.dst)
         return node
@@ -441,15 +501,31 @@ class ir_Module_to_x86_Transformer(BodyStacker):
             return x86_Add(src=self.move_to_register(node.src), dst=node.dst)
         return node
 
+    def visit_x86_And(self, node: x86_And):
+        '''
+        Fix x86_And instructions with too many memory references
+        '''
+        if isinstance(node.src, x86_Memory) and isinstance(node.dst, x86_Memory):
+            return x86_And(src=self.move_to_register(node.src), dst=node.dst)
+        return node
+
+    def visit_x86_Or(self, node: x86_Or):
+        '''
+        Fix x86_Or instructions with too many memory references
+        '''
+        if isinstance(node.src, x86_Memory) and isinstance(node.dst, x86_Memory):
+            return x86_Or(src=self.move_to_register(node.src), dst=node.dst)
+        return node
+
     def visit_x86_Cmp(self, node: x86_Cmp):
         '''
         Fix x86_Cmp instructions with too many memory references
         '''
         # If the source is a memory location and the destination is a memory location
         if isinstance(node.src, x86_Memory) and isinstance(node.dst, x86_Memory):
-            return x86_Cmp(src=self.move_to_register(node.src), dst=self.move_to_register(node.dst))
-        if isinstance(node.src, x86_Constant) and isinstance(node.dst, x86_Constant):
-            # We need to move the source to a register first
+            return x86_Cmp(src=self.move_to_register(node.src), dst=node.dst)
+        if isinstance(node.dst, x86_Constant):
+            # The destination of cmp cannot be an immediate
             # self.appendToCurrentBody(x86_Movq(src=node.src, dst=x86_Registers['rax']))
             # return x86_Cmp(src=x86_Registers['rax'], dst=node.dst)
             return x86_Cmp(src=node.src, dst=self.move_to_register(node.dst))
@@ -460,21 +536,11 @@ class ir_Module_to_x86_Transformer(BodyStacker):
         Move the source to a register
         '''
         if register is None:
-            register = self.get_reg_sequential()
+            register = x86_Registers[SPILL_REGISTER]
         # We need to move the source to a register first
         self.appendToCurrentBody(x86_Movq(src=node, dst=register))
         return register
 
-    def get_reg_sequential(self):
-        '''
-        Get a register sequentially
-        '''
-        reg = x86_Registers[list(x86_Registers.keys())[int(self.get_temp('')) % len(x86_Registers)]]
-        if reg.is8Bit() or reg.isReserved():
-            reg = self.get_reg_sequential()
-        return reg
-
-
     ...
 
 # def to_x86(ir_module: ir_Module) -> List[x86_stmnt]:
@@ -124,6 +124,10 @@ class TempGenerator(set):
         # self.add_user(name, func_name)
         return name
 
+    def count(self) -> int:
+        ''' Number of temps handed out since the last reset '''
+        return sum(self._temp_num.values())
+
     def reset(self):
         self._temp_num = {}
         self.clear()
@@ -143,11 +147,18 @@ class BodyStacker(NodeTransformer, TempContext):
         It also provides a few helper functions for manipulating the tree:
         - replaceWithTemp: Replaces a node with a temporary variable
         - appendToCurrentBody: Appends a node to the current body
+
+        `modified` counts the changes made to the tree by the last transform,
+        so drivers can iterate passes to a fixpoint without comparing unparsed code.
     """
     def __init__(self, prefix: str = 'f'):
         super().__init__()
         self.prefix = prefix
         self._body_stack = []
+        self.modified = 0
+
+    def markModified(self):
+        self.modified += 1
     
     def _pushCurrentBody(self, body):
         self._body_stack.append(body)
@@ -159,6 +170,7 @@ class BodyStacker(NodeTransformer, TempContext):
         return self._body_stack[-1]
     
     def appendToCurrentBody(self, node: AST):
+        self.markModified()
         self._body_stack[-1].append(node)
 
     def get_temp(self, alternate_prefix: str = None):
@@ -172,8 +184,10 @@ class BodyStacker(NodeTransformer, TempContext):
             if index == -1:
                 self.appendToCurrentBody(new)
             else:
+                self.markModified()
                 self._getCurrentBody().insert(index, new)
         else:
+            self.markModified()
             body.insert(index, new)
         return Name(id=new_id, ctx=Load())
 
@@ -216,6 +230,7 @@ class BodyStacker(NodeTransformer, TempContext):
         # Convert to `while 1:` and add a break statement
         # but only if the test isn't already `while 1:`
         if not (isinstance(node.test, Constant) and node.test.value == 1):
+            self.markModified()
             test = node.test
             node.test = Constant(value=1)
             iff = If(test=test, body=node.body, orelse=[Break()])
@@ -246,6 +261,7 @@ class BodyStacker(NodeTransformer, TempContext):
         '''
         # tt = c()
         # if isinstance(tree, Module):
+        self.modified = 0
         insertParentPointers(tree)
         tree = self.visit(tree)
         fix_missing_locations(tree)
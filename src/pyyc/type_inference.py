@@ -0,0 +1,208 @@
+'''
+Flow-sensitive type inference over the IR.
+
+After explicate every value is a boxed pyobj and every operation checks the
+tag of its operands, so values are injected and then immediately projected
+again. This pass tracks, for each variable, what is known about it at each
+point of the function:
+- ('tag', TAG, has_raw): a pyobj whose tag is known (see constants.py).
+  If has_raw is set, the unboxed value is also held in raw_name(var).
+- ('const', value): a raw (unboxed) constant.
+
+Every injection `x = inject_int(a)` is rewritten to keep the unboxed value
+in a shadow variable (`x = inject_int(a); raw.x = project_int(x)`, the
+runtime only keeps the low bits of an int, see constants.py). Since all of the
+definitions of x use the same shadow variable, the fact survives merges in
+the CFG, which lets loop-carried counters stay unboxed.
+
+With the facts, the pass rewrites:
+- is_int(x) / is_bool(x) / is_big(x) -> constant
+- project_int(x) / project_bool(x) / project_big(x) -> raw.x
+- is_true(x) -> raw.x (bool) or raw.x != 0 (int)
+- branches on constants -> jumps (and removes the blocks that become unreachable)
+
+The analysis is optimistic (like sparse conditional constant propagation):
+only the CFG edges which can be taken are followed, so a check that is
+always true inside a loop does not get polluted by the slow path it skips.
+'''
+
+from typing import Dict, List, Optional, Tuple
+
+from IR import *
+from cfg import CFG
+from dataflow import Worklist, constant, meet
+from constants import INT_TAG, BOOL_TAG, BIG_TAG, inject_value, project_value
+
+INJECTIONS = {'inject_int': INT_TAG, 'inject_bool': BOOL_TAG, 'inject_big': BIG_TAG}
+TAG_CHECKS = {'is_int': INT_TAG, 'is_bool': BOOL_TAG, 'is_big': BIG_TAG}
+PROJECTIONS = {'project_int': INT_TAG, 'project_bool': BOOL_TAG, 'project_big': BIG_TAG}
+PROJECTION_OF = {'inject_int': 'project_int', 'inject_bool': 'project_bool', 'inject_big': 'project_big'}
+
+Fact = Tuple
+State = Dict[str, Fact]
+
+def raw_name(var: str) -> str:
+    ''' Name of the shadow variable holding the unboxed value of var '''
+    return f'raw.{var}'
+
+class TypeInference:
+    '''
+    Type inference and boxing elimination for one ir_Function.
+    '''
+    def __init__(self, function: ir_Function):
+        self.function = function
+        self.cfg = CFG(function, lambda s: (set(), set()))
+        self.in_states: Dict[int, State] = {}
+
+    def run(self) -> ir_Function:
+        if len(self.function.body) == 0:
+            return self.function
+        self.analyze()
+        body = []
+        for block in self.cfg.basic_blocks:
+            if block.index not in self.in_states:
+                # Unreachable
+                continue
+            state = dict(self.in_states[block.index])
+            for stmnt in block.statements:
+                body.extend(self.transfer(stmnt, state))
+        self.function.body = body
+        return self.function
+
+    def analyze(self):
+        '''
+        Worklist over the blocks in reverse postorder, following only the edges which can be taken.
+        A block is visited again when the state at its start changes.
+        '''
+        entry = self.cfg.get_entry_block()
+        out_states: Dict[int, State] = {}
+        executable = set()
+        worklist = Worklist(self.cfg)
+        worklist.add(entry)
+        while worklist:
+            block = worklist.pop()
+            incoming = [out_states[p.index] for p in block.prev_blocks if (p.index, block.index) in executable]
+            if block is entry:
+                incoming.append({})
+            state = meet(incoming)
+            if block.index in out_states and self.in_states[block.index] == state:
+                continue
+            self.in_states[block.index] = state
+            state = dict(state)
+            last = None
+            for stmnt in block.statements:
+                last = self.transfer(stmnt, state)[-1]
+            changed = out_states.get(block.index) != state
+            out_states[block.index] = state
+            for succ in self.successors(block, last):
+                edge = (block.index, succ.index)
+                if changed or edge not in executable:
+                    executable.add(edge)
+                    worklist.add(succ)
+
+    def successors(self, block: CFG.BasicBlock, last: Optional[ir_stmt]) -> List[CFG.BasicBlock]:
+        ''' The blocks reachable from the (rewritten) last statement of the block '''
+        if isinstance(last, ir_Jump):
+            labels = [last.label]
+        elif isinstance(last, ir_Branch):
+            labels = [last.true_label, last.false_label]
+        elif isinstance(last, ir_Return):
+            labels = []
+        else:
+            following = block.index + 1
+            return self.cfg.basic_blocks[following:following + 1]
+        return [self.cfg.block_dict[l] for l in labels if l in self.cfg.block_dict]
+
+    def fact_of(self, value: ir_trgt, state: State) -> Optional[Fact]:
+        if isinstance(value, ir_Constant):
+            return ('const', int(value.value))
+        if isinstance(value, ir_Name):
+            return state.get(value.id)
+        return None
+
+    def tag_of(self, value: ir_trgt, state: State) -> Optional[Fact]:
+        fact = self.fact_of(value, state)
+        if fact is not None and fact[0] == 'tag':
+            return fact
+        return None
+
+    def transfer(self, stmnt: ir_stmt, state: State) -> List[ir_stmt]:
+        '''
+        Rewrite a statement using the facts in state, and update state with its effect.
+        Returns the statements which replace it.
+        '''
+        if isinstance(stmnt, ir_Branch):
+            fact = self.fact_of(stmnt.condition, state)
+            if fact is not None and fact[0] == 'const':
+                return [ir_Jump(label=stmnt.true_label if fact[1] else stmnt.false_label)]
+            return [stmnt]
+        if not isinstance(stmnt, ir_Assign):
+            return [stmnt]
+        target = stmnt.target.id
+        value = stmnt.value
+        new = [stmnt]
+        fact = None
+        if isinstance(value, ir_Target):
+            fact = self.fact_of(value.target, state)
+            if fact is not None and fact[0] == 'tag' and fact[2]:
+                # Copy the unboxed value along with the boxed one
+                raw = raw_name(value.target.id)
+                new = [ir_Assign(target=ir_Name(id=raw_name(target)), value=ir_Target(target=ir_Name(id=raw))), stmnt]
+                self.set_fact(state, raw_name(target), state.get(raw))
+        elif isinstance(value, ir_Call) and len(value.args) == 1:
+            func = value.func
+            arg = value.args[0]
+            tag = self.tag_of(arg, state)
+            if func in INJECTIONS:
+                raw = raw_name(target)
+                arg_fact = self.fact_of(arg, state)
+                raw_fact = None
+                if arg_fact is not None and arg_fact[0] == 'const':
+                    # Boxing a constant can be done at compile time (see to_x86)
+                    arg = constant(arg_fact[1])
+                    if func != 'inject_big':
+                        raw_fact = ('const', project_value(inject_value(arg_fact[1], INJECTIONS[func])))
+                # The shadow is what projecting the boxed value gives, not the argument
+                # (which may not fit in the boxed value)
+                new = [
+                    ir_Assign(target=stmnt.target, value=ir_Call(func=func, args=[arg])),
+                    ir_Assign(target=ir_Name(id=raw),
+                              value=ir_Call(func=PROJECTION_OF[func], args=[ir_Name(id=target)])),
+                ]
+                self.set_fact(state, target, ('tag', INJECTIONS[func], True))
+                self.set_fact(state, raw, raw_fact)
+                return new
+            elif func in TAG_CHECKS and tag is not None:
+                result = int(tag[1] == TAG_CHECKS[func])
+                new = [ir_Assign(target=stmnt.target, value=ir_Target(target=constant(result)))]
+                fact = ('const', result)
+            elif func in PROJECTIONS and tag is not None and tag[2] and tag[1] == PROJECTIONS[func]:
+                raw = raw_name(arg.id)
+                new = [ir_Assign(target=stmnt.target, value=ir_Target(target=ir_Name(id=raw)))]
+                fact = state.get(raw)
+            elif func == 'is_true' and tag is not None and tag[2] and tag[1] in (INT_TAG, BOOL_TAG):
+                raw = ir_Name(id=raw_name(arg.id))
+                raw_fact = state.get(raw.id)
+                if raw_fact is not None and raw_fact[0] == 'const':
+                    result = int(raw_fact[1] != 0)
+                    new = [ir_Assign(target=stmnt.target, value=ir_Target(target=constant(result)))]
+                    fact = ('const', result)
+                elif tag[1] == BOOL_TAG:
+                    new = [ir_Assign(target=stmnt.target, value=ir_Target(target=raw))]
+                else:
+                    new = [ir_Assign(target=stmnt.target, value=ir_Compare(left=raw, op=ir_NotEq(), right=constant(0)))]
+        self.set_fact(state, target, fact)
+        return new
+
+    @staticmethod
+    def set_fact(state: State, var: str, fact: Optional[Fact]):
+        if fact is None:
+            state.pop(var, None)
+        else:
+            state[var] = fact
+
+def infer_types(module: ir_Module) -> ir_Module:
+    ''' Run type inference on every function of the module '''
+    for function in module.functions:
+        TypeInference(function).run()
+    return module
@@ -67,7 +67,7 @@ x86_Registers = {
     'bh': x86_Register('bh', 8, True, ['rbx']),
     'ch': x86_Register('ch', 8, True, ['rcx']),
     'dh': x86_Register('dh', 8, True, ['rdx']),
-    'rax': x86_Register('rax', 64, False, ['al', 'ah']),
+    'rax': x86_Register('rax', 64, True, ['al', 'ah']),
     'rbx': x86_Register('rbx', 64, False, ['bl', 'bh']),
     'rcx': x86_Register('rcx', 64, True, ['cl', 'ch']),
     'rdx': x86_Register('rdx', 64, True, ['dl', 'dh']),
@@ -232,6 +232,59 @@ class x86_Xorq(x86_stmnt):
         # Cannot have too many memory references
         assert(not (isinstance(self.src, x86_Memory) and isinstance(self.dst, x86_Memory)))
         return True
+class x86_And(x86_stmnt):
+    '''
+    x86 and instruction
+    - andq $3, %rax
+    '''
+    _fields = ('src', 'dst')
+    src: Union[x86_Register, x86_Memory, ir_Constant]
+    dst: Union[x86_Register, x86_Memory]
+    def __str__(self):
+        return f'{TAB_PREF}andq {self.src}, {self.dst}'
+    def is_valid(self):
+        assert(isinstance(self.src, (x86_Register, x86_Memory, ir_Constant)))
+        assert(isinstance(self.dst, (x86_Register, x86_Memory)))
+        # Cannot have too many memory references
+        assert(not (isinstance(self.src, x86_Memory) and isinstance(self.dst, x86_Memory)))
+        return True
+class x86_Or(x86_stmnt):
+    '''
+    x86 or instruction
+    - orq $1, %rax
+    '''
+    _fields = ('src', 'dst')
+    src: Union[x86_Register, x86_Memory, ir_Constant]
+    dst: Union[x86_Register, x86_Memory]
+    def __str__(self):
+        return f'{TAB_PREF}orq {self.src}, {self.dst}'
+    def is_valid(self):
+        assert(isinstance(self.src, (x86_Register, x86_Memory, ir_Constant)))
+        assert(isinstance(self.dst, (x86_Register, x86_Memory)))
+        # Cannot have too many memory references
+        assert(not (isinstance(self.src, x86_Memory) and isinstance(self.dst, x86_Memory)))
+        return True
+class x86_shift(x86_stmnt):
+    '''
+    x86 shift instruction type (only immediate shift counts are supported)
+    '''
+    _fields = ('src', 'dst')
+    _type = ClassVar[str]
+    src: ir_Constant
+    dst: Union[x86_Register, x86_Memory]
+    def __str__(self):
+        return f'{TAB_PREF}{self._type} {self.src}, {self.dst}'
+    def is_valid(self):
+        assert(isinstance(self._type, str))
+        assert(isinstance(self.src, ir_Constant))
+        assert(isinstance(self.dst, (x86_Register, x86_Memory)))
+        return True
+class x86_Shl(x86_shift):
+    ' 64-bit shift left '
+    _type = 'shlq'
+class x86_Sar(x86_shift):
+    ' 64-bit arithmetic shift right '
+    _type = 'sarq'
 class x86_Push(x86_stmnt):
     '''
     x86 push instruction
@@ -260,9 +313,11 @@ class x86_Call(x86_stmnt):
     '''
     x86 call instruction
     - callq print_any (call a 64-bit function, use call for 32-bit)
+    num_args is the number of argument registers read by the call (for liveness)
     '''
     _fields = ('func',)
     func: str
+    num_args: int = 6
     def __str__(self):
         return f'{TAB_PREF}callq {self.func}'
     def is_valid(self):
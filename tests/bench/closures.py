@@ -0,0 +1,39 @@
+def apply(f, x):
+    return f(x)
+
+def compose(f, g, x):
+    return f(g(x))
+
+def shift(x):
+    return x + step
+
+def run(n, delta):
+    def add(x):
+        return x + delta
+    def sub(x):
+        return add(x) + -delta + -delta
+    total = 0
+    i = 0
+    while i != n:
+        total = add(total)
+        total = sub(total)
+        total = shift(total)
+        i = i + 1
+    return total
+
+inc = lambda x: x + 1
+dec = lambda x: x + -1
+ops = [inc, dec, inc]
+step = 1
+n = eval(input())
+total = 0
+i = 0
+while i != n:
+    total = apply(inc, total)
+    total = compose(dec, dec, total)
+    total = ops[0](total)
+    total = ops[2](total)
+    total = shift(total)
+    i = i + 1
+print(total)
+print(run(n, 3))
@@ -0,0 +1,17 @@
+n = eval(input())
+d = {}
+i = 0
+while i != n:
+    d[i] = -i
+    i = i + 1
+total = 0
+round = 0
+while round != 10:
+    i = 0
+    while i != n:
+        total = total + d[i] + i
+        d[i] = d[i] + 1
+        i = i + 1
+    round = round + 1
+print(total)
+print(d[0] == 10)
@@ -0,0 +1,17 @@
+n = eval(input())
+l = []
+i = 0
+while i != n:
+    l = l + [i]
+    i = i + 1
+total = 0
+round = 0
+while round != 20:
+    i = 0
+    while i != n:
+        total = total + l[i] + -i
+        l[i] = l[i] + 1
+        i = i + 1
+    round = round + 1
+print(total)
+print(l[n + -1])
@@ -0,0 +1,14 @@
+n = eval(input())
+total = 0
+hits = 0
+i = 0
+while i != n:
+    j = 0
+    while j != 100:
+        total = total + j + -49
+        if i == j:
+            hits = hits + 1
+        j = j + 1
+    i = i + 1
+print(total)
+print(hits)
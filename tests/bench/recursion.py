@@ -0,0 +1,4 @@
+def fib(n):
+    return n if n == 0 or n == 1 else fib(n + -1) + fib(n + -2)
+
+print(fib(eval(input())))
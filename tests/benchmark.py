@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+'''
+Run-time benchmarks: CPU heavy P2 programs (tests/bench) compiled with pyyc
+and timed against the python interpreter.
+
+For each benchmark this compiles the program, links it with the run-time
+system, checks that it prints what python prints for the same input, and
+then runs both the executable and python --repeat times. The medians, the
+minimums and the speedup are printed as a table and appended, as one JSON
+object per run, to the history file (tests/bench/history.jsonl by default),
+so the numbers of different commits can be compared later. When `perf` is
+installed, the instructions the executable retires are counted too (they
+vary much less than the times).
+
+A benchmark which fails to compile, crashes or prints something else than
+python is recorded with its status and no times, and makes the exit status 1.
+'''
+
+import os
+import sys
+import json
+import glob
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import statistics
+import time
+from datetime import datetime, timezone
+
+### Constants
+
+this_file = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_file)
+root_dir = os.path.realpath(os.path.join(this_dir, '..'))
+
+compile_py = os.path.join(root_dir, 'src', 'pyyc', 'compile.py')
+runtime_dir = os.path.join(root_dir, 'runtime')
+runtime_lib = os.path.join(runtime_dir, 'libpyyruntime.a')
+
+cc = ['gcc', '-O2']
+
+default_bench_dir = os.path.join(this_dir, 'bench')
+default_history = os.path.join(default_bench_dir, 'history.jsonl')
+default_repeat = 5
+
+run_timeout = 120
+
+### Code
+
+def reference_python():
+    # type: () -> str
+    ''' The interpreter the P languages follow (python3.10), or this one '''
+    return shutil.which('python3.10') or sys.executable
+
+def git_revision():
+    # type: () -> Dict[str, object]
+    def git(*args):
+        result = subprocess.run(['git', '-C', root_dir] + list(args), stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True)
+        return result.stdout.strip() if result.returncode == 0 else None
+    status = git('status', '--porcelain', '--untracked-files=no')
+    return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(status) if status is not None else None}
+
+def read_input(input_path):
+    # type: (str) -> bytes
+    if not os.path.exists(input_path):
+        return b''
+    with open(input_path, 'rb') as f:
+        return f.read()
+
+def run(cmd, stdin):
+    # type: (List[str], bytes) -> (float, Optional[bytes])
+    ''' Run cmd on stdin, returns its wall time and its output (None if it failed) '''
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(cmd, input=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                timeout=run_timeout)
+    except subprocess.TimeoutExpired:
+        return (time.perf_counter() - start, None)
+    elapsed = time.perf_counter() - start
+    return (elapsed, result.stdout if result.returncode == 0 else None)
+
+def timings(times):
+    # type: (List[float]) -> Dict[str, object]
+    return {'median': statistics.median(times), 'min': min(times), 'times': times}
+
+def count_instructions(exe, stdin):
+    # type: (str, bytes) -> Optional[int]
+    ''' Instructions retired by one run of exe (perf stat), None without perf '''
+    perf = shutil.which('perf')
+    if perf is None:
+        return None
+    result = subprocess.run([perf, 'stat', '-x', ',', '-e', 'instructions', '--', exe],
+                            input=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True, timeout=run_timeout)
+    for line in result.stderr.splitlines():
+        fields = line.split(',')
+        if len(fields) > 2 and fields[2].startswith('instructions') and fields[0].isdigit():
+            return int(fields[0])
+    return None
+
+class Benchmark:
+    def __init__(self, source):
+        self.name = os.path.splitext(os.path.basename(source))[0]
+        self.source = source
+        self.stdin = read_input(os.path.splitext(source)[0] + '.in')
+
+    def build(self, work_dir):
+        # type: (str) -> (str, Optional[str], float)
+        ''' Compile and link in work_dir, returns the status, the executable and the compile time '''
+        pysource = os.path.join(work_dir, self.name + '.py')
+        shutil.copyfile(self.source, pysource)
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, compile_py, '--no-cache', pysource],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        compile_time = time.perf_counter() - start
+        if result.returncode != 0:
+            return ('compile error', None, compile_time)
+        exe = os.path.join(work_dir, self.name)
+        result = subprocess.run(cc + [os.path.join(work_dir, self.name + '.s'), runtime_lib, '-lm', '-o', exe],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode != 0:
+            return ('link error', None, compile_time)
+        return ('ok', exe, compile_time)
+
+    def measure(self, work_dir, python, repeat):
+        # type: (str, str, int) -> Dict[str, object]
+        (status, exe, compile_time) = self.build(work_dir)
+        record = {'status': status, 'compile_time': compile_time}
+        if exe is None:
+            return record
+        (_, expected) = run([python, self.source], self.stdin)
+        (_, output) = run([exe], self.stdin)
+        if expected is None:
+            record['status'] = 'python error'
+        elif output is None:
+            record['status'] = 'crashed'
+        elif output.split() != expected.split():
+            record['status'] = 'wrong output'
+        if record['status'] != 'ok':
+            return record
+        exe_times = [run([exe], self.stdin)[0] for _ in range(repeat)]
+        python_times = [run([python, self.source], self.stdin)[0] for _ in range(repeat)]
+        record['exe'] = timings(exe_times)
+        record['python'] = timings(python_times)
+        record['speedup'] = record['python']['median'] / record['exe']['median']
+        record['instructions'] = count_instructions(exe, self.stdin)
+        return record
+
+def find_benchmarks(bench_dir, names):
+    # type: (str, List[str]) -> List[Benchmark]
+    sources = sorted(glob.glob(os.path.join(bench_dir, '*.py')))
+    benchmarks = [Benchmark(source) for source in sources]
+    if names:
+        benchmarks = [b for b in benchmarks if b.name in names]
+    return benchmarks
+
+def print_table(results):
+    # type: (Dict[str, Dict[str, object]]) -> None
+    print('{:<12} {:>12} {:>10} {:>10} {:>8} {:>14}'.format(
+        'benchmark', 'status', 'pyyc (s)', 'python (s)', 'speedup', 'instructions'))
+    for name, r in results.items():
+        if r['status'] != 'ok':
+            print('{:<12} {:>12}'.format(name, r['status']))
+            continue
+        instructions = r['instructions'] if r['instructions'] is not None else '-'
+        print('{:<12} {:>12} {:>10.4f} {:>10.4f} {:>7.1f}x {:>14}'.format(
+            name, r['status'], r['exe']['median'], r['python']['median'], r['speedup'], instructions))
+
+def append_history(path, record):
+    # type: (str, Dict[str, object]) -> None
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+def main(argv):
+    argparser = argparse.ArgumentParser(description='Time pyyc compiled benchmarks against python.')
+    argparser.add_argument('names',
+                           help='benchmarks to run (default: every .py file of the benchmark directory)',
+                           nargs='*')
+    argparser.add_argument('--bench-dir',
+                           help='directory of the benchmark programs (default: {})'.format(default_bench_dir),
+                           default=default_bench_dir)
+    argparser.add_argument('-r', '--repeat',
+                           help='runs of each program (default: {})'.format(default_repeat),
+                           metavar='N',
+                           type=int,
+                           default=default_repeat)
+    argparser.add_argument('--python',
+                           help='reference interpreter (default: python3.10 if found, else {})'.format(sys.executable),
+                           default=reference_python())
+    argparser.add_argument('--history',
+                           help='JSON lines file the results are appended to (default: {})'.format(default_history),
+                           default=default_history)
+    argparser.add_argument('--no-history',
+                           help='only print the results',
+                           action='store_true')
+    args = argparser.parse_args(argv[1:])
+
+    if subprocess.run(['make', '-C', runtime_dir], stdout=subprocess.DEVNULL).returncode != 0:
+        print('Failed to build the run-time system.', file=sys.stderr)
+        return 1
+    benchmarks = find_benchmarks(args.bench_dir, args.names)
+    if not benchmarks:
+        print('No benchmarks found in {}'.format(args.bench_dir), file=sys.stderr)
+        return 1
+
+    python_version = subprocess.run([args.python, '--version'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, universal_newlines=True).stdout.strip()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='pyyc-bench-') as work_dir:
+        for benchmark in benchmarks:
+            results[benchmark.name] = benchmark.measure(work_dir, args.python, args.repeat)
+    print_table(results)
+
+    if not args.no_history:
+        record = {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'host': platform.node(),
+            'machine': platform.machine(),
+            'python': python_version,
+            'repeat': args.repeat,
+            'benchmarks': results,
+        }
+        record.update(git_revision())
+        append_history(args.history, record)
+    return 0 if all(r['status'] == 'ok' for r in results.values()) else 1
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+'''
+Compiler throughput benchmark: compiles synthetic programs of growing size
+(see synthetic.py) and reports how the compile time and memory scale.
+
+For each size this generates a program, compiles it --repeat times (in a
+fresh process, without the .s cache) for the wall time, the lines per second
+and the maximum resident set size, and once more with --stats for the time
+of every compiler phase (see src/pyyc/stats.py). The per phase table ends
+with the growth of each phase between the two largest sizes as an exponent
+(1 is linear, 2 is quadratic), which points at the phases which do not scale.
+
+A compile which fails or runs longer than --timeout is reported as such, and
+the larger sizes are skipped. The --stats compile has no timeout: it compiles
+the program a second time under tracemalloc for the memory of the phases,
+which takes several times longer than the compile itself.
+'''
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import tempfile
+import subprocess
+
+from synthetic import generate_program, default_depth, default_seed
+
+### Constants
+
+this_file = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_file)
+root_dir = os.path.realpath(os.path.join(this_dir, '..'))
+
+compile_py = os.path.join(root_dir, 'src', 'pyyc', 'compile.py')
+
+default_sizes = [1000, 2000, 4000]
+default_repeat = 1
+default_timeout = 600
+
+### Code
+
+def run_compile(pysource, args, timeout):
+    # type: (str, List[str], Optional[float]) -> (str, float, int)
+    '''
+    Compile pysource in a new process (with no time limit for a timeout of None).
+    Returns the status, the wall time and the maximum resident set size (bytes).
+    '''
+    start = time.perf_counter()
+    popen = subprocess.Popen([sys.executable, compile_py, '--no-cache'] + args + [pysource],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # wait4 gives the resources of this child alone
+    while True:
+        (pid, status, rusage) = os.wait4(popen.pid, os.WNOHANG)
+        if pid != 0:
+            break
+        if timeout is not None and time.perf_counter() - start > timeout:
+            popen.kill()
+            popen.wait()
+            return ('timeout', time.perf_counter() - start, 0)
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    # Reaped by wait4 above, so popen must not wait for it again
+    popen.returncode = os.waitstatus_to_exitcode(status)
+    return ('ok' if popen.returncode == 0 else 'failed', elapsed, rusage.ru_maxrss * 1024)
+
+def measure(size, args, work_dir):
+    # type: (int, argparse.Namespace, str) -> Dict[str, object]
+    lambdas = args.lambdas if args.lambdas is not None else max(size // 20, 1)
+    program = generate_program(size, args.depth, lambdas, args.seed)
+    pysource = os.path.join(work_dir, 'synthetic{}.py'.format(size))
+    with open(pysource, 'w') as f:
+        f.write(program)
+    lines = program.count('\n')
+    result = {'statements': size, 'lines': lines, 'status': 'ok'}
+    times = []
+    max_rss = 0
+    for _ in range(args.repeat):
+        (status, elapsed, rss) = run_compile(pysource, [], args.timeout)
+        if status != 'ok':
+            result['status'] = status
+            return result
+        times.append(elapsed)
+        max_rss = max(max_rss, rss)
+    wall_time = min(times)
+    result.update({'wall_time': wall_time, 'lines_per_second': lines / wall_time, 'max_rss': max_rss})
+    stats_path = os.path.join(work_dir, 'synthetic{}.json'.format(size))
+    (status, _, _) = run_compile(pysource, ['--stats-file', stats_path], None)
+    if status == 'ok':
+        with open(stats_path) as f:
+            result['phases'] = json.load(f)['phases']
+    return result
+
+def growth(small, large):
+    # type: (Dict[str, object], Dict[str, object]) -> Dict[str, float]
+    ''' Exponent of the growth of each phase's time from the small to the large program '''
+    ratio = math.log(large['lines'] / small['lines'])
+    if ratio == 0:
+        return {}
+    small_times = {p['name']: p['wall_time'] for p in small['phases']}
+    exponents = {}
+    for p in large['phases']:
+        before = small_times.get(p['name'])
+        if before and p['wall_time']:
+            exponents[p['name']] = math.log(p['wall_time'] / before) / ratio
+    return exponents
+
+def print_results(results):
+    # type: (List[Dict[str, object]]) -> None
+    print('{:>10} {:>7} {:>10} {:>10} {:>12}'.format('statements', 'lines', 'time (s)', 'lines/s', 'max RSS (MB)'))
+    for r in results:
+        if r['status'] != 'ok':
+            print('{:>10} {:>7} {:>10}'.format(r['statements'], r['lines'], r['status']))
+            continue
+        print('{:>10} {:>7} {:>10.3f} {:>10.1f} {:>12.1f}'.format(
+            r['statements'], r['lines'], r['wall_time'], r['lines_per_second'], r['max_rss'] / 2**20))
+
+    with_phases = [r for r in results if 'phases' in r]
+    if not with_phases:
+        return
+    print()
+    print('Time of each phase (s), with --stats:')
+    header = '{:<20}'.format('phase') + ''.join('{:>10}'.format(r['lines']) for r in with_phases)
+    exponents = growth(with_phases[-2], with_phases[-1]) if len(with_phases) > 1 else {}
+    if exponents:
+        header += '{:>8}'.format('growth')
+    print(header)
+    for i, p in enumerate(with_phases[-1]['phases']):
+        row = '{:<20}'.format(p['name'])
+        row += ''.join('{:>10.3f}'.format(r['phases'][i]['wall_time']) for r in with_phases)
+        if p['name'] in exponents:
+            row += '{:>8.2f}'.format(exponents[p['name']])
+        print(row)
+
+def main(argv):
+    argparser = argparse.ArgumentParser(description='Measure how compile time and memory scale with program size.')
+    argparser.add_argument('sizes',
+                           help='numbers of statements of the generated programs (default: {})'.format(
+                               ' '.join(map(str, default_sizes))),
+                           type=int,
+                           nargs='*')
+    argparser.add_argument('--depth',
+                           help='maximum nesting of ifs and whiles (default: {})'.format(default_depth),
+                           type=int,
+                           default=default_depth)
+    argparser.add_argument('--lambdas',
+                           help='lambdas in each program (default: one per 20 statements)',
+                           type=int)
+    argparser.add_argument('--seed',
+                           help='random seed of the programs (default: {})'.format(default_seed),
+                           type=int,
+                           default=default_seed)
+    argparser.add_argument('-r', '--repeat',
+                           help='compiles of each program, the fastest is reported (default: {})'.format(default_repeat),
+                           metavar='N',
+                           type=int,
+                           default=default_repeat)
+    argparser.add_argument('--timeout',
+                           help='seconds a compile may take (default: {})'.format(default_timeout),
+                           type=float,
+                           default=default_timeout)
+    argparser.add_argument('--keep',
+                           help='directory to keep the generated programs and stats in (default: a temporary one)',
+                           metavar='DIR')
+    argparser.add_argument('--json',
+                           help='also write the results as JSON to FILE',
+                           metavar='FILE')
+    args = argparser.parse_args(argv[1:])
+    sizes = sorted(args.sizes or default_sizes)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='pyyc-compile-bench-') as tmp_dir:
+        work_dir = args.keep or tmp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        for size in sizes:
+            result = measure(size, args, work_dir)
+            results.append(result)
+            print('{} statements: {}'.format(size, result['status']), file=sys.stderr)
+            if result['status'] != 'ok':
+                break
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+    return 0 if all(r['status'] == 'ok' for r in results) else 1
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
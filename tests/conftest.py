@@ -1,8 +1,9 @@
 import pytest
 
 import os
+import fcntl
 
-from test_compiler import Pyyctest, Result, default_pyyctests
+from test_compiler import Pyyctest, Result, default_pyyctests, runtime_lib
 
 ### Code
 
@@ -18,15 +19,42 @@ def find_pyyctests(acc, root):
                 loop(os.path.join(root, sub))
     loop(root)
 
+runtime_hash_key = 'pyyc/runtime_hash'
+
+@pytest.fixture(scope='session')
+def build(request):
+    """Builds the run-time system and the compiler once per session.
+
+    make is skipped for the run-time system when its sources hash to the same
+    value as at the last successful build (kept in the pytest cache) and the
+    library is still there. Returns an error message if a build failed.
+    Parallel sessions (shards) take turns, so make never runs twice at once.
+    """
+    # type: (...) -> Optional[str]
+    cache = getattr(request.config, 'cache', None)
+    if cache is None:
+        return build_runtime_and_compiler(None)
+    with open(os.path.join(str(cache.mkdir('pyyc')), 'build.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return build_runtime_and_compiler(cache)
+
+def build_runtime_and_compiler(cache):
+    # type: (Optional[Cache]) -> Optional[str]
+    runtime_hash = Pyyctest.runtime_hash()
+    built = cache is not None and cache.get(runtime_hash_key, None) == runtime_hash
+    if not (built and os.path.exists(runtime_lib)):
+        if Pyyctest.build_runtime() == Result.failure:
+            return 'Failed to build the run-time system.'
+        if cache is not None:
+            cache.set(runtime_hash_key, runtime_hash)
+    if Pyyctest.build_compiler() == Result.failure:
+        return 'Failed to build your compiler.'
+    return None
+
 @pytest.fixture
-def filename_py(request):
-    runtime_result = Pyyctest.build_runtime()
-    if runtime_result == Result.failure:
-        print('Failed to build the run-time system.')
-        return None
-    compiler_result = Pyyctest.build_compiler()
-    if compiler_result == Result.failure:
-        print('Failed to build your compiler.')
+def filename_py(request, build):
+    if build is not None:
+        print(build)
         return None
     return request.param
 
@@ -34,6 +62,19 @@ def pytest_addoption(parser):
     parser.addoption('--pyyctests',
                      help='add pyyc test file name or root directory (default if none specified: {})'.format(default_pyyctests),
                      action='append')
+    parser.addoption('--shard',
+                     help='only run the K-th of N equal parts of the tests (K/N, from 1/N to N/N), to run them in parallel',
+                     metavar='K/N')
+
+def parse_shard(shard):
+    # type: (str) -> (int, int)
+    try:
+        (k, n) = [int(part) for part in shard.split('/')]
+    except ValueError:
+        raise ValueError('Invalid shard {} (expected K/N)'.format(shard))
+    if not 1 <= k <= n:
+        raise ValueError('Invalid shard {} (expected 1 <= K <= N)'.format(shard))
+    return (k, n)
 
 def pytest_generate_tests(metafunc):
     if 'filename_py' in metafunc.fixturenames:
@@ -50,4 +91,10 @@ def pytest_generate_tests(metafunc):
         acc = []
         for root in pyyctests:
             find_pyyctests(acc, root)
+        # Sorted so every shard sees the same order
+        acc.sort()
+        shard = metafunc.config.getoption('shard')
+        if shard is not None:
+            (k, n) = parse_shard(shard)
+            acc = acc[k - 1::n]
         metafunc.parametrize('filename_py', acc, indirect=True)
@@ -0,0 +1,7 @@
+x = eval(input())
+y = 0
+if x:
+    y = 1
+else:
+    print(5)
+print(7)
@@ -0,0 +1,25 @@
+def fib(n):
+    return n if n == 0 or n == 1 else fib(n + -1) + fib(n + -2)
+
+def twice(x):
+    return inc(inc(x))
+
+def inc(x):
+    return x + step
+
+def count(n, step):
+    def add(x):
+        return x + step
+    total = 0
+    i = 0
+    while i != n:
+        total = add(total)
+        i = i + 1
+    return total
+
+step = eval(input())
+print(fib(eval(input())))
+print(twice(1))
+print(inc(fib(5)))
+print(count(4, 5))
+print(twice(count(2, step)))
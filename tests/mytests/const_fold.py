@@ -0,0 +1,11 @@
+x = 3
+y = x + 4
+z = y
+if z == 7:
+    print(z + -x)
+else:
+    print(0)
+w = eval(input())
+v = w
+print(v + y)
+print(not x)
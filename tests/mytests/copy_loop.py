@@ -0,0 +1,15 @@
+i = 0
+while i != 3:
+    if i != 0:
+        x = y
+    y = eval(input())
+    if i != 0:
+        print(x)
+    z = eval(input())
+    if i != 1:
+        w = z
+    print(w)
+    c = 5
+    if i != 0:
+        print(c + i)
+    i = i + 1
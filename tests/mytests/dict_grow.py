@@ -0,0 +1,17 @@
+n = eval(input())
+d = {}
+i = 0
+while i != n:
+    d[i] = i + i
+    i = i + 1
+print(d)
+print(d[7] + d[n + -1])
+e = {1: 1, 2: 2, 3: False, True: 2, False: 1}
+print(e)
+f = {False: 1, True: 2, 3: False, 2: 2}
+print(e == f)
+d[True] = [1, 2]
+d[0] = {5: d[1]}
+print(d[1])
+print(d == d)
+print(d != e)
@@ -0,0 +1,13 @@
+n = eval(input())
+keep = [0, {0: [1]}]
+i = 0
+total = 0
+while i != n:
+    t = [i, [i, i + 1], {i: [i]}]
+    total = t[1][1] + -t[2][i][0] + total
+    if i == 5000:
+        keep[0] = t
+    i = i + 1
+print(total)
+print(keep[0][1])
+print(keep[1])
@@ -0,0 +1,10 @@
+n = eval(input())
+total = 0
+i = 0
+while i != n:
+    total = total + eval(input())
+    i = i + 1
+print(total)
+print(eval(input()))
+print(eval(input()))
+print(eval(input()))
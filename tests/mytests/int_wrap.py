@@ -0,0 +1,21 @@
+a = 2147483649
+print(a)
+print(a == 1)
+n = eval(input())
+m = n + n + n + n + n
+print(m)
+print(m < 0)
+print(m == n + -4)
+l = [a, m, m + 1]
+print(l)
+print(l[1] == m)
+i = 0
+s = 0
+while i != 4:
+    s = s + m
+    i = i + 1
+print(s)
+print(s < 0)
+d = {m: 1, a: 2}
+print(d[n + -4])
+print(d[1])
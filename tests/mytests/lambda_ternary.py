@@ -0,0 +1,6 @@
+f = lambda p: p + (p if p < 33 else 43)
+g = lambda a, b: (a if b else (lambda c: c + 1)(a))
+print(f(eval(input())))
+print(f(50))
+print(g(1, 0))
+print(g(5, 1))
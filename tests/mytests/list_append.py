@@ -0,0 +1,15 @@
+n = eval(input())
+l = []
+i = 0
+while i != n:
+    l = l + [i]
+    i = i + 1
+print(l[0] + l[n + -1])
+small = [1, 2]
+small = small + small
+small = small + [3]
+print(small)
+alias = small
+small = small + [4]
+print(alias)
+print(small)
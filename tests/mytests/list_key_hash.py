@@ -0,0 +1,17 @@
+k = [1, 2]
+d = {}
+d[k] = 1
+print(d[k])
+print(d[[1, 2]])
+d[[1, 5]] = 2
+k[1] = 5
+print(d[k])
+print(d[[1, 5]])
+d[[1, 5, 7]] = 3
+k = k + [7]
+print(d[k])
+print(d[[1, 5]])
+k[2] = 9
+d[k] = 4
+print(d[[1, 5, 9]])
+print(d)
@@ -0,0 +1,15 @@
+n = eval(input())
+i = 0
+total = 0
+while i < n:
+    if i == 3:
+        total = total + True
+    else:
+        total = total + i
+    i = i + 1
+print(total)
+print(i)
+b = n == 10
+while b:
+    b = False
+    print(b + 1)
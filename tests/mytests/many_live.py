@@ -0,0 +1,36 @@
+a = 1
+b = 2
+c = 3
+d = 4
+e = 5
+f = 6
+g = 7
+h = 8
+i = 9
+j = 10
+k = 11
+l = 12
+m = 13
+n = 14
+o = 15
+p = 16
+q = 17
+x = eval(input())
+print(a + x)
+print(b + x)
+print(c + x)
+print(d + x)
+print(e + x)
+print(f + x)
+print(g + x)
+print(h + x)
+print(i + x)
+print(j + x)
+print(k + x)
+print(l + x)
+print(m + x)
+print(n + x)
+print(o + x)
+print(p + x)
+print(q + x)
+print(a + b + c + d + e + f + g + h + i + j + k + l + m + n + o + p + q + x)
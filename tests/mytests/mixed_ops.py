@@ -0,0 +1,13 @@
+x = eval(input())
+y = True
+l = [1, 2]
+print(x + 1)
+print(x + y)
+print(y + y)
+print(l + [3])
+print(x < 5)
+print(x == y)
+print(l == [1, 2])
+print(1 != x)
+print(x >= 10)
+print(y > x)
@@ -0,0 +1,12 @@
+l = [1, 2]
+l[0] = l
+print(l)
+d = {1: 2}
+d[2] = d
+d[3] = [d, l]
+print(d)
+a = [3]
+b = [a, a, {True: a}]
+print(b)
+print([])
+print({})
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+'''
+Generator of large synthetic P2 programs, for measuring how the compiler
+scales with the size of its input (see compile_benchmark.py).
+
+A program is a sequence of top level statements, function definitions and
+lambdas. The statements are assignments of int expressions, prints, list
+and dict stores, ifs and bounded while loops nested up to --depth levels;
+the expressions use +, unary -, ternaries, comparisons, and/or/not,
+subscripts and, outside of the functions and lambdas, calls of the ones
+defined before them (so there is no recursion). Every while loop runs a fixed number of times, so
+the programs also terminate under python.
+
+The same seed and sizes always generate the same program.
+'''
+
+import sys
+import random
+import argparse
+
+default_statements = 1000
+default_depth = 4
+default_lambdas = 50
+default_seed = 0
+
+indent_unit = '    '
+
+class Scope:
+    '''
+    The names an expression can use: the int variables, the lists and dicts
+    (whose indices 0 to container_size - 1 are bound) and whether it can call
+    the functions and lambdas.
+    '''
+    def __init__(self, params=(), calls=True):
+        self.ints = list(params)
+        self.lists = []
+        self.dicts = []
+        self.calls = calls
+
+    def copy(self):
+        scope = Scope(self.ints, self.calls)
+        scope.lists = list(self.lists)
+        scope.dicts = list(self.dicts)
+        return scope
+
+class ProgramGenerator:
+    '''
+    Generates a program of about `statements` simple statements, with
+    blocks nested up to `depth` levels and `lambdas` lambdas.
+    '''
+    # Elements of every generated list, and keys of every generated dict
+    container_size = 3
+    loop_count = 3
+    max_expr_depth = 2
+    # Every free variable of a function becomes one more argument after closure
+    # conversion and calls pass at most 6 (in registers), so the bodies of the
+    # functions and lambdas only use their parameters and locals.
+    max_params = 3
+
+    def __init__(self, statements=default_statements, depth=default_depth, lambdas=default_lambdas,
+                 seed=default_seed):
+        self.statements = statements
+        self.depth = depth
+        self.lambdas = lambdas
+        self.random = random.Random(seed)
+        self.lines = []
+        self.emitted = 0
+        self.names = 0
+        # The functions and lambdas defined so far, with their arity
+        self.functions = []
+
+    def fresh(self, prefix):
+        # type: (str) -> str
+        self.names += 1
+        return '{}{}'.format(prefix, self.names)
+
+    def emit(self, indent, line):
+        # type: (int, str) -> None
+        self.lines.append(indent_unit * indent + line)
+
+    ### Expressions
+
+    def int_expr(self, scope, depth=0):
+        # type: (Scope, int) -> str
+        r = self.random
+        if depth >= self.max_expr_depth or r.random() < 0.3:
+            if scope.ints and r.random() < 0.7:
+                return r.choice(scope.ints)
+            return str(r.randint(0, 100))
+        kind = r.randrange(6)
+        if kind == 0:
+            return '-' + self.atom(scope, depth + 1)
+        if kind == 1 and (scope.lists or scope.dicts):
+            container = r.choice(scope.lists + scope.dicts)
+            return '{}[{}]'.format(container, r.randrange(self.container_size))
+        if kind == 2 and self.functions and scope.calls:
+            (name, arity) = r.choice(self.functions)
+            args = ', '.join(self.int_expr(scope, depth + 1) for _ in range(arity))
+            return '{}({})'.format(name, args)
+        if kind == 3:
+            return '({} if {} else {})'.format(self.int_expr(scope, depth + 1), self.bool_expr(scope, depth + 1),
+                                               self.int_expr(scope, depth + 1))
+        return '{} + {}'.format(self.int_expr(scope, depth + 1), self.atom(scope, depth + 1))
+
+    def atom(self, scope, depth):
+        # type: (Scope, int) -> str
+        expr = self.int_expr(scope, depth)
+        return expr if expr.isidentifier() or expr.isdigit() else '(' + expr + ')'
+
+    def bool_expr(self, scope, depth=0):
+        # type: (Scope, int) -> str
+        r = self.random
+        kind = r.randrange(5)
+        if kind == 0 and depth < self.max_expr_depth:
+            op = r.choice(['and', 'or'])
+            return '({} {} {})'.format(self.bool_expr(scope, depth + 1), op, self.bool_expr(scope, depth + 1))
+        if kind == 1 and depth < self.max_expr_depth:
+            return 'not ' + self.bool_expr(scope, depth + 1)
+        op = r.choice(['==', '!=', '<'])
+        return '{} {} {}'.format(self.atom(scope, depth + 1), op, self.atom(scope, depth + 1))
+
+    ### Statements
+
+    def simple_statement(self, scope, indent):
+        # type: (Scope, int) -> None
+        r = self.random
+        kind = r.randrange(8)
+        self.emitted += 1
+        if kind == 0:
+            self.emit(indent, 'print({})'.format(self.int_expr(scope)))
+        elif kind == 1:
+            name = self.fresh('l')
+            elements = ', '.join(self.int_expr(scope) for _ in range(self.container_size))
+            self.emit(indent, '{} = [{}]'.format(name, elements))
+            scope.lists.append(name)
+        elif kind == 2:
+            name = self.fresh('d')
+            items = ', '.join('{}: {}'.format(k, self.int_expr(scope)) for k in range(self.container_size))
+            self.emit(indent, '{} = {{{}}}'.format(name, items))
+            scope.dicts.append(name)
+        elif kind == 3 and (scope.lists or scope.dicts):
+            container = r.choice(scope.lists + scope.dicts)
+            self.emit(indent, '{}[{}] = {}'.format(container, r.randrange(self.container_size), self.int_expr(scope)))
+        elif kind == 4 and scope.ints:
+            name = r.choice(scope.ints)
+            self.emit(indent, '{} = {} + {}'.format(name, name, self.atom(scope, 1)))
+        else:
+            name = self.fresh('v')
+            self.emit(indent, '{} = {}'.format(name, self.int_expr(scope)))
+            scope.ints.append(name)
+
+    def block(self, scope, indent, depth, size):
+        # type: (Scope, int, int, int) -> None
+        ''' About `size` statements, nested up to `depth` more levels '''
+        target = self.emitted + max(size, 1)
+        while self.emitted < target:
+            kind = self.random.randrange(6)
+            if depth > 0 and kind == 0:
+                self.if_statement(scope, indent, depth, size)
+            elif depth > 0 and kind == 1:
+                self.while_statement(scope, indent, depth, size)
+            else:
+                self.simple_statement(scope, indent)
+
+    def if_statement(self, scope, indent, depth, size):
+        # type: (Scope, int, int, int) -> None
+        self.emitted += 1
+        self.emit(indent, 'if {}:'.format(self.bool_expr(scope)))
+        # Names bound in one branch are not defined after the if
+        self.block(scope.copy(), indent + 1, depth - 1, size // 2)
+        self.emit(indent, 'else:')
+        self.block(scope.copy(), indent + 1, depth - 1, size // 2)
+
+    def while_statement(self, scope, indent, depth, size):
+        # type: (Scope, int, int, int) -> None
+        self.emitted += 2
+        counter = self.fresh('i')
+        self.emit(indent, '{} = 0'.format(counter))
+        self.emit(indent, 'while {} != {}:'.format(counter, self.loop_count))
+        self.block(scope.copy(), indent + 1, depth - 1, size // 2)
+        self.emit(indent + 1, '{} = {} + 1'.format(counter, counter))
+
+    def function(self, scope, size):
+        # type: (Scope, int) -> None
+        name = self.fresh('f')
+        params = [self.fresh('p') for _ in range(self.random.randint(1, self.max_params))]
+        self.emit(0, 'def {}({}):'.format(name, ', '.join(params)))
+        body = Scope(params, calls=False)
+        self.block(body, 1, self.depth, size)
+        self.emit(1, 'return {}'.format(self.int_expr(body)))
+        self.functions.append((name, len(params)))
+
+    def lambda_statement(self, scope):
+        # type: (Scope) -> None
+        self.emitted += 1
+        name = self.fresh('lam')
+        params = [self.fresh('p') for _ in range(self.random.randint(1, self.max_params))]
+        body = Scope(params, calls=False)
+        self.emit(0, '{} = lambda {}: {}'.format(name, ', '.join(params), self.int_expr(body)))
+        self.functions.append((name, len(params)))
+
+    def generate(self):
+        # type: () -> str
+        scope = Scope()
+        chunk = max(self.statements // 50, 5)
+        lambda_every = max(self.statements // (self.lambdas + 1), 1) if self.lambdas else None
+        lambdas = 0
+        next_lambda = lambda_every
+        while self.emitted < self.statements:
+            if lambda_every is not None and lambdas < self.lambdas and self.emitted >= next_lambda:
+                self.lambda_statement(scope)
+                lambdas += 1
+                next_lambda += lambda_every
+            elif self.random.random() < 0.3:
+                self.function(scope, chunk)
+            else:
+                self.block(scope, 0, self.depth, chunk)
+        while lambdas < self.lambdas:
+            self.lambda_statement(scope)
+            lambdas += 1
+        return '\n'.join(self.lines) + '\n'
+
+def generate_program(statements=default_statements, depth=default_depth, lambdas=default_lambdas,
+                     seed=default_seed):
+    # type: (int, int, int, int) -> str
+    return ProgramGenerator(statements, depth, lambdas, seed).generate()
+
+def main(argv):
+    argparser = argparse.ArgumentParser(description='Generate a large synthetic P2 program.')
+    argparser.add_argument('-n', '--statements',
+                           help='approximate number of statements (default: {})'.format(default_statements),
+                           metavar='N',
+                           type=int,
+                           default=default_statements)
+    argparser.add_argument('--depth',
+                           help='maximum nesting of ifs and whiles (default: {})'.format(default_depth),
+                           type=int,
+                           default=default_depth)
+    argparser.add_argument('--lambdas',
+                           help='number of lambdas (default: {})'.format(default_lambdas),
+                           type=int,
+                           default=default_lambdas)
+    argparser.add_argument('--seed',
+                           help='random seed (default: {})'.format(default_seed),
+                           type=int,
+                           default=default_seed)
+    argparser.add_argument('-o', '--output',
+                           help='file to write (default: stdout)')
+    args = argparser.parse_args(argv[1:])
+    program = generate_program(args.statements, args.depth, args.lambdas, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(program)
+    else:
+        sys.stdout.write(program)
+    return 0
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+'''
+Tests of the compiler driver (src/pyyc/compile.py) run as a command.
+'''
+
+import os
+import subprocess
+import sys
+
+this_file = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_file)
+root_dir = os.path.realpath(os.path.join(this_dir, '..'))
+
+compile_py = os.path.join(root_dir, 'src', 'pyyc', 'compile.py')
+
+def test_directory_with_a_failing_file(tmp_path):
+    (tmp_path / 'a.py').write_text('print(1)\n')
+    # String constants are not P1
+    (tmp_path / 'b.py').write_text('print("b")\n')
+    (tmp_path / 'c.py').write_text('x = eval(input())\nprint(x + 1)\n')
+    result = subprocess.run([sys.executable, compile_py, '--no-cache', '-j', '2', str(tmp_path)],
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 1
+    assert 'FAILED {}'.format(tmp_path / 'b.py') in result.stderr
+    assert '2/3 files compiled' in result.stdout
+    # The other files are still compiled
+    assert (tmp_path / 'a.s').exists()
+    assert (tmp_path / 'c.s').exists()
+    assert not (tmp_path / 'b.s').exists()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+'''
+Unit tests of single compiler passes (src/pyyc), which the end to end tests
+of test_compiler.py only see through the output of whole programs.
+'''
+
+import ast
+import copy
+import os
+import sys
+
+this_file = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_file)
+root_dir = os.path.realpath(os.path.join(this_dir, '..'))
+
+sys.path.insert(0, os.path.join(root_dir, 'src', 'pyyc'))
+
+from flatten import FlattenTreeTransformer
+from desugar import DesguarShortCircuitTransformer
+from tree_utils import insertParentPointers
+import box_front
+import explicate as exp
+from IR import ir_Function, ir_Assign, ir_Name, ir_Target, ir_Label, ir_Jump, ir_Branch, ir_Return, ir_void
+from cfg import CFG
+from dataflow import Dominators, constant
+
+### Desugaring
+
+def short_circuit_changes(source):
+    # type: (str) -> int
+    ''' Changes made by the short circuit desugaring of a program which is flat already '''
+    tree = ast.parse(source)
+    flatten = FlattenTreeTransformer('f_')
+    flatten.transform(tree)
+    assert flatten.modified == 0
+    short_circuit = DesguarShortCircuitTransformer('s_')
+    short_circuit.transform(tree)
+    assert not any(isinstance(n, (ast.BoolOp, ast.Compare)) and not getattr(n, 'visited', False)
+                   for n in ast.walk(tree))
+    return short_circuit.modified
+
+def test_short_circuit_and_is_a_change():
+    # The only change of the round, so the fixpoint loop of compile.py must see it
+    assert short_circuit_changes('a = 1\nb = 2\nc = a and b\nprint(c)\n') > 0
+
+def test_short_circuit_compare_is_a_change():
+    assert short_circuit_changes('a = 1\nb = 2\nc = a < b\nprint(c)\n') > 0
+    assert short_circuit_changes('a = 1\nb = 2\nc = a < b < 3\nprint(c)\n') > 0
+
+### Explicate
+
+def copied_objects(monkeypatch, program_size):
+    # type: (MonkeyPatch, int) -> int
+    ''' Objects copied for a helper while a program of program_size statements has parent pointers '''
+    lines = ['x{} = not (x{} + 1 == 2 and x{} < 3)'.format(i, i - 1, i - 1) for i in range(1, program_size)]
+    tree = ast.parse('x0 = 1\n' + '\n'.join(lines) + '\n')
+    insertParentPointers(tree)
+    copied = []
+    def deepcopy(template, memo):
+        pinned = len(memo)
+        result = copy.deepcopy(template, memo)
+        # The memo also keeps a list of the copied objects alive
+        copied.append(len(memo) - pinned - 1)
+        return result
+    monkeypatch.setattr(box_front, 'copy', type('copy', (), {'deepcopy': staticmethod(deepcopy)}))
+    box_front.get_helper_template(exp.__add__)
+    return copied[0]
+
+def test_helper_copy_does_not_grow_with_the_program(monkeypatch):
+    small = copied_objects(monkeypatch, 10)
+    assert copied_objects(monkeypatch, 1000) == small
+    # The copy is about the size of the template
+    template = box_front.get_helper_template(exp.__add__)
+    assert small < 4 * sum(1 for _ in ast.walk(template))
+
+### Optimize
+
+def test_dominators_of_a_branch_in_a_loop():
+    body = [
+        ir_Assign(target=ir_Name(id='a'), value=ir_Target(target=constant(1))),
+        ir_Label(name='loop'),
+        ir_Branch(condition=ir_Name(id='a'), true_label='then', false_label='done'),
+        ir_Label(name='then'),
+        ir_Branch(condition=ir_Name(id='a'), true_label='join', false_label='else'),
+        ir_Label(name='else'),
+        ir_Jump(label='join'),
+        ir_Label(name='join'),
+        ir_Jump(label='loop'),
+        ir_Label(name='done'),
+        ir_Return(value=ir_Name(id='a')),
+        # Unreachable, its edge into the loop does not count
+        ir_Label(name='dead'),
+        ir_Jump(label='loop'),
+    ]
+    cfg = CFG(ir_Function(name='f', args=[], body=body, return_type=ir_void, variables=set()))
+    block = {b.label: b.index for b in cfg.basic_blocks}
+    dominators = Dominators(cfg)
+    def dominated_by(label):
+        return {b for b in block if dominators.dominates(block[label], block[b])}
+    assert dominated_by(None) == {None, 'loop', 'then', 'else', 'join', 'done'}
+    assert dominated_by('loop') == {'loop', 'then', 'else', 'join', 'done'}
+    assert dominated_by('then') == {'then', 'else', 'join'}
+    assert dominated_by('else') == {'else'}
+    assert dominated_by('join') == {'join'}
+    assert dominated_by('dead') == set()
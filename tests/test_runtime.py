@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+'''
+Tests of the run-time system (runtime/) which the end to end tests of
+test_compiler.py cannot see in the output of a program: where the heap puts
+blocks, and when the buffered output is written.
+'''
+
+import os
+import select
+import subprocess
+import sys
+
+from test_compiler import root_dir, runtime_dir, runtime_lib
+
+compile_py = os.path.join(root_dir, 'src', 'pyyc', 'compile.py')
+
+read_timeout = 10
+
+def link(tmp_path, sources):
+    # type: (Path, List[str]) -> str
+    ''' Link C or assembly sources against the run-time library, returns the executable '''
+    exe = str(tmp_path / 'a.out')
+    subprocess.run(['gcc', '-g', '-I', runtime_dir] + sources + [runtime_lib, '-lm', '-o', exe],
+                   check=True, capture_output=True)
+    return exe
+
+### Allocation
+
+alloc_driver = r'''
+#include <stdio.h>
+#include <string.h>
+
+#include "alloc.h"
+
+#define CHECK(cond) \
+  do { if (!(cond)) { printf("line %d: %s\n", __LINE__, #cond); return 1; } } while (0)
+
+#define ARENA(p) ((unsigned long)(p) & ~(unsigned long)(ALLOC_ARENA_SIZE - 1))
+
+int main(void)
+{
+  size_t size;
+  int is_object;
+
+  /* A freed slot goes back to its own size class */
+  char* small = pyy_alloc(16);
+  pyy_free(small, 16);
+  char* medium = pyy_alloc(32);
+  CHECK(medium != small);
+  CHECK(ARENA(medium) != ARENA(small));
+  CHECK(pyy_alloc(16) == small);
+
+  /* Resizing to another size class moves the block and frees its slot */
+  memset(small, 7, 16);
+  char* moved = pyy_resize(small, 16, 48);
+  CHECK(moved != small);
+  CHECK(ARENA(moved) != ARENA(small));
+  CHECK(moved[0] == 7 && moved[15] == 7 && moved[16] == 0);
+  CHECK(pyy_block_of(moved, &size, &is_object) == moved && size == 64);
+  CHECK(pyy_block_of(small, &size, &is_object) == NULL);
+  /* The old slot is reused, zeroed */
+  char* reused = pyy_alloc(8);
+  CHECK(reused == small);
+  CHECK(reused[0] == 0);
+
+  /* Resizing within the size class keeps the block */
+  CHECK(pyy_resize(moved, 48, 64) == moved);
+  /* The 64 byte class has its own arena */
+  CHECK(ARENA(moved) != ARENA(medium));
+  return 0;
+}
+'''
+
+def test_arena_reuse_across_size_classes(build, tmp_path):
+    assert build is None, build
+    source = tmp_path / 'alloc_driver.c'
+    source.write_text(alloc_driver)
+    exe = link(tmp_path, [str(source)])
+    result = subprocess.run([exe], env=dict(os.environ, PYYC_GC='0'), capture_output=True, text=True, timeout=10)
+    assert result.returncode == 0, result.stdout
+
+### Output
+
+def test_output_is_flushed_before_input(build, tmp_path):
+    assert build is None, build
+    program = tmp_path / 'prompt.py'
+    program.write_text('print(1)\nx = eval(input())\nprint(x + 1)\n')
+    subprocess.run([sys.executable, compile_py, '--no-cache', str(program)], check=True, capture_output=True)
+    exe = link(tmp_path, [str(tmp_path / 'prompt.s')])
+    popen = subprocess.Popen([exe], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        # Through a pipe the output is not line buffered, only the read flushes the first line
+        (readable, _, _) = select.select([popen.stdout], [], [], read_timeout)
+        assert readable, 'the output before input() was not written'
+        assert popen.stdout.readline() == b'1\n'
+        (out, _) = popen.communicate(b'41\n', timeout=read_timeout)
+    finally:
+        popen.kill()
+        popen.wait()
+    assert out == b'42\n'